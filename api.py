@@ -0,0 +1,329 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import uuid
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from shared_backend.startup import print_report, start_profiling
+
+# Must run before the imports below for them to show up in the STARTUP_PROFILE report
+start_profiling()
+
+from aiohttp import web
+from dotenv import load_dotenv
+
+from sales_backend.chat import create_chat_session as create_sales_chat
+from services_backend.chat import create_chat_session as create_services_chat
+from services_backend.bigquery import query_stats_summary
+from shared_backend.flows import run_sales_turn, run_services_turn
+from shared_backend.hedging import hedging_stats
+from shared_backend.idempotency import submission_stats
+from shared_backend.prompt_cache import prompt_cache_stats
+from shared_backend.scheduler import GEMINI_MAX_CONCURRENCY, scheduler_stats
+from shared_backend.sessions import SessionManager, get_session_manager
+from shared_backend.tracing import trace_turn
+
+load_dotenv()
+
+API_HOST = os.getenv("API_HOST", "0.0.0.0")
+API_PORT = int(os.getenv("API_PORT", "8080"))
+# Turns run on worker threads (the Gemini, BigQuery and webhook clients are blocking); this bounds how many at once.
+# A streamed turn holds its thread until the reply is complete. Gemini requests are further capped at
+# GEMINI_MAX_CONCURRENCY per model by the quota scheduler, so threads beyond that wait for quota or run tools
+API_MAX_WORKERS = int(os.getenv("API_MAX_WORKERS", "64"))
+# Turns allowed to wait for a free worker; beyond that new turns get 503 with Retry-After instead of queueing
+API_MAX_QUEUED_TURNS = int(os.getenv("API_MAX_QUEUED_TURNS", "16"))
+API_RETRY_AFTER_SECONDS = int(os.getenv("API_RETRY_AFTER_SECONDS", "5"))
+# Session store lookups get their own threads so they never wait behind queued turns
+API_STORE_WORKERS = 4
+# Comma separated origins allowed to call the API from a browser, e.g. the website widget; "*" allows any
+API_ALLOWED_ORIGINS = [origin.strip() for origin in os.getenv("API_ALLOWED_ORIGINS", "").split(",") if origin.strip()]
+
+BOTS = ("sales", "services")
+SALES_MODES = ("local", "rag", "search")
+
+
+class TurnLimiter:
+    """Counts turns running on or waiting for a worker thread; only used on the event loop, so it needs no lock"""
+
+    def __init__(self, max_workers: int, max_queued: int):
+        self.max_workers = max_workers
+        self.limit = max_workers + max_queued
+        self.active = 0
+        self.rejected = 0
+
+    @contextlib.contextmanager
+    def admit(self):
+        """Hold a turn place for the enclosed work; raises 503 with Retry-After when every place is taken"""
+        if self.active >= self.limit:
+            self.rejected += 1
+            raise web.HTTPServiceUnavailable(
+                text=json.dumps({"error": "Too many conversations in progress, please retry shortly"}),
+                content_type="application/json",
+                headers={"Retry-After": str(API_RETRY_AFTER_SECONDS)},
+            )
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+
+    def stats(self) -> dict:
+        return {
+            "running": min(self.active, self.max_workers),
+            "queued": max(0, self.active - self.max_workers),
+            "limit": self.limit,
+            "rejected": self.rejected,
+        }
+
+
+sessions_key = web.AppKey("sessions", SessionManager)
+executor_key = web.AppKey("executor", ThreadPoolExecutor)
+store_executor_key = web.AppKey("store_executor", ThreadPoolExecutor)
+turns_key = web.AppKey("turns", TurnLimiter)
+# One lock per session so its turns run one at a time; entries disappear once no request holds them
+locks_key = web.AppKey("locks", weakref.WeakValueDictionary)
+
+
+def default_sales_mode() -> str:
+    """Pick the sales grounding the same way the Streamlit app does: local index, then Vertex RAG, then search"""
+    if os.getenv("LOCAL_RAG_INDEX_DIR"):
+        return "local"
+    if os.getenv("PROJECT_ID") and os.getenv("LOCATION") and os.getenv("CORPUS_ID"):
+        return "rag"
+    return "search"
+
+
+def create_chat(bot: str, mode: str = None, history: list = None):
+    """Build a chat session for bot from server-side credentials"""
+    if bot == "services":
+        return create_services_chat(api_key=os.getenv("GEMINI_API_KEY"), history=history)
+    mode = mode or default_sales_mode()
+    if mode == "local":
+        return create_sales_chat(rag=True, api_key=os.getenv("GEMINI_API_KEY"), local_index_dir=os.getenv("LOCAL_RAG_INDEX_DIR"), history=history)
+    if mode == "rag":
+        return create_sales_chat(rag=True, project_id=os.getenv("PROJECT_ID"), location=os.getenv("LOCATION"), corpus_id=os.getenv("CORPUS_ID"), history=history)
+    return create_sales_chat(rag=False, api_key=os.getenv("GEMINI_API_KEY"), history=history)
+
+
+def open_chat(manager: SessionManager, session_id: str, bot: str, settings: dict):
+    """Return the live chat for a session, rebuilding it from the stored history if it was evicted"""
+    return manager.get(session_id, lambda history: create_chat(bot, settings.get("mode"), history), bot, settings)
+
+
+def run_turn(manager: SessionManager, info: dict, message: str, on_chunk=None):
+    """Run one turn on a worker thread inside its own trace and persist it"""
+    session_id, bot = info["session_id"], info["bot"]
+    chat_session = open_chat(manager, session_id, bot, info["settings"])
+    manager.store.append_message(session_id, "user", message)
+    with trace_turn(session_id, bot, transport="api"):
+        if bot == "sales":
+            result = run_sales_turn(chat_session, message, on_chunk=on_chunk)
+        else:
+            result = run_services_turn(chat_session, message, on_chunk=on_chunk)
+    manager.store.append_message(session_id, "assistant", result.text)
+    manager.save(session_id, chat_session)
+    return result
+
+
+def error_response(status: int, message: str):
+    return web.json_response({"error": message}, status=status)
+
+
+async def read_json(request) -> dict:
+    try:
+        body = await request.json()
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        raise web.HTTPBadRequest(text=json.dumps({"error": "Body must be JSON"}), content_type="application/json")
+    if not isinstance(body, dict):
+        raise web.HTTPBadRequest(text=json.dumps({"error": "Body must be a JSON object"}), content_type="application/json")
+    return body
+
+
+async def run_blocking(request, func, *args):
+    """Run a blocking call (SQLite, Gemini, BigQuery) on the worker pool"""
+    return await asyncio.get_running_loop().run_in_executor(request.app[executor_key], func, *args)
+
+
+async def run_store(request, func, *args):
+    """Run a session store call (SQLite only) on the store pool"""
+    return await asyncio.get_running_loop().run_in_executor(request.app[store_executor_key], func, *args)
+
+
+async def get_session(request) -> dict:
+    info = await run_store(request, request.app[sessions_key].store.info, request.match_info["session_id"])
+    if info is None:
+        raise web.HTTPNotFound(text=json.dumps({"error": "Unknown session"}), content_type="application/json")
+    return info
+
+
+def session_lock(request, session_id: str) -> asyncio.Lock:
+    locks = request.app[locks_key]
+    lock = locks.get(session_id)
+    if lock is None:
+        lock = locks[session_id] = asyncio.Lock()
+    return lock
+
+
+async def read_message(request) -> str:
+    message = (await read_json(request)).get("message")
+    if not isinstance(message, str) or not message.strip():
+        raise web.HTTPBadRequest(text=json.dumps({"error": "message is required"}), content_type="application/json")
+    return message
+
+
+# Handlers
+
+
+async def create_session(request):
+    body = await read_json(request) if request.can_read_body else {}
+    bot = body.get("bot", "sales")
+    mode = body.get("mode")
+    if bot not in BOTS:
+        return error_response(400, f"bot must be one of {', '.join(BOTS)}")
+    if mode is not None and (bot != "sales" or mode not in SALES_MODES):
+        return error_response(400, f"mode applies to the sales bot and must be one of {', '.join(SALES_MODES)}")
+
+    session_id = uuid.uuid4().hex
+    settings = {"mode": mode or default_sales_mode()} if bot == "sales" else {}
+    try:
+        with request.app[turns_key].admit():
+            await run_blocking(request, open_chat, request.app[sessions_key], session_id, bot, settings)
+    except web.HTTPServiceUnavailable:
+        raise
+    except Exception as e:
+        return error_response(503, f"Could not create chat session: {e}")
+    return web.json_response({"session_id": session_id, "bot": bot}, status=201)
+
+
+async def get_session_messages(request):
+    info = await get_session(request)
+    limit = request.query.get("limit")
+    before = request.query.get("before")
+    messages = await run_store(
+        request, request.app[sessions_key].store.messages, info["session_id"],
+        int(limit) if limit and limit.isdigit() else None, int(before) if before and before.isdigit() else None,
+    )
+    return web.json_response({"session_id": info["session_id"], "bot": info["bot"], "messages": messages})
+
+
+async def delete_session(request):
+    info = await get_session(request)
+    await run_store(request, request.app[sessions_key].delete, info["session_id"])
+    return web.json_response({"deleted": True})
+
+
+async def send_message(request):
+    info = await get_session(request)
+    message = await read_message(request)
+    with request.app[turns_key].admit():
+        async with session_lock(request, info["session_id"]):
+            try:
+                result = await run_blocking(request, run_turn, request.app[sessions_key], info, message)
+            except Exception as e:
+                return error_response(502, str(e))
+    return web.json_response({"reply": result.text, "json": result.json, "notices": result.notices})
+
+
+async def send_message_stream(request):
+    """Stream the reply as server-sent events: chunk events with text deltas, then done or error"""
+    info = await get_session(request)
+    message = await read_message(request)
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    sent = 0
+
+    def on_chunk(text_so_far: str):
+        # Called on the worker thread; hand each delta to the event loop
+        nonlocal sent
+        delta, sent = text_so_far[sent:], len(text_so_far)
+        loop.call_soon_threadsafe(queue.put_nowait, ("chunk", {"text": delta}))
+
+    # Admitted before the response starts, so a busy server can still answer 503
+    with request.app[turns_key].admit():
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+
+        async with session_lock(request, info["session_id"]):
+            turn = loop.run_in_executor(request.app[executor_key], run_turn, request.app[sessions_key], info, message, on_chunk)
+            turn.add_done_callback(lambda _: queue.put_nowait(None))
+            try:
+                while (event := await queue.get()) is not None:
+                    await response.write(format_event(*event))
+                result = await turn
+                await response.write(format_event("done", {"json": result.json, "notices": result.notices}))
+            except ConnectionResetError:
+                # The customer left; the turn still finishes and is stored so the conversation stays consistent
+                with contextlib.suppress(Exception):
+                    await turn
+                return response
+            except Exception as e:
+                await response.write(format_event("error", {"error": str(e)}))
+    await response.write_eof()
+    return response
+
+
+def format_event(event: str, data: dict) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode("utf-8")
+
+
+async def health(request):
+    return web.json_response({"status": "ok", "sessions": request.app[sessions_key].stats(), "turns": request.app[turns_key].stats(), "gemini_quota": scheduler_stats(), "grounding": hedging_stats(), "bigquery": query_stats_summary(), "submissions": submission_stats(), "prompt_cache": prompt_cache_stats()})
+
+
+@web.middleware
+async def cors_middleware(request, handler):
+    origin = request.headers.get("Origin")
+    allowed = origin and ("*" in API_ALLOWED_ORIGINS or origin in API_ALLOWED_ORIGINS)
+    if request.method == "OPTIONS" and allowed:
+        response = web.Response()
+    else:
+        response = await handler(request)
+    if allowed:
+        response.headers["Access-Control-Allow-Origin"] = origin
+        response.headers["Access-Control-Allow-Methods"] = "GET, POST, DELETE, OPTIONS"
+        response.headers["Access-Control-Allow-Headers"] = "Content-Type"
+        response.headers["Vary"] = "Origin"
+    return response
+
+
+async def close_executor(app):
+    app[executor_key].shutdown(wait=False, cancel_futures=True)
+    app[store_executor_key].shutdown(wait=False, cancel_futures=True)
+
+
+def create_app(max_workers: int = API_MAX_WORKERS, max_queued_turns: int = API_MAX_QUEUED_TURNS) -> web.Application:
+    if max_workers < GEMINI_MAX_CONCURRENCY:
+        print(f"API_MAX_WORKERS={max_workers} is below GEMINI_MAX_CONCURRENCY={GEMINI_MAX_CONCURRENCY}; the Gemini quota can't be used fully")
+    app = web.Application(middlewares=[cors_middleware])
+    app[sessions_key] = get_session_manager()
+    app[locks_key] = weakref.WeakValueDictionary()
+    app[executor_key] = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="api-turn")
+    app[store_executor_key] = ThreadPoolExecutor(max_workers=API_STORE_WORKERS, thread_name_prefix="api-store")
+    app[turns_key] = TurnLimiter(max_workers, max_queued_turns)
+    app.on_cleanup.append(close_executor)
+    app.router.add_get("/healthz", health)
+    app.router.add_post("/sessions", create_session)
+    app.router.add_get("/sessions/{session_id}", get_session_messages)
+    app.router.add_delete("/sessions/{session_id}", delete_session)
+    app.router.add_post("/sessions/{session_id}/messages", send_message)
+    app.router.add_post("/sessions/{session_id}/messages/stream", send_message_stream)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP API for the sales and services agents")
+    parser.add_argument("--host", default=API_HOST)
+    parser.add_argument("--port", type=int, default=API_PORT)
+    parser.add_argument("--max-workers", type=int, default=API_MAX_WORKERS)
+    parser.add_argument("--max-queued-turns", type=int, default=API_MAX_QUEUED_TURNS)
+    args = parser.parse_args()
+    print_report()
+    web.run_app(create_app(args.max_workers, args.max_queued_turns), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
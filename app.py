@@ -1,15 +1,33 @@
 import streamlit as st
 import sys
 import os
-from sales_backend.chat import create_chat_session as create_sales_chat, query_llm as query_sales_llm, extract_json_from_response as sales_extract_json_from_response, create_opportunity
-from services_backend.chat import create_chat_session as create_services_chat, query_llm as query_services_llm, extract_json_from_response as services_extract_json_from_response, create_case
-from services_backend.bigquery import run_recent_jobs_query
+from shared_backend.startup import print_report, start_profiling
+
+# Must run before the imports below for them to show up in the STARTUP_PROFILE report
+start_profiling()
+
+from sales_backend.chat import create_chat_session as create_sales_chat
+from services_backend.chat import create_chat_session as create_services_chat
+from shared_backend.flows import run_sales_turn, run_services_turn
+from shared_backend.prompt_cache import prompt_cache_stats
+from shared_backend.scheduler import scheduler_stats
+from shared_backend.sessions import get_session_manager
+from shared_backend.tracing import recent_turns, span, span_percentiles, trace_turn
 from dotenv import load_dotenv
 from datetime import datetime
 import hashlib
+import uuid
 
 # Load environment variables
 load_dotenv()
+print_report()
+
+# Older messages are shown this many at a time, behind a "Show earlier messages" button
+CHAT_HISTORY_PAGE_SIZE = int(os.getenv("CHAT_HISTORY_PAGE_SIZE", "20"))
+# Messages the chat fragment redraws on each turn before they are handed to the history fragment
+CHAT_LIVE_MESSAGES = int(os.getenv("CHAT_LIVE_MESSAGES", "10"))
+
+AGENT_AVATAR = "https://media.licdn.com/dms/image/v2/C5603AQFQKW-lOyNbOA/profile-displayphoto-shrink_800_800/profile-displayphoto-shrink_800_800/0/1516317569754?e=1756944000&v=beta&t=sTMOjNLrt7zCJhySpVUE1eoXLH0lXm2ZaLbd_7JIuVw"
 
 # Page configuration
 st.set_page_config(
@@ -32,9 +50,25 @@ def get_user_avatar():
     avatar_url = f"https://api.dicebear.com/9.x/personas/svg?seed={st.session_state.user_avatar_seed}&size=64&backgroundColor=f0f0f0"
     return avatar_url 
 
+# Conversations are stored server-side; live chats are kept in a bounded LRU and rebuilt from the store
+session_manager = get_session_manager()
+
+def start_new_conversation():
+    """Start a fresh conversation under a new session id; the old one stays in the store"""
+    session_manager.discard(st.session_state.session_id)
+    st.session_state.session_id = uuid.uuid4().hex
+    st.session_state.history_pages = 1
+    st.query_params["sid"] = st.session_state.session_id
+
 # Initialize session state
-if "messages" not in st.session_state:
-    st.session_state.messages = []
+# The session id lives in the URL so a returning customer picks up their stored conversation
+if "session_id" not in st.session_state:
+    st.session_state.session_id = st.query_params.get("sid") or uuid.uuid4().hex
+    st.query_params["sid"] = st.session_state.session_id
+    stored_session = session_manager.store.info(st.session_state.session_id)
+    if stored_session:
+        st.session_state.chatbot_type = stored_session["bot"]
+        st.session_state.use_rag = stored_session["settings"].get("mode", "search") != "search"
 if "api_key" not in st.session_state:
     st.session_state.api_key = os.getenv("GEMINI_API_KEY", "")
 if "is_typing" not in st.session_state:
@@ -47,8 +81,14 @@ if "location" not in st.session_state:
     st.session_state.location = os.getenv("LOCATION", "")
 if "corpus_id" not in st.session_state:
     st.session_state.corpus_id = os.getenv("CORPUS_ID", "")
+if "local_index_dir" not in st.session_state:
+    st.session_state.local_index_dir = os.getenv("LOCAL_RAG_INDEX_DIR", "")
 if "chatbot_type" not in st.session_state:
     st.session_state.chatbot_type = "sales"
+if "model_route" not in st.session_state:
+    st.session_state.model_route = "auto"
+if "history_pages" not in st.session_state:
+    st.session_state.history_pages = 1
 
 # Add styles
 st.markdown(
@@ -151,6 +191,45 @@ st.markdown(
     unsafe_allow_html=True
 )
 
+# Refreshed with its own button, so looking at it doesn't rerun the chat
+@st.fragment
+def render_diagnostics():
+    with st.expander("Diagnostics"):
+        turns = recent_turns(st.session_state.session_id, limit=5)
+        if turns:
+            st.markdown("**Recent turns (ms):**")
+            st.dataframe([
+                dict({"time": datetime.fromtimestamp(turn["started_at"]).strftime("%H:%M:%S"), "total": round(turn["total_ms"])},
+                     **{stage: round(ms) for stage, ms in turn["stages"].items()})
+                for turn in turns
+            ], hide_index=True)
+        else:
+            st.caption("No turns yet in this session")
+        percentiles = span_percentiles(st.session_state.chatbot_type)
+        if percentiles:
+            st.markdown("**Rolling percentiles (ms):**")
+            st.dataframe([dict({"span": name}, **stats) for name, stats in percentiles.items()], hide_index=True)
+        quotas = scheduler_stats()
+        if quotas:
+            st.markdown("**Gemini quota (queue wait, ms):**")
+            st.dataframe([
+                {
+                    "quota": owner, "model": model, "priority": priority, "admitted": stats["admitted"], "shed": stats["shed"],
+                    "queued": stats["queued"], "p50": round(waits["p50"] * 1000), "p95": round(waits["p95"] * 1000),
+                }
+                for owner, models in quotas.items()
+                for model, stats in models.items()
+                for priority, waits in stats["queue_wait"].items()
+            ], hide_index=True)
+        prompt_cache = prompt_cache_stats()
+        if prompt_cache["hits"] or prompt_cache["misses"]:
+            st.markdown("**Prompt cache:**")
+            st.caption(
+                f"{prompt_cache['hits']} hits, {prompt_cache['misses']} misses ({prompt_cache['hit_rate']:.0%}), "
+                f"{prompt_cache['cached_tokens']} prompt tokens served from cache, {prompt_cache['failures']} failed creates"
+            )
+        st.button("Refresh", key="refresh_diagnostics")
+
 # Sidebar with settings
 with st.sidebar:
     st.title("Settings")
@@ -167,11 +246,8 @@ with st.sidebar:
     # Check if chatbot type changed
     if chatbot_type != st.session_state.chatbot_type:
         st.session_state.chatbot_type = chatbot_type
-        # Clear chat session to force recreation
-        if "chat_session" in st.session_state:
-            del st.session_state.chat_session
-        # Clear messages when switching modes
-        st.session_state.messages = []
+        # Switching modes starts a new conversation
+        start_new_conversation()
         st.rerun()
     
     st.markdown("---")
@@ -189,11 +265,8 @@ with st.sidebar:
     # Check if RAG setting changed
     if use_rag != st.session_state.use_rag:
         st.session_state.use_rag = use_rag
-        # Clear chat session to force recreation
-        if "chat_session" in st.session_state:
-            del st.session_state.chat_session
-        # Clear messages when switching modes
-        st.session_state.messages = []
+        # Switching modes starts a new conversation
+        start_new_conversation()
         st.rerun()
     
     # API Key input (always visible)
@@ -202,8 +275,17 @@ with st.sidebar:
                            help="Get your API key from [Google AI Studio](https://makersuite.google.com/app/apikey)")
     if api_key != st.session_state.api_key:
         st.session_state.api_key = api_key
-        if "chat_session" in st.session_state:
-            del st.session_state.chat_session
+        # Rebuilt from the stored history with the new settings on the next turn
+        session_manager.discard(st.session_state.session_id)
+
+    # Model routing override
+    st.session_state.model_route = st.selectbox(
+        "Model",
+        options=["auto", "fast", "pro"],
+        index=["auto", "fast", "pro"].index(st.session_state.model_route),
+        format_func=lambda x: {"auto": "Auto (route per turn)", "fast": "Always Flash", "pro": "Always Pro"}[x],
+        help="Auto sends short slot-filling turns to the fast model and everything else to the pro model"
+    )
 
     if use_rag:
         st.markdown("**RAG Settings (Vertex AI):**")
@@ -212,31 +294,42 @@ with st.sidebar:
                                   help="Google Cloud Project ID")
         if project_id != st.session_state.project_id:
             st.session_state.project_id = project_id
-            if "chat_session" in st.session_state:
-                del st.session_state.chat_session
+            # Rebuilt from the stored history with the new settings on the next turn
+            session_manager.discard(st.session_state.session_id)
         
         # Location input
         location = st.text_input("Location", value=st.session_state.location, type="password",
                                 help="Google Cloud Location (e.g., us-central1)")
         if location != st.session_state.location:
             st.session_state.location = location
-            if "chat_session" in st.session_state:
-                del st.session_state.chat_session
+            # Rebuilt from the stored history with the new settings on the next turn
+            session_manager.discard(st.session_state.session_id)
         
         # Corpus ID input
         corpus_id = st.text_input("Corpus ID", value=st.session_state.corpus_id, type="password",
                                  help="RAG Corpus ID")
         if corpus_id != st.session_state.corpus_id:
             st.session_state.corpus_id = corpus_id
-            if "chat_session" in st.session_state:
-                del st.session_state.chat_session
+            # Rebuilt from the stored history with the new settings on the next turn
+            session_manager.discard(st.session_state.session_id)
+
+        # Local index input
+        local_index_dir = st.text_input("Local Index Directory", value=st.session_state.local_index_dir,
+                                       help="Retrieve from a local vector index instead of the Vertex AI corpus (uses the Gemini API key)")
+        if local_index_dir != st.session_state.local_index_dir:
+            st.session_state.local_index_dir = local_index_dir
+            # Rebuilt from the stored history with the new settings on the next turn
+            session_manager.discard(st.session_state.session_id)
     else:
         st.markdown("**Google Search Settings:**")
     
     # Clear chat button
     if st.button("Clear Chat", type="primary"):
-        st.session_state.messages = []
+        start_new_conversation()
         st.rerun()
+
+    # Where the time went in recent turns of this session, plus rolling percentiles for this bot
+    render_diagnostics()
     
     st.markdown("---")
     st.markdown("**Instructions:**")
@@ -301,7 +394,11 @@ else:
 # Chat interface
 # Check if we have the required credentials
 can_chat = False
-if st.session_state.use_rag:
+if st.session_state.use_rag and st.session_state.local_index_dir:
+    can_chat = bool(st.session_state.api_key)
+    if not can_chat:
+        st.info("👈 Please enter your Gemini API key in the sidebar to start chatting with the local index")
+elif st.session_state.use_rag:
     can_chat = bool(st.session_state.project_id and st.session_state.location and st.session_state.corpus_id)
     if not can_chat:
         st.info("👈 Please enter your Vertex AI credentials in the sidebar to start chatting with RAG")
@@ -311,107 +408,132 @@ else:
     if not can_chat:
         st.info("👈 Please enter your Gemini API key in the sidebar to start chatting")
 
-if can_chat:
-    try:
-        # Initialize chat session if needed
-        if "chat_session" not in st.session_state:
-            if st.session_state.chatbot_type == "sales":
-                if st.session_state.use_rag:
-                    st.session_state.chat_session = create_sales_chat(
-                        rag=True,
-                        project_id=st.session_state.project_id,
-                        location=st.session_state.location,
-                        corpus_id=st.session_state.corpus_id
-                    )
-                else:
-                    st.session_state.chat_session = create_sales_chat(
-                        rag=False,
-                        api_key=st.session_state.api_key
-                    )
-            else:
-                # Services chatbot
-                st.session_state.chat_session = create_services_chat(
-                    api_key=st.session_state.api_key
-                )
-        
-        # Display chat messages using native Streamlit components
-        for message in st.session_state.messages:
-            # Keep agent avatar the same, use DiceBear for user avatar
-            if message["role"] == "assistant":
-                avatar = "https://media.licdn.com/dms/image/v2/C5603AQFQKW-lOyNbOA/profile-displayphoto-shrink_800_800/profile-displayphoto-shrink_800_800/0/1516317569754?e=1756944000&v=beta&t=sTMOjNLrt7zCJhySpVUE1eoXLH0lXm2ZaLbd_7JIuVw"
-            else:
-                avatar = get_user_avatar()
-            
-            with st.chat_message(message["role"], avatar=avatar):
-                if message["role"] == "assistant" and st.session_state.is_typing:
-                    st.markdown('<div class="typing-animation">Typing</div>', unsafe_allow_html=True)
-                else:
-                    st.write(message["content"])
-                    if "timestamp" in message:
-                        st.markdown(f'<div class="message-timestamp">{message["timestamp"]}</div>', unsafe_allow_html=True)
-
-
-        # Chat input
-        placeholder_text = "How can I help you with your 3D printing needs?" if st.session_state.chatbot_type == "sales" else "What seems to be the problem with your device today?"
-        if prompt := st.chat_input(placeholder_text):
-            
-            timestamp = datetime.now().strftime("%I:%M %p")
-            st.session_state.messages.append({
-                "role": "user",
-                "content": prompt,
-                "timestamp": timestamp
-            })
-            
-            with st.chat_message("user", avatar=get_user_avatar()):
-                st.write(prompt)
-                st.markdown(f'<div class="message-timestamp">{timestamp}</div>', unsafe_allow_html=True)
-            
-            with st.chat_message("assistant", avatar="https://media.licdn.com/dms/image/v2/C5603AQFQKW-lOyNbOA/profile-displayphoto-shrink_800_800/profile-displayphoto-shrink_800_800/0/1516317569754?e=1756944000&v=beta&t=sTMOjNLrt7zCJhySpVUE1eoXLH0lXm2ZaLbd_7JIuVw"):
-                message_placeholder = st.empty()
-                st.session_state.is_typing = True
-                message_placeholder.markdown('<div class="typing-animation">Typing</div>', unsafe_allow_html=True)
-                
-                try:
+# Build the chat session, continuing the stored history if this conversation already has one
+def build_chat(history):
+    if st.session_state.chatbot_type == "sales":
+        if st.session_state.use_rag and st.session_state.local_index_dir:
+            return create_sales_chat(
+                rag=True,
+                api_key=st.session_state.api_key,
+                local_index_dir=st.session_state.local_index_dir,
+                history=history
+            )
+        elif st.session_state.use_rag:
+            return create_sales_chat(
+                rag=True,
+                project_id=st.session_state.project_id,
+                location=st.session_state.location,
+                corpus_id=st.session_state.corpus_id,
+                api_key=st.session_state.api_key,
+                history=history
+            )
+        else:
+            return create_sales_chat(
+                rag=False,
+                api_key=st.session_state.api_key,
+                history=history
+            )
+    else:
+        # Services chatbot
+        return create_services_chat(
+            api_key=st.session_state.api_key,
+            history=history
+        )
+
+def chat_settings():
+    if st.session_state.chatbot_type == "sales":
+        return {"mode": "local" if st.session_state.local_index_dir else "rag"} if st.session_state.use_rag else {"mode": "search"}
+    return {}
+
+def render_message(message, user_avatar):
+    with st.chat_message(message["role"], avatar=AGENT_AVATAR if message["role"] == "assistant" else user_avatar):
+        st.write(message["content"])
+        if message.get("timestamp"):
+            st.markdown(f'<div class="message-timestamp">{message["timestamp"]}</div>', unsafe_allow_html=True)
+
+def show_earlier_messages():
+    st.session_state.history_pages += 1
+
+# Messages up to the anchor are drawn by the history fragment, which only reruns on a full page run
+# or when the customer asks for earlier messages; newer ones belong to the chat fragment
+@st.fragment
+def render_history():
+    anchor = st.session_state.history_anchor
+    if anchor is None:
+        return
+    shown = st.session_state.history_pages * CHAT_HISTORY_PAGE_SIZE
+    messages = session_manager.store.messages(st.session_state.session_id, limit=shown + 1, before_id=anchor + 1)
+    if len(messages) > shown:
+        messages = messages[1:]
+        st.button("Show earlier messages", key="show_earlier_messages", on_click=show_earlier_messages)
+    user_avatar = get_user_avatar()
+    for message in messages:
+        render_message(message, user_avatar)
+
+# Each turn reruns only this fragment: the messages sent since the last full run, then the new exchange
+@st.fragment
+def render_chat():
+    user_avatar = get_user_avatar()
+    live_messages = session_manager.store.messages(st.session_state.session_id, after_id=st.session_state.history_anchor)
+    for message in live_messages:
+        render_message(message, user_avatar)
+
+    # Chat input
+    placeholder_text = "How can I help you with your 3D printing needs?" if st.session_state.chatbot_type == "sales" else "What seems to be the problem with your device today?"
+    if prompt := st.chat_input(placeholder_text):
+        try:
+            # The chat (and the SDKs behind it) is only built once there is a message to send
+            chat_session = session_manager.get(st.session_state.session_id, build_chat, st.session_state.chatbot_type, chat_settings())
+            chat_session.set_override(None if st.session_state.model_route == "auto" else st.session_state.model_route)
+        except Exception as e:
+            st.error(f"Error: {str(e)}")
+            session_manager.discard(st.session_state.session_id)
+            return
+
+        prompt_timestamp = datetime.now().strftime("%I:%M %p")
+
+        with st.chat_message("user", avatar=user_avatar):
+            st.write(prompt)
+            st.markdown(f'<div class="message-timestamp">{prompt_timestamp}</div>', unsafe_allow_html=True)
+
+        with st.chat_message("assistant", avatar=AGENT_AVATAR):
+            message_placeholder = st.empty()
+            st.session_state.is_typing = True
+            message_placeholder.markdown('<div class="typing-animation">Typing</div>', unsafe_allow_html=True)
+
+            try:
+                with trace_turn(st.session_state.session_id, st.session_state.chatbot_type) as turn_span:
+                    # Streamed chunks are rendered as they arrive; follow-up actions run on the finished text
+                    render_chunk = lambda text: message_placeholder.write(text + "▌")
                     if st.session_state.chatbot_type == "sales":
-                        response = query_sales_llm(st.session_state.chat_session, prompt)
-                        json_response = sales_extract_json_from_response(response.text)
-                        if json_response:
-                            create_opportunity(json_response)
-                            if json_response.get('is_qualified') == 'Yes':
-                                st.markdown("Ok we have everything we need. A sales rep will get back to you")
-                            else:
-                                st.markdown("Thank you for your inquiry. Please visit our website for any future purchases")
+                        result = run_sales_turn(chat_session, prompt, on_chunk=render_chunk)
                     else:
-                        response = query_services_llm(st.session_state.chat_session, prompt)
-                        json_response = services_extract_json_from_response(response.text)
-                        if json_response:
-                            if json_response.get('job_name'):
-                                create_case(json_response)
-                                print('creating case')
-                            elif json_response.get('printer_serial'):
-                                print("I have the serial")
-                                printer_serial = json_response.get('printer_serial')
-                                print(printer_serial)
-                                full_jobs, jobs_to_display = run_recent_jobs_query(printer_serial)
-                                print(jobs_to_display)
-                                if jobs_to_display == 'No jobs found':
-                                    st.markdown("It does not appear that we have logs for your printer. Can you please upload them?")
-                                else:
-                                    st.markdown("Are these any of your prints?\n\n" + jobs_to_display)
-                    timestamp = datetime.now().strftime("%I:%M %p")
-                    st.session_state.is_typing = False
-                    message_placeholder.write(response.text)
-                    st.markdown(f'<div class="message-timestamp">{timestamp}</div>', unsafe_allow_html=True)
-                    st.session_state.messages.append({
-                        "role": "assistant",
-                        "content": response.text,
-                        "timestamp": timestamp
-                    })
-                except Exception as e:
-                    st.session_state.is_typing = False
-                    message_placeholder.error(f"Error: {str(e)}")
-
-    except Exception as e:
-        st.error(f"Error: {str(e)}")
-        if "chat_session" in st.session_state:
-            del st.session_state.chat_session 
\ No newline at end of file
+                        result = run_services_turn(chat_session, prompt, on_chunk=render_chunk)
+                    turn_span.set("stream_render_ms", round(result.timings["render"] * 1000, 3))
+                    with span("render", notices=len(result.notices)):
+                        for notice in result.notices:
+                            st.markdown(notice)
+                        response_text = result.text
+                        timestamp = datetime.now().strftime("%I:%M %p")
+                        st.session_state.is_typing = False
+                        message_placeholder.write(response_text)
+                        st.markdown(f'<div class="message-timestamp">{timestamp}</div>', unsafe_allow_html=True)
+                # The message is logged with its reply, so a failed turn leaves no unanswered message behind
+                session_manager.store.append_message(st.session_state.session_id, "user", prompt, prompt_timestamp)
+                session_manager.store.append_message(st.session_state.session_id, "assistant", response_text, timestamp)
+                session_manager.save(st.session_state.session_id, chat_session)
+            except Exception as e:
+                st.session_state.is_typing = False
+                message_placeholder.error(f"Error: {str(e)}")
+                return
+
+        # Hand the piled-up messages over to the history fragment so this one stays small
+        if len(live_messages) + 2 >= CHAT_LIVE_MESSAGES:
+            st.rerun()
+
+if can_chat:
+    # Everything up to here is the last message the history fragment draws
+    latest = session_manager.store.messages(st.session_state.session_id, limit=1)
+    st.session_state.history_anchor = latest[-1]["id"] if latest else None
+    render_history()
+    render_chat()
@@ -0,0 +1,186 @@
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from google.genai import types
+
+
+def lead_json_block(data: dict) -> str:
+    """Wrap a payload the way the agents emit it: a fenced json block"""
+    return f"```json\n{json.dumps(data, indent=2)}\n```"
+
+
+class FakeUsage:
+    def __init__(self, prompt_token_count: int, candidates_token_count: int):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+
+
+class FakeChunk:
+    def __init__(self, text: str, usage_metadata=None):
+        self.text = text
+        self.usage_metadata = usage_metadata
+
+
+class FakeChatSession:
+    """
+    Stands in for a Gemini chat: replies come from a script, one per turn, and are streamed
+    after first_token_latency seconds at tokens_per_second (about 4 characters per token).
+    Latencies are jittered by +/- jitter (a fraction) with a seeded RNG so runs are repeatable.
+    """
+
+    def __init__(self, script: list, first_token_latency: float = 0.8, tokens_per_second: float = 80.0,
+                 jitter: float = 0.25, chunk_tokens: int = 8, seed: int = None,
+                 answer_cache_namespace: str = "default", history: list = None):
+        self.script = list(script)
+        self.first_token_latency = first_token_latency
+        self.tokens_per_second = tokens_per_second
+        self.jitter = jitter
+        self.chunk_tokens = chunk_tokens
+        self.answer_cache_namespace = answer_cache_namespace
+        self.history = list(history or [])
+        self.last_route = None
+        self._random = random.Random(seed)
+
+    def _jittered(self, seconds: float) -> float:
+        return max(0.0, seconds * (1 + self._random.uniform(-self.jitter, self.jitter)))
+
+    def _next_reply(self) -> str:
+        turn = sum(1 for content in self.history if content.role == "user")
+        return self.script[min(turn, len(self.script) - 1)]
+
+    def send_message_stream(self, message: str, **kwargs):
+        reply = self._next_reply()
+        time.sleep(self._jittered(self.first_token_latency))
+        chunk_chars = self.chunk_tokens * 4
+        chunks = [reply[i:i + chunk_chars] for i in range(0, len(reply), chunk_chars)] or [""]
+        usage = FakeUsage(sum(len(content.parts[0].text) for content in self.history) // 4 + len(message) // 4, len(reply) // 4)
+        for i, text in enumerate(chunks):
+            if i:
+                time.sleep(self._jittered(self.chunk_tokens / self.tokens_per_second))
+            yield FakeChunk(text, usage if i == len(chunks) - 1 else None)
+        self.history += [
+            types.Content(role="user", parts=[types.Part.from_text(text=message)]),
+            types.Content(role="model", parts=[types.Part.from_text(text=reply)]),
+        ]
+
+    def send_message(self, message: str, **kwargs):
+        reply = "".join(chunk.text for chunk in self.send_message_stream(message))
+        return FakeChunk(reply)
+
+    def get_history(self, curated: bool = False):
+        return list(self.history)
+
+    def record_history(self, user_input, model_output, automatic_function_calling_history, is_valid):
+        self.history += [user_input] + list(model_output)
+
+    def set_override(self, route: str = None):
+        pass
+
+
+class FakeQueryJob:
+    def __init__(self, rows: list, latency: float, total_bytes_processed: int = 0):
+        self._rows = rows
+        self._latency = latency
+        self.total_bytes_processed = total_bytes_processed
+
+    def result(self):
+        time.sleep(self._latency)
+        return self._rows
+
+
+class FakeBigQueryClient:
+    """
+    Drop-in for google.cloud.bigquery.Client that answers every query after latency seconds.
+    Serials in empty_serials return no rows; everything else gets rows_per_serial recent jobs.
+    Dry runs answer after dry_run_latency seconds with an estimate of bytes_per_query.
+    """
+
+    def __init__(self, project: str = None, latency: float = 1.5, jitter: float = 0.25, rows_per_serial: int = 5,
+                 empty_serials=(), seed: int = None, dry_run_latency: float = 0.1, bytes_per_query: int = 50 * 1024 ** 2,
+                 **kwargs):
+        self.project = project
+        self.latency = latency
+        self.jitter = jitter
+        self.rows_per_serial = rows_per_serial
+        self.empty_serials = {serial.lower() for serial in empty_serials}
+        self.dry_run_latency = dry_run_latency
+        self.bytes_per_query = bytes_per_query
+        self.queries = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def query(self, query: str, job_config=None, **kwargs):
+        if getattr(job_config, "dry_run", False):
+            # Dry runs return with the estimate already filled in, like the real client
+            time.sleep(self.dry_run_latency)
+            return FakeQueryJob([], 0.0, self.bytes_per_query)
+        serials = []
+        for parameter in getattr(job_config, "query_parameters", None) or []:
+            serials += list(getattr(parameter, "values", None) or [])
+        serial = serials[0] if serials else "Unknown"
+        with self._lock:
+            self.queries += 1
+            latency = max(0.0, self.latency * (1 + self._random.uniform(-self.jitter, self.jitter)))
+        if serial.lower() in self.empty_serials:
+            return FakeQueryJob([], latency, self.bytes_per_query)
+        rows = [
+            {
+                "printer_serial": serial,
+                "print_guid": f"{serial}-print-{i}",
+                "name": f"bench_part_{i}.form",
+                "print_started_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(time.time() - i * 3600)),
+            }
+            for i in range(self.rows_per_serial)
+        ]
+        return FakeQueryJob(rows, latency, self.bytes_per_query)
+
+
+class WebhookServer:
+    """
+    Local HTTP server standing in for the Zapier catch hooks.
+    Every POST is recorded; responses wait latency seconds and fail with 503 at failure_rate.
+    """
+
+    def __init__(self, latency: float = 0.2, failure_rate: float = 0.0, seed: int = None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.received = []
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, name="bench-webhooks", daemon=True)
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                with server._lock:
+                    failed = server._random.random() < server.failure_rate
+                    server.received.append({"path": self.path, "received_at": time.time(), "failed": failed, "body": body})
+                time.sleep(server.latency)
+                self.send_response(503 if failed else 200)
+                self.send_header("Content-Type", "application/json")
+                self.end_headers()
+                self.wfile.write(b'{"status": "success"}')
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def url(self, path: str) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}{path}"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
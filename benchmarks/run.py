@@ -0,0 +1,144 @@
+import argparse
+import functools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.fakes import FakeBigQueryClient, WebhookServer
+from benchmarks.scenarios import SCENARIOS, run_scenario
+
+RESULTS_DIR = "benchmark_results"
+# Stages this fast are dominated by timer noise, so growth below this many seconds is never a regression
+REGRESSION_FLOOR_SECONDS = 0.005
+STAGES = ["first_token", "llm", "extract_json", "webhook", "bigquery", "turn", "webhook_delivery"]
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def summarize(values) -> dict:
+    """Count, mean and p50/p95/p99/max of a list of seconds"""
+    from shared_backend.tracing import percentile
+
+    return {
+        "count": len(values),
+        "mean": round(sum(values) / len(values), 6),
+        "p50": round(percentile(values, 50), 6),
+        "p95": round(percentile(values, 95), 6),
+        "p99": round(percentile(values, 99), 6),
+        "max": round(max(values), 6),
+    }
+
+
+def install_fakes(webhooks: WebhookServer, args):
+    """
+    Point the app's modules at the stand-ins. Must run before they are imported, since
+    webhook URLs and the outbox, submission index and trace paths are read at import time.
+    """
+    from google.cloud import bigquery
+
+    os.environ["SALES_WEBHOOK_URL"] = webhooks.url("/hooks/sales")
+    os.environ["SERVICES_WEBHOOK_URL"] = webhooks.url("/hooks/services")
+    scratch_dir = tempfile.mkdtemp(prefix="bench-")
+    os.environ["OUTBOX_PATH"] = os.path.join(scratch_dir, "outbox.sqlite3")
+    os.environ["SUBMISSION_INDEX_PATH"] = os.path.join(scratch_dir, "submissions.sqlite3")
+    os.environ["TRACE_PATH"] = os.path.join(scratch_dir, "traces.jsonl")
+    os.environ["ANSWER_CACHE_ENABLED"] = "1" if args.answer_cache else "0"
+    bigquery.Client = functools.partial(
+        FakeBigQueryClient, latency=args.bigquery_latency * args.time_scale, seed=args.seed,
+        dry_run_latency=0.1 * args.time_scale,
+    )
+
+
+def run(args) -> dict:
+    with WebhookServer(latency=args.webhook_latency * args.time_scale, failure_rate=args.webhook_failure_rate, seed=args.seed) as webhooks:
+        install_fakes(webhooks, args)
+        from shared_backend.outbox import get_outbox
+
+        results = {}
+        for name in args.scenarios:
+            print(f"Running {name}: {args.conversations} conversations, {args.concurrency} at a time...")
+            started_at = time.time()
+            scenario = run_scenario(name, args.conversations, args.concurrency, args.seed, args.time_scale)
+            if not get_outbox().wait_until_idle(timeout=60):
+                print(f"  → {name}: webhook deliveries still pending after 60s")
+            scenario["samples"]["webhook_delivery"] = get_outbox().delivery_latencies(since=started_at)
+
+            samples = scenario.pop("samples")
+            scenario["stages"] = {stage: summarize(samples[stage]) for stage in STAGES if samples.get(stage)}
+            results[name] = scenario
+            print(f"  → {name}: {scenario['turns']} turns in {scenario['wall_seconds']:.1f}s, "
+                  f"turn p95 {scenario['stages']['turn']['p95'] * 1000:.0f} ms")
+
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        },
+        "scenarios": results,
+    }
+
+
+def compare(current: dict, baseline: dict, max_regression: float = None) -> bool:
+    """Print p95 per stage against a baseline run; returns False if any stage regressed beyond max_regression"""
+    print(f"\nComparing against {baseline['meta']['commit']} ({baseline['meta']['timestamp']})")
+    ok = True
+    for name, scenario in current["scenarios"].items():
+        base_stages = baseline["scenarios"].get(name, {}).get("stages", {})
+        for stage, stats in scenario["stages"].items():
+            if stage not in base_stages:
+                continue
+            before, after = base_stages[stage]["p95"], stats["p95"]
+            ratio = after / before if before else float("inf") if after else 1.0
+            flag = ""
+            if max_regression is not None and ratio > max_regression and after - before > REGRESSION_FLOOR_SECONDS:
+                flag = "  REGRESSION"
+                ok = False
+            print(f"  {name:<14} {stage:<17} p95 {before * 1000:9.1f} ms → {after * 1000:9.1f} ms  ({ratio:.2f}x){flag}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the chat turn pipeline against local stand-ins for Gemini, BigQuery and Zapier")
+    parser.add_argument("--scenarios", nargs="+", choices=sorted(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--conversations", type=int, default=20, help="Conversations per scenario")
+    parser.add_argument("--concurrency", type=int, default=4, help="Conversations in flight at once")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="Multiply every simulated latency, e.g. 0.05 for a quick run")
+    parser.add_argument("--bigquery-latency", type=float, default=1.5)
+    parser.add_argument("--webhook-latency", type=float, default=0.25)
+    parser.add_argument("--webhook-failure-rate", type=float, default=0.0)
+    parser.add_argument("--answer-cache", action="store_true", help="Leave the first-turn answer cache on")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--output", help=f"Results file; defaults to {RESULTS_DIR}/<commit>.json")
+    parser.add_argument("--compare", help="Baseline results file to compare p95s against")
+    parser.add_argument("--max-regression", type=float, help="Exit non-zero if any stage's p95 grows by more than this factor")
+    args = parser.parse_args()
+
+    results = run(args)
+    output = args.output or os.path.join(RESULTS_DIR, f"{results['meta']['commit']}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nWrote {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if not compare(results, baseline, args.max_regression):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.fakes import FakeChatSession, lead_json_block
+from services_backend.serials import ANIMALS
+
+SERIAL_ADJECTIVES = ["Calm", "Brave", "Quiet", "Lucky", "Swift", "Gentle", "Jolly", "Proud", "Clever", "Sunny"]
+
+SALES_PROSE = (
+    "Thanks for reaching out! For surgical guides most dental labs use the Form 4B with Surgical Guide Resin, "
+    "which is biocompatible and can be sterilized after printing. The Form 4B prints a full arch guide in under "
+    "twenty minutes, and with Form Wash and Form Cure post-processing is largely hands off. "
+)
+
+# Latencies in seconds before --time-scale; RAG grounding retrieves passages before the first token
+SCENARIOS = {
+    "sales-rag": {"flow": "sales", "namespace": "rag:bench", "first_token_latency": 1.6, "tokens_per_second": 70.0},
+    "sales-search": {"flow": "sales", "namespace": "search", "first_token_latency": 1.1, "tokens_per_second": 80.0},
+    "services": {"flow": "services", "namespace": "default", "first_token_latency": 0.9, "tokens_per_second": 90.0},
+}
+
+
+def sales_conversation(rng: random.Random) -> list:
+    """Three customer turns and Rhys's scripted replies, ending in the lead JSON"""
+    lead = {
+        "email": f"buyer{rng.randint(1, 10_000)}@examplelab.com",
+        "customer_initial_question": "We run a dental lab and want to print surgical guides. Which printer should we look at?",
+        "overview_of_customers_business_and_use_case_for_3d_printing": "Dental lab printing surgical guides.",
+        "budget": 15000,
+        "estimated_purchase_date": "2026-01-15",
+        "is_qualified": rng.choice(["Yes", "Yes", "No"]),
+    }
+    return [
+        (lead["customer_initial_question"], SALES_PROSE * 2 + "What budget and timeline are you working with?"),
+        ("About $15k, and we'd like to buy within 3 months.", SALES_PROSE + "What's the best email to reach you?"),
+        (lead["email"], "Thanks! I've passed your details to our team.\n\n" + lead_json_block(lead)),
+    ]
+
+
+def services_conversation(rng: random.Random) -> list:
+    """Pete asks for logs via the serial JSON, then opens a case for the failed job"""
+    serial = rng.choice(SERIAL_ADJECTIVES) + rng.choice(sorted(ANIMALS)).capitalize()
+    case = {
+        "email": f"tech{rng.randint(1, 10_000)}@examplelab.com",
+        "printer_serial": serial,
+        "job_name": "bench_part_0.form",
+        "problem": "Print failed around layer 200",
+    }
+    return [
+        (f"My Form 4 {serial} keeps failing prints halfway through.",
+         "Sorry to hear that! Let me pull up your recent prints.\n\n" + lead_json_block({"printer_serial": serial})),
+        ("Yes, bench_part_0.form failed around layer 200. I'm at " + case["email"],
+         "Thanks, I've opened a case with our support team.\n\n" + lead_json_block(case)),
+    ]
+
+
+def run_conversation(name: str, config: dict, seed: int, time_scale: float) -> list:
+    """Play one scripted conversation through the real turn pipeline and return per-turn stage timings"""
+    from shared_backend.flows import run_sales_turn, run_services_turn
+
+    rng = random.Random(seed)
+    if config["flow"] == "sales":
+        conversation, run_turn = sales_conversation(rng), run_sales_turn
+    else:
+        conversation, run_turn = services_conversation(rng), run_services_turn
+
+    chat_session = FakeChatSession(
+        [reply for _, reply in conversation],
+        first_token_latency=config["first_token_latency"] * time_scale,
+        tokens_per_second=config["tokens_per_second"] / time_scale,
+        seed=seed,
+        answer_cache_namespace=config["namespace"],
+    )
+    turns = []
+    for prompt, _ in conversation:
+        start = time.perf_counter()
+        result = run_turn(chat_session, prompt)
+        turns.append(dict(result.timings, turn=time.perf_counter() - start))
+    return turns
+
+
+def run_scenario(name: str, conversations: int, concurrency: int, seed: int, time_scale: float) -> dict:
+    """Run conversations of a scenario, concurrency at a time; returns stage samples and wall time"""
+    config = SCENARIOS[name]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=f"bench-{name}") as executor:
+        futures = [executor.submit(run_conversation, name, config, seed + i, time_scale) for i in range(conversations)]
+        results = [future.result() for future in futures]
+
+    samples = {}
+    for turns in results:
+        for timings in turns:
+            for stage, seconds in timings.items():
+                samples.setdefault(stage, []).append(seconds)
+    return {
+        "conversations": conversations,
+        "turns": sum(len(turns) for turns in results),
+        "wall_seconds": time.perf_counter() - start,
+        "samples": samples,
+    }
@@ -0,0 +1,207 @@
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "1") == "1"
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.9"))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", str(24 * 3600)))
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1000"))
+# Questions match on normalized text only unless a semantic embedder is set; the bag-of-words
+# "hashing" embedder scores "SLS vs FDM" and "SLS vs SLA" alike, so it is never used for matching
+ANSWER_CACHE_EMBEDDER = os.getenv("ANSWER_CACHE_EMBEDDER", "")
+SEMANTIC_EMBEDDERS = ("gemini",)
+
+# Words that change the answer however similar the rest of the question is: products, materials,
+# print technologies and regions. Numbers and words typed in capitals (e.g. "UK", "SLS") count too
+KEY_TERMS = frozenset("""
+form fuse 3 3b 3l 4 4b 4l sift wash cure automation
+sla sls fdm msla lfs dlp polyjet mjf resin resins powder nylon pa11 pa12 tpu pp
+tough durable rigid flexible elastic grey gray clear white black draft model castable wax
+high temp biomed dental premium silicone ceramic alumina esd fast
+us usa america uk britain eu europe european germany france italy spain canada australia japan
+china india mexico brazil usd gbp eur aud cad jpy
+""".split())
+
+_PUNCTUATION_PATTERN = re.compile(r"[^\w\s]")
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+_CAPITALIZED_PATTERN = re.compile(r"\b[A-Z][A-Z0-9]+\b")
+
+
+def normalize_question(question: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace so trivially different phrasings share a key"""
+    question = _PUNCTUATION_PATTERN.sub(" ", question.lower())
+    return _WHITESPACE_PATTERN.sub(" ", question).strip()
+
+
+def key_terms(question: str) -> frozenset:
+    """Numbers, product, material, technology and region words in a question, which a cached answer must share"""
+    tokens = normalize_question(question).split()
+    capitalized = {word.lower() for word in _CAPITALIZED_PATTERN.findall(question)}
+    return frozenset(
+        token for token in tokens
+        if token in KEY_TERMS or token in capitalized or any(char.isdigit() for char in token)
+    )
+
+
+class CachedResponse:
+    """Stands in for a model response when the answer comes from the cache"""
+
+    def __init__(self, text: str):
+        self.text = text
+
+
+class _Entry:
+    def __init__(self, entry_id, namespace, question, normalized, terms, embedding, answer, expires_at):
+        self.entry_id = entry_id
+        self.namespace = namespace
+        self.question = question
+        self.normalized = normalized
+        self.terms = terms
+        self.embedding = embedding
+        self.answer = answer
+        self.expires_at = expires_at
+
+
+class SemanticAnswerCache:
+    """
+    Answers to context-free questions, matched by normalized text, or with a semantic embedder by
+    embedding similarity among questions with the same key terms (see key_terms).
+    Entries expire after ttl seconds and the least recently used are evicted beyond maxsize.
+    Namespaces keep answers from different grounding backends apart.
+    """
+
+    def __init__(self, embedder=None, threshold: float = ANSWER_CACHE_THRESHOLD, ttl: float = ANSWER_CACHE_TTL_SECONDS,
+                 maxsize: int = ANSWER_CACHE_SIZE):
+        self.embedder = embedder
+        self.threshold = threshold
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._by_text = {}
+        self._lock = threading.Lock()
+
+    def _remove(self, entry_id):
+        entry = self._entries.pop(entry_id, None)
+        if entry is not None:
+            self._by_text.pop((entry.namespace, entry.normalized), None)
+        return entry
+
+    def _purge_expired(self, now):
+        for entry_id in [e.entry_id for e in self._entries.values() if e.expires_at <= now]:
+            self._remove(entry_id)
+
+    def lookup(self, question: str, namespace: str = "default"):
+        """Return (entry_id, answer) for a matching cached answer, or None"""
+        normalized = normalize_question(question)
+        now = time.monotonic()
+        with self._lock:
+            self._purge_expired(now)
+            entry_id = self._by_text.get((namespace, normalized))
+            if entry_id is not None:
+                self._entries.move_to_end(entry_id)
+                self.exact_hits += 1
+                return entry_id, self._entries[entry_id].answer
+            if self.embedder is None:
+                self.misses += 1
+                return None
+            terms = key_terms(question)
+            candidates = [e for e in self._entries.values() if e.namespace == namespace and e.terms == terms]
+
+        if candidates:
+            query = self.embedder.embed_query(normalized)
+            scores = np.stack([e.embedding for e in candidates]) @ query
+            best = int(np.argmax(scores))
+            if scores[best] >= self.threshold:
+                entry = candidates[best]
+                with self._lock:
+                    if entry.entry_id in self._entries:
+                        self._entries.move_to_end(entry.entry_id)
+                        self.semantic_hits += 1
+                        return entry.entry_id, entry.answer
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def store(self, question: str, answer: str, namespace: str = "default", ttl: float = None) -> str:
+        """Cache an answer and return its entry id"""
+        normalized = normalize_question(question)
+        embedding = None if self.embedder is None else self.embedder.embed_query(normalized)
+        entry = _Entry(uuid.uuid4().hex, namespace, question, normalized, key_terms(question), embedding, answer,
+                       time.monotonic() + (self.ttl if ttl is None else ttl))
+        with self._lock:
+            previous = self._by_text.get((namespace, normalized))
+            if previous is not None:
+                self._remove(previous)
+            self._entries[entry.entry_id] = entry
+            self._by_text[(namespace, normalized)] = entry.entry_id
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+        return entry.entry_id
+
+    def invalidate(self, entry_id: str) -> bool:
+        """Drop a single cached answer"""
+        with self._lock:
+            return self._remove(entry_id) is not None
+
+    def invalidate_matching(self, text: str) -> int:
+        """Drop every cached answer whose question or answer mentions text, e.g. 'price' after a store update"""
+        text = text.lower()
+        with self._lock:
+            matching = [
+                e.entry_id for e in self._entries.values()
+                if text in e.question.lower() or text in e.answer.lower()
+            ]
+            for entry_id in matching:
+                self._remove(entry_id)
+        return len(matching)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_text.clear()
+
+    def entries(self):
+        """Return (entry_id, namespace, question) for every cached answer, most recently used last"""
+        with self._lock:
+            return [(e.entry_id, e.namespace, e.question) for e in self._entries.values()]
+
+    def stats(self):
+        """Return hit/miss counters, hit rate and current size"""
+        with self._lock:
+            hits = self.exact_hits + self.semantic_hits
+            lookups = hits + self.misses
+            return {
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "size": len(self._entries),
+            }
+
+
+_answer_cache = None
+_answer_cache_lock = threading.Lock()
+
+
+def get_answer_cache() -> SemanticAnswerCache:
+    """Return the process-wide answer cache, creating it on first use"""
+    global _answer_cache
+    with _answer_cache_lock:
+        if _answer_cache is None:
+            embedder = None
+            if ANSWER_CACHE_EMBEDDER in SEMANTIC_EMBEDDERS:
+                from sales_backend.local_rag import create_embedder
+
+                embedder = create_embedder(ANSWER_CACHE_EMBEDDER)
+            elif ANSWER_CACHE_EMBEDDER:
+                print(f"ANSWER_CACHE_EMBEDDER={ANSWER_CACHE_EMBEDDER} is not a semantic embedder, matching exact questions only")
+            _answer_cache = SemanticAnswerCache(embedder)
+        return _answer_cache
@@ -1,21 +1,66 @@
-from google import genai
-from google.genai import types
 import re
 import json
-import requests
 from typing import Dict, Any, Optional
 from datetime import date
 import os
+from functools import lru_cache
 from dotenv import load_dotenv
+from shared_backend.idempotency import submit_once
+from sales_backend.answer_cache import ANSWER_CACHE_ENABLED, CachedResponse, get_answer_cache
+from shared_backend.clients import get_genai_client, get_vertex_client, track_session
+from shared_backend.hedging import HEDGE_ENABLED, HedgedChat
+from shared_backend.history import CompactingChat, extract_email
+from shared_backend.router import RoutingChat
+from shared_backend.scheduler import BusyResponse, BUSY_MESSAGE, QuotaExceeded
+from shared_backend.tracing import set_attribute, traced
 
 load_dotenv()
 
-def create_gemini_chat(client, tools: list):
-    return client.chats.create(
+_BUDGET_PATTERN = re.compile(r'(?:[$€£]\s?\d[\d,.]*\s?k?\b|\b\d[\d,.]*\s?k?\s?(?:usd|eur|gbp|dollars|euros|pounds)\b)', re.IGNORECASE)
+_TIMELINE_PATTERN = re.compile(r'\b(?:\d+|a|one|two|three|four|five|six|twelve)\s+(?:weeks?|months?|years?)\b|\bnext\s+(?:week|month|quarter|year)\b', re.IGNORECASE)
+
+def extract_sales_slots(text: str) -> dict:
+    """Pull email, budget and timeline mentions out of a customer message"""
+    slots = extract_email(text)
+    budget = _BUDGET_PATTERN.search(text)
+    if budget:
+        slots["budget"] = budget.group(0).strip()
+    timeline = _TIMELINE_PATTERN.search(text)
+    if timeline:
+        slots["timeline"] = timeline.group(0).strip()
+    return slots
+
+def create_gemini_chat(client, tools: list, history: list = None):
+    from google.genai import types
+
+    # The router moves the conversation between flash and pro per turn; gemini-2.5-pro is the starting model
+    chat_session = RoutingChat(CompactingChat(
+        client,
         model="gemini-2.5-pro",
         config=types.GenerateContentConfig(
             tools=tools,
-            system_instruction=system_instruction,
+            system_instruction=build_system_instruction(),
+        ),
+        history=history,
+        slot_extractors=[extract_sales_slots],
+    ))
+    track_session(client, chat_session)
+    return chat_session
+
+@lru_cache(maxsize=None)
+def create_rag_tool(project_id: str, location: str, corpus_id: str):
+    """Build the Vertex RAG retrieval tool for a corpus"""
+    from google.genai import types
+
+    return types.Tool(
+        retrieval=types.Retrieval(
+            vertex_rag_store=types.VertexRagStore(
+                rag_resources=[
+                    types.VertexRagStoreRagResource(
+                        rag_corpus=f"projects/{project_id}/locations/{location}/ragCorpora/{corpus_id}"
+                    )
+                ]
+            )
         )
     )
 
@@ -30,22 +75,8 @@ def init_vertex_client(project_id: str = None, location: str = None, corpus_id:
     if not (project_id and location and corpus_id) :
         raise ValueError("Please provide a valid project ID, location, and corpus ID.")
 
-    client = genai.Client(
-        project=project_id,
-        location=location,
-        vertexai=True,
-    )
-    rag_tool = types.Tool(
-        retrieval=types.Retrieval(
-            vertex_rag_store=types.VertexRagStore(
-                rag_resources=[
-                    types.VertexRagStoreRagResource(
-                        rag_corpus=f"projects/{project_id}/locations/{location}/ragCorpora/{corpus_id}"
-                    )
-                ]
-            )
-        )
-    )
+    client = get_vertex_client(project_id, location)
+    rag_tool = create_rag_tool(project_id, location, corpus_id)
     return client, rag_tool
 
 def init_genai_client(api_key: str = None):
@@ -56,20 +87,64 @@ def init_genai_client(api_key: str = None):
     if not api_key:
         raise ValueError("No API key provided. Please provide a Gemini API key.")
     
-    return genai.Client(api_key=api_key)
+    return get_genai_client(api_key)
+
+def init_local_rag(index_dir: str, api_key: str = None):
+    """Open a local vector index and the embedder it was built with"""
+    from sales_backend.local_rag import create_embedder, open_index
+
+    index = open_index(index_dir)
+    embedder = create_embedder(index.embedder_name, api_key=api_key, dim=index.dim)
+    return index, embedder
 
-def create_chat_session(rag: bool, api_key: str = None, project_id: str = None, location: str = None, corpus_id: str = None):
-    """Create a new chat session with the provided API key"""
+def create_chat_session(rag: bool, api_key: str = None, project_id: str = None, location: str = None, corpus_id: str = None, local_index_dir: str = None, history: list = None):
+    """Create a new chat session with the provided API key, optionally continuing a stored history"""
 
     # We can only use RAG or Google Search
-    if rag:
-        client, rag_tool = init_vertex_client(project_id, location, corpus_id)
-        return create_gemini_chat(client, [rag_tool])
-    else:
-        client = init_genai_client(api_key)
-        return create_gemini_chat(client, [types.Tool(google_search=types.GoogleSearch())])
+    if rag and local_index_dir:
+        # Retrieval runs in-process against a local index; passages are injected into each message
+        from sales_backend.local_rag import LocalRagChatSession
 
-date = date.today()
+        client = init_genai_client(api_key)
+        index, embedder = init_local_rag(local_index_dir, api_key)
+        chat_session = LocalRagChatSession(create_gemini_chat(client, [], history), index, embedder)
+        chat_session.answer_cache_namespace = f"local:{local_index_dir}"
+    elif rag:
+        chat_session = create_vertex_rag_chat(project_id, location, corpus_id, history)
+        if HEDGE_ENABLED:
+            chat_session = hedge_chat_session(chat_session, "rag", lambda: create_search_chat(api_key, history))
+    else:
+        chat_session = create_search_chat(api_key, history)
+        if HEDGE_ENABLED:
+            chat_session = hedge_chat_session(chat_session, "search", lambda: create_vertex_rag_chat(project_id, location, corpus_id, history))
+    return chat_session
+
+def create_vertex_rag_chat(project_id: str = None, location: str = None, corpus_id: str = None, history: list = None):
+    """Chat grounded on the Vertex RAG corpus"""
+    client, rag_tool = init_vertex_client(project_id, location, corpus_id)
+    chat_session = create_gemini_chat(client, [rag_tool], history)
+    chat_session.answer_cache_namespace = f"rag:{corpus_id or os.getenv('CORPUS_ID')}"
+    return chat_session
+
+def create_search_chat(api_key: str = None, history: list = None):
+    """Chat grounded on Google Search"""
+    from google.genai import types
+
+    client = init_genai_client(api_key)
+    chat_session = create_gemini_chat(client, [types.Tool(google_search=types.GoogleSearch())], history)
+    chat_session.answer_cache_namespace = "search"
+    return chat_session
+
+def hedge_chat_session(chat_session, primary: str, create_secondary):
+    """Back the chat with the other grounding backend when it is configured, so stalled turns are hedged"""
+    try:
+        secondary = create_secondary()
+    except ValueError:
+        # Only one backend has credentials; run unhedged
+        return chat_session
+    hedged = HedgedChat({primary: chat_session, "search" if primary == "rag" else "rag": secondary}, primary)
+    hedged.answer_cache_namespace = chat_session.answer_cache_namespace
+    return hedged
 
 json_converter = """
 You are a JSON converter bot. Your goal is to take text and output to a JSON object with the following columns:
@@ -81,7 +156,7 @@ timeline_in_months
 is_qualified
 """
 
-system_instruction = f"""
+system_instruction_template = """
 You are Formlabs Sales Representative, Rhys, and your goal is to answer questions from customers and determine if they are actually interested in buying a Formlabs printer in the next 60 days.
 
 You should use information primarily sourced from formlabs.com and support.formlabs.com to answer questions. But you can also use general information from the web if you cannot find an answer on these websites. For price related questions, use https://formlabs.com/store/
@@ -120,6 +195,10 @@ is_qualified (Yes or No) - STRING
 
 """
 
+def build_system_instruction(today: date = None) -> str:
+    """Rhys's instructions with today's date, which purchase timelines in months are added to"""
+    return system_instruction_template.format(date=today or date.today())
+
 def is_json_response(response):
     try:
         # Attempt to parse the response text as JSON
@@ -133,14 +212,81 @@ def is_json_response(response):
         # Handle cases where response.text might not be a string (e.g., None)
         return False
 
+def is_cacheable_turn(chat_session) -> bool:
+    """Only the first question of a conversation is free of context, so only it is answered from the cache"""
+    return ANSWER_CACHE_ENABLED and not chat_session.get_history()
+
+def lookup_cached_answer(chat_session, question: str) -> Optional[str]:
+    """Return a cached answer for a first-turn question and record the exchange in the chat history"""
+    from google.genai import types
+
+    match = get_answer_cache().lookup(question, getattr(chat_session, "answer_cache_namespace", "default"))
+    if match is None:
+        return None
+    _, answer = match
+    # Later turns need the exchange in context exactly as if the model had answered it
+    chat_session.record_history(
+        user_input=types.Content(role="user", parts=[types.Part.from_text(text=question)]),
+        model_output=[types.Content(role="model", parts=[types.Part.from_text(text=answer)])],
+        automatic_function_calling_history=[],
+        is_valid=True,
+    )
+    return answer
+
+def store_cached_answer(chat_session, question: str, answer: str):
+    """Cache a first-turn answer unless it is empty or carries the lead JSON"""
+    if answer and not extract_json_from_response(answer):
+        get_answer_cache().store(question, answer, getattr(chat_session, "answer_cache_namespace", "default"))
+
+@traced("query_llm")
 def query_llm(chat_session, question: str):
     """Send a message to the LLM and get the response"""
     try:
+        cacheable = is_cacheable_turn(chat_session)
+        if cacheable:
+            answer = lookup_cached_answer(chat_session, question)
+            set_attribute("answer_cache", "miss" if answer is None else "hit")
+            if answer is not None:
+                return CachedResponse(answer)
         response = chat_session.send_message(question)
+        if cacheable:
+            store_cached_answer(chat_session, question, response.text)
         return response
+    except QuotaExceeded as e:
+        # Shed by the quota scheduler: tell the customer to retry instead of showing an error
+        set_attribute("shed", str(e))
+        return BusyResponse()
+    except Exception as e:
+        raise Exception(f"Error querying LLM: {str(e)}")
+
+@traced("query_llm")
+def query_llm_stream(chat_session, question: str):
+    """Send a message to the LLM and yield the response text as it is generated"""
+    try:
+        cacheable = is_cacheable_turn(chat_session)
+        if cacheable:
+            answer = lookup_cached_answer(chat_session, question)
+            set_attribute("answer_cache", "miss" if answer is None else "hit")
+            if answer is not None:
+                yield answer
+                return
+        chunks = []
+        for chunk in chat_session.send_message_stream(question):
+            if chunk.text:
+                chunks.append(chunk.text)
+                yield chunk.text
+        if cacheable:
+            store_cached_answer(chat_session, question, "".join(chunks))
+    except QuotaExceeded as e:
+        set_attribute("shed", str(e))
+        yield BUSY_MESSAGE
     except Exception as e:
         raise Exception(f"Error querying LLM: {str(e)}")
 
+def answer_cache_stats():
+    """Return hit-rate metrics for the first-turn answer cache"""
+    return get_answer_cache().stats()
+
 def extract_json_from_response(response: str) -> Optional[Dict[str, Any]]:
     """
     Extract JSON objects from the response text.
@@ -159,9 +305,12 @@ def extract_json_from_response(response: str) -> Optional[Dict[str, Any]]:
     return None
 
 
+# Replace with your actual Zapier webhook URL
+ZAPIER_WEBHOOK_URL = os.getenv("SALES_WEBHOOK_URL", 'https://hooks.zapier.com/hooks/catch/18996039/u41k77t/')
+
+@traced("webhook.enqueue")
 def create_opportunity(data):
-    # Replace with your actual Zapier webhook URL
-    zapier_webhook_url = 'https://hooks.zapier.com/hooks/catch/18996039/u41k77t/'
+    """Queue the lead for delivery to Zapier, once per customer and question; returns the outbox id without waiting on the webhook"""
 
     # Data you want to send
     # payload = {
@@ -173,19 +322,9 @@ def create_opportunity(data):
     #     "is_qualified": "Yes"
     # }
 
-    # # Convert the dict to a JSON-formatted string
-    payload_json = json.dumps(data)
-
-    # Set headers to indicate you're sending JSON
-    headers = {'Content-Type': 'application/json'}
-
-    # Send POST request with JSON payload
-    response = requests.post(zapier_webhook_url, data=payload_json, headers=headers)
-
-    # Print the response
-    print(f"Status Code: {response.status_code}")
-    print(f"Response Text: {response.text}")
-
-
-# Create initial chat session
-chat = create_chat_session(rag=True)
\ No newline at end of file
+    # The outbox persists the payload and posts it in the background with retries; re-emitted
+    # or corrected JSON for the same customer updates that submission instead of creating another.
+    # Leads are keyed on the email alone: the model rephrases customer_initial_question every time
+    outbox_id = submit_once("opportunity", ZAPIER_WEBHOOK_URL, data)
+    set_attribute("outbox_id", outbox_id)
+    return outbox_id
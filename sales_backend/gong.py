@@ -0,0 +1,244 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+import aiohttp
+
+# --- Configuration ---
+ACCESS_KEY = os.getenv("GONG_ACCESS_KEY", "")
+SECRET_KEY = os.getenv("GONG_SECRET_KEY", "")
+BASE_URL = os.getenv("GONG_BASE_URL", "")
+OUTPUT_DIR = os.getenv("GONG_OUTPUT_DIR", "gong_transcripts")
+CHECKPOINT_PATH = os.getenv("GONG_CHECKPOINT_PATH", "gong_checkpoint.json")
+# Gong allows 3 calls per second per workspace; the limiter backs off further on 429s
+MIN_REQUEST_INTERVAL = 1 / 3
+MAX_REQUEST_INTERVAL = 30.0
+# The date range is split into windows that are paged through concurrently
+WINDOW_DAYS = 7
+MAX_CONCURRENT_WINDOWS = 4
+# Incremental runs start this far before the previous run's end to catch late-processed calls
+INCREMENTAL_OVERLAP = timedelta(days=1)
+DEFAULT_START = "2025-01-01T00:00:00-04:00"
+MAX_RETRIES = 6
+
+
+class AdaptiveRateLimiter:
+    """
+    Spaces requests at least `interval` seconds apart across all tasks.
+    The interval grows when the API returns 429 and decays back towards the minimum on success.
+    """
+
+    def __init__(self, min_interval: float = MIN_REQUEST_INTERVAL, max_interval: float = MAX_REQUEST_INTERVAL):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        self._next_slot = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            now = time.monotonic()
+            wait = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def on_success(self):
+        self.interval = max(self.min_interval, self.interval * 0.9)
+
+    def on_throttled(self, retry_after: float = None):
+        self.interval = min(self.max_interval, self.interval * 2)
+        if retry_after:
+            # Nobody sends until the server says we can
+            self._next_slot = max(self._next_slot, time.monotonic() + retry_after)
+
+
+class Checkpoint:
+    """
+    The range of the run in progress with its per-window cursors and completion flags, saved atomically
+    after every page, and the end of the last completed run
+    """
+
+    def __init__(self, path: str = CHECKPOINT_PATH):
+        self.path = path
+        self.state = {"run": None, "windows": {}, "last_to": None}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.state.update(json.load(f))
+        self._lock = asyncio.Lock()
+
+    def window(self, key: str) -> dict:
+        return self.state["windows"].setdefault(key, {"cursor": None, "done": False, "fetched": 0})
+
+    async def save(self):
+        async with self._lock:
+            data = json.dumps(self.state, indent=2)
+            await asyncio.to_thread(_write_atomic, self.path, data)
+
+
+def _write_atomic(path: str, text: str):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def format_transcript(transcript_obj) -> str:
+    """Format a single callTranscripts entry as 'speaker: text' lines"""
+    lines = []
+    for utterance in transcript_obj.get("transcript", []):
+        spk = utterance.get("speakerId", "Unknown")
+        # each utterance may contain one or more sentences
+        text = utterance.get("text") or ""
+        if not text and utterance.get("sentences"):
+            text = " ".join(sentence.get("text", "") for sentence in utterance["sentences"])
+        lines.append(f"{spk}: {text}")
+    return "\n".join(lines) or "<no transcript text>"
+
+
+async def write_transcript(transcript_obj, output_dir: str = OUTPUT_DIR) -> str:
+    """Write a transcript as soon as it arrives; atomic so a resumed run never sees a partial file"""
+    fn = os.path.join(output_dir, f"gong_transcript_{transcript_obj['callId']}.txt")
+    await asyncio.to_thread(_write_atomic, fn, format_transcript(transcript_obj))
+    return fn
+
+
+def split_windows(from_dt: datetime, to_dt: datetime, window_days: int = WINDOW_DAYS):
+    """Split [from_dt, to_dt] into consecutive windows of window_days"""
+    windows = []
+    start = from_dt
+    while start < to_dt:
+        end = min(to_dt, start + timedelta(days=window_days))
+        windows.append((start.isoformat(), end.isoformat()))
+        start = end
+    return windows
+
+
+async def fetch_transcripts_batch(session: aiohttp.ClientSession, limiter: AdaptiveRateLimiter, from_dt: str, to_dt: str, cursor=None):
+    """
+    POST to /v2/calls/transcript with optional cursor,
+    returns (records, callTranscripts).
+    """
+    payload = {"filter": {"fromDateTime": from_dt, "toDateTime": to_dt}}
+    if cursor:
+        payload["cursor"] = cursor
+
+    for attempt in range(MAX_RETRIES):
+        await limiter.acquire()
+        try:
+            async with session.post(f"{BASE_URL}/v2/calls/transcript", json=payload) as resp:
+                if resp.status == 404:
+                    # Gong returns 404 when a window has no calls
+                    return {}, []
+                if resp.status == 429 or resp.status >= 500:
+                    retry_after = resp.headers.get("Retry-After")
+                    limiter.on_throttled(float(retry_after) if retry_after and retry_after.isdigit() else 2 ** attempt)
+                    continue
+                resp.raise_for_status()
+                data = await resp.json()
+        except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError) as e:
+            # Dropped connections and timeouts back off like a 429 without a Retry-After
+            print(f"  Retrying {from_dt} – {to_dt} after {type(e).__name__}: {e}")
+            limiter.on_throttled(2 ** attempt)
+            continue
+        limiter.on_success()
+        return data["records"], data.get("callTranscripts", [])
+    raise RuntimeError(f"Gong kept throttling or failing the window {from_dt} – {to_dt}")
+
+
+async def fetch_window(session, limiter, checkpoint: Checkpoint, from_dt: str, to_dt: str, output_dir: str):
+    """Page through one window, resuming from its checkpointed cursor"""
+    state = checkpoint.window(f"{from_dt}|{to_dt}")
+    while not state["done"]:
+        records, transcripts = await fetch_transcripts_batch(session, limiter, from_dt, to_dt, state["cursor"])
+        await asyncio.gather(*(write_transcript(ct, output_dir) for ct in transcripts))
+        state["fetched"] += len(transcripts)
+        state["cursor"] = records.get("cursor")
+        state["done"] = not state["cursor"]
+        await checkpoint.save()
+    return state["fetched"]
+
+
+async def fetch_all(from_dt: datetime = None, to_dt: datetime = None, output_dir: str = OUTPUT_DIR,
+                    checkpoint_path: str = CHECKPOINT_PATH, max_concurrent_windows: int = MAX_CONCURRENT_WINDOWS,
+                    resume: bool = False):
+    """
+    Fetch every transcript between from_dt and to_dt into output_dir.
+    Without from_dt the run is incremental: it starts where the last completed run ended.
+    With resume, an interrupted run picks up its saved range and window cursors instead.
+    """
+    if not all([ACCESS_KEY, SECRET_KEY, BASE_URL]):
+        raise RuntimeError("Make sure GONG_ACCESS_KEY, GONG_SECRET_KEY and GONG_BASE_URL are set.")
+
+    checkpoint = Checkpoint(checkpoint_path)
+    run_range = checkpoint.state.get("run")
+    if resume and run_range:
+        # The saved end, not a new "now", so every window keeps its key and cursor
+        from_dt, to_dt = datetime.fromisoformat(run_range["from"]), datetime.fromisoformat(run_range["to"])
+    else:
+        if from_dt is None:
+            last_to = checkpoint.state.get("last_to")
+            from_dt = datetime.fromisoformat(last_to) - INCREMENTAL_OVERLAP if last_to else datetime.fromisoformat(DEFAULT_START)
+        if to_dt is None:
+            to_dt = datetime.now(timezone.utc).astimezone(from_dt.tzinfo)
+        new_range = {"from": from_dt.isoformat(), "to": to_dt.isoformat()}
+        if run_range != new_range:
+            if run_range:
+                print(f"Dropping the interrupted run {run_range['from']} – {run_range['to']}; use --resume to finish it")
+            # Cursors from another range never apply to this one
+            checkpoint.state["windows"] = {}
+        checkpoint.state["run"] = new_range
+        await checkpoint.save()
+
+    os.makedirs(output_dir, exist_ok=True)
+    windows = split_windows(from_dt, to_dt)
+    print(f"Fetching transcripts from {from_dt.isoformat()} to {to_dt.isoformat()} in {len(windows)} windows...")
+
+    limiter = AdaptiveRateLimiter()
+    semaphore = asyncio.Semaphore(max_concurrent_windows)
+    connector = aiohttp.TCPConnector(limit=max_concurrent_windows)
+    auth = aiohttp.BasicAuth(ACCESS_KEY, SECRET_KEY)
+
+    async with aiohttp.ClientSession(auth=auth, connector=connector, timeout=aiohttp.ClientTimeout(total=60)) as session:
+        async def run(window):
+            async with semaphore:
+                fetched = await fetch_window(session, limiter, checkpoint, *window, output_dir)
+                print(f"  → {window[0]} – {window[1]}: {fetched} transcripts")
+                return fetched
+
+        totals = await asyncio.gather(*(run(window) for window in windows))
+
+    # Only a fully completed run moves the incremental start forward
+    checkpoint.state["last_to"] = to_dt.isoformat()
+    checkpoint.state["run"] = None
+    checkpoint.state["windows"] = {}
+    await checkpoint.save()
+    print(f"\nDone — wrote {sum(totals)} transcript files.")
+    return sum(totals)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Download Gong call transcripts")
+    parser.add_argument("--from", dest="from_dt", help="ISO start datetime; defaults to the end of the last run")
+    parser.add_argument("--to", dest="to_dt", help="ISO end datetime; defaults to now")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("--checkpoint", default=CHECKPOINT_PATH)
+    parser.add_argument("--concurrency", type=int, default=MAX_CONCURRENT_WINDOWS)
+    parser.add_argument("--resume", action="store_true", help="Finish the interrupted run in the checkpoint over its original range")
+    args = parser.parse_args()
+
+    asyncio.run(fetch_all(
+        datetime.fromisoformat(args.from_dt) if args.from_dt else None,
+        datetime.fromisoformat(args.to_dt) if args.to_dt else None,
+        args.output_dir,
+        args.checkpoint,
+        args.concurrency,
+        args.resume,
+    ))
+
+
+if __name__ == "__main__":
+    main()
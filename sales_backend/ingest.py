@@ -0,0 +1,327 @@
+import argparse
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Defaults match the original batch loop in rag.ipynb
+DRIVE_FOLDER_ID = os.getenv("DRIVE_FOLDER_ID", "1qh3Gjo6UNrfZ6f6fILQqwj6wZgSRPxH1")
+MANIFEST_PATH = os.getenv("INGEST_MANIFEST_PATH", "ingest_manifest.sqlite3")
+BATCH_SIZE = 25
+MAX_FILES = 8000
+MAX_WORKERS = 4
+MAX_EMBEDDING_REQUESTS_PER_MIN = 1000
+# Import operations started per minute across all workers
+MAX_IMPORTS_PER_MIN = 60
+CHUNK_SIZE = 512
+CHUNK_OVERLAP = 100
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    file_id TEXT PRIMARY KEY,
+    name TEXT,
+    created_time TEXT,
+    content_key TEXT NOT NULL,
+    status TEXT NOT NULL,
+    imported_key TEXT,
+    imported_at REAL,
+    last_error TEXT,
+    rag_file_name TEXT
+);
+CREATE INDEX IF NOT EXISTS files_status ON files (status, created_time);
+"""
+
+
+class RateLimiter:
+    """Token bucket shared by all workers; acquire() blocks until a token is available"""
+
+    def __init__(self, rate_per_min: float, burst: int = 1):
+        self.interval = 60.0 / rate_per_min
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1.0):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) / self.interval)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) * self.interval
+            time.sleep(wait)
+
+
+class Manifest:
+    """
+    Local record of every Drive file seen, its content key, whether that version was imported
+    and the RAG file it was imported as.
+    A file is pending until its current content key has been imported, so interrupted runs resume.
+    Files gone from Drive are marked deleted until their RAG file has been removed.
+    """
+
+    def __init__(self, path: str = MANIFEST_PATH):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.executescript(SCHEMA)
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(files)")]
+        if "rag_file_name" not in columns:
+            # Manifests written before RAG file names were tracked
+            self._conn.execute("ALTER TABLE files ADD COLUMN rag_file_name TEXT")
+
+    def sync(self, drive_files) -> dict:
+        """Record the current Drive listing, mark new or changed files as pending and missing files as deleted"""
+        counts = {"new": 0, "changed": 0, "unchanged": 0, "deleted": 0}
+        seen = set()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            for f in drive_files:
+                seen.add(f["id"])
+                content_key = f.get("md5Checksum") or f.get("modifiedTime") or f.get("createdTime")
+                row = self._conn.execute("SELECT imported_key FROM files WHERE file_id = ?", (f["id"],)).fetchone()
+                if row is None or row[0] is None:
+                    counts["new"] += 1
+                elif row[0] != content_key:
+                    counts["changed"] += 1
+                else:
+                    counts["unchanged"] += 1
+                status = "imported" if row is not None and row[0] == content_key else "pending"
+                self._conn.execute(
+                    "INSERT INTO files (file_id, name, created_time, content_key, status) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT(file_id) DO UPDATE SET name = excluded.name, created_time = excluded.created_time, "
+                    "content_key = excluded.content_key, status = excluded.status",
+                    (f["id"], f.get("name"), f.get("createdTime"), content_key, status),
+                )
+            missing = [
+                (file_id,) for file_id, in self._conn.execute("SELECT file_id FROM files WHERE status != 'deleted'")
+                if file_id not in seen
+            ]
+            self._conn.executemany("UPDATE files SET status = 'deleted' WHERE file_id = ?", missing)
+            counts["deleted"] = len(missing)
+            self._conn.execute("COMMIT")
+        return counts
+
+    def pending(self, limit: int = None):
+        """Return (file_id, content_key) for pending files, newest first"""
+        sql = "SELECT file_id, content_key FROM files WHERE status = 'pending' ORDER BY created_time DESC"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        with self._lock:
+            return self._conn.execute(sql).fetchall()
+
+    def mark_imported(self, files):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE files SET status = 'imported', imported_key = ?, imported_at = ?, last_error = NULL "
+                "WHERE file_id = ? AND content_key = ?",
+                [(content_key, now, file_id, content_key) for file_id, content_key in files],
+            )
+
+    def superseded(self, file_ids):
+        """Return (file_id, rag_file_name) for deleted files and for the given pending files that replace an imported one"""
+        file_ids = set(file_ids)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT file_id, rag_file_name, status FROM files "
+                "WHERE status = 'deleted' OR (status = 'pending' AND rag_file_name IS NOT NULL)"
+            ).fetchall()
+        return [(file_id, rag_file_name) for file_id, rag_file_name, status in rows if status == "deleted" or file_id in file_ids]
+
+    def record_rag_files(self, rag_files: dict):
+        """Store the RAG file name of each imported Drive file that does not have one yet"""
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE files SET rag_file_name = ? WHERE file_id = ? AND imported_key IS NOT NULL AND rag_file_name IS NULL",
+                [(rag_file_name, file_id) for file_id, rag_file_name in rag_files.items()],
+            )
+
+    def mark_removed(self, file_id: str):
+        """Forget a removed RAG file; deleted files leave the manifest, changed files stay pending"""
+        with self._lock:
+            self._conn.execute("DELETE FROM files WHERE file_id = ? AND status = 'deleted'", (file_id,))
+            self._conn.execute("UPDATE files SET rag_file_name = NULL WHERE file_id = ?", (file_id,))
+
+    def mark_failed(self, files, error: str):
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE files SET last_error = ? WHERE file_id = ?",
+                [(error, file_id) for file_id, _ in files],
+            )
+
+    def stats(self):
+        with self._lock:
+            return dict(self._conn.execute("SELECT status, COUNT(*) FROM files GROUP BY status").fetchall())
+
+
+def build_drive_service():
+    """Build a read-only Drive client from application default credentials"""
+    import google.auth
+    from googleapiclient.discovery import build
+
+    creds, _ = google.auth.default(scopes=["https://www.googleapis.com/auth/drive.readonly"])
+    return build("drive", "v3", credentials=creds)
+
+
+def list_drive_files(drive_svc, folder_id: str = DRIVE_FOLDER_ID):
+    """Yield every file in a Drive folder with the fields needed to detect changes"""
+    page_token = None
+    while True:
+        resp = drive_svc.files().list(
+            q=f"'{folder_id}' in parents and trashed = false",
+            fields="nextPageToken, files(id, name, createdTime, modifiedTime, md5Checksum)",
+            pageSize=1000,
+            pageToken=page_token
+        ).execute()
+        yield from resp.get("files", [])
+        page_token = resp.get("nextPageToken")
+        if not page_token:
+            break
+
+
+def chunked(lst, n):
+    """Utility to split a list into chunks of size n"""
+    for i in range(0, len(lst), n):
+        yield lst[i : i + n]
+
+
+def list_rag_files(corpus_name: str) -> dict:
+    """Map each Drive file id in the RAG corpus to its RAG file resource name"""
+    from vertexai import rag
+
+    rag_files = {}
+    for rag_file in rag.list_files(corpus_name):
+        for resource in rag_file.google_drive_source.resource_ids:
+            rag_files[resource.resource_id] = rag_file.name
+    return rag_files
+
+
+def delete_rag_file(rag_file_name: str):
+    """Delete one RAG file from its corpus"""
+    from vertexai import rag
+
+    rag.delete_file(rag_file_name)
+
+
+def remove_superseded(manifest: Manifest, file_ids, delete_file_fn=delete_rag_file) -> set:
+    """
+    Delete the RAG files of Drive files that were deleted, or changed and are about to be imported again,
+    so the corpus never holds two versions of a file. Returns the ids whose old RAG file could not be deleted.
+    """
+    failed = set()
+    for file_id, rag_file_name in manifest.superseded(file_ids):
+        if rag_file_name:
+            try:
+                delete_file_fn(rag_file_name)
+            except Exception as e:
+                # The row keeps its RAG file name, so the delete is retried on the next run
+                print(f"  Deleting {rag_file_name} failed: {e}")
+                failed.add(file_id)
+                continue
+        manifest.mark_removed(file_id)
+    return failed
+
+
+def import_batch(corpus_name: str, batch, embedding_requests_per_min: int, import_limiter: RateLimiter):
+    """Import one batch of Drive files into the RAG corpus and return the imported count"""
+    from vertexai import rag
+
+    import_limiter.acquire()
+    result = rag.import_files(
+        corpus_name,
+        paths=[f"https://drive.google.com/file/d/{file_id}" for file_id, _ in batch],
+        transformation_config=rag.TransformationConfig(
+            rag.ChunkingConfig(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP),
+        ),
+        max_embedding_requests_per_min=embedding_requests_per_min,
+    )
+    return result.imported_rag_files_count
+
+
+def ingest(corpus_name: str, manifest: Manifest, drive_files=None, batch_size: int = BATCH_SIZE, max_workers: int = MAX_WORKERS,
+           max_embedding_requests_per_min: int = MAX_EMBEDDING_REQUESTS_PER_MIN, max_files: int = MAX_FILES,
+           import_batch_fn=import_batch, list_rag_files_fn=list_rag_files, delete_file_fn=delete_rag_file):
+    """
+    Sync the manifest with the Drive listing, delete the RAG files of deleted and changed files,
+    then import new and changed files in concurrent batches.
+    The embedding budget is split across workers so concurrent imports stay under
+    max_embedding_requests_per_min in total.
+    """
+    if drive_files is not None:
+        print(f"Manifest sync: {manifest.sync(drive_files)}")
+    pending = manifest.pending(max_files)
+    # Fills in RAG file names for files imported before a run recorded them
+    manifest.record_rag_files(list_rag_files_fn(corpus_name))
+    # A changed file whose old version is still in the corpus waits for the next run
+    failed = remove_superseded(manifest, [file_id for file_id, _ in pending], delete_file_fn)
+    pending = [row for row in pending if row[0] not in failed]
+    batches = list(chunked(pending, batch_size))
+    if not batches:
+        print("Corpus is up to date")
+        return 0
+
+    workers = min(max_workers, len(batches))
+    per_worker_budget = max(1, max_embedding_requests_per_min // workers)
+    import_limiter = RateLimiter(MAX_IMPORTS_PER_MIN, burst=workers)
+    imported = 0
+
+    print(f"Importing {len(pending)} files in {len(batches)} batches with {workers} workers…")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(import_batch_fn, corpus_name, batch, per_worker_budget, import_limiter): batch
+            for batch in batches
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            batch = futures[future]
+            try:
+                count = future.result()
+            except Exception as e:
+                # Failed batches stay pending and are retried on the next run
+                print(f"  Batch {done}/{len(batches)} failed: {e}")
+                manifest.mark_failed(batch, str(e))
+                continue
+            manifest.mark_imported(batch)
+            imported += len(batch)
+            print(f"  Batch {done}/{len(batches)} → Imported {count} files")
+    manifest.record_rag_files(list_rag_files_fn(corpus_name))
+    print(f"Done — manifest: {manifest.stats()}")
+    return imported
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Incrementally import Drive files into the Vertex RAG corpus")
+    parser.add_argument("corpus_name", help="RAG corpus resource name, projects/…/locations/…/ragCorpora/…")
+    parser.add_argument("--folder-id", default=DRIVE_FOLDER_ID)
+    parser.add_argument("--manifest", default=MANIFEST_PATH)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS)
+    parser.add_argument("--max-embedding-requests-per-min", type=int, default=MAX_EMBEDDING_REQUESTS_PER_MIN)
+    parser.add_argument("--max-files", type=int, default=MAX_FILES)
+    parser.add_argument("--resume", action="store_true", help="Only import files already pending in the manifest, skip listing Drive")
+    args = parser.parse_args()
+
+    import vertexai
+
+    # The corpus name carries the project and location the import runs in
+    parts = args.corpus_name.split("/")
+    vertexai.init(project=parts[1], location=parts[3])
+
+    manifest = Manifest(args.manifest)
+    drive_files = None if args.resume else list_drive_files(build_drive_service(), args.folder_id)
+    ingest(
+        args.corpus_name,
+        manifest,
+        drive_files,
+        batch_size=args.batch_size,
+        max_workers=args.workers,
+        max_embedding_requests_per_min=args.max_embedding_requests_per_min,
+        max_files=args.max_files,
+    )
+
+
+if __name__ == "__main__":
+    main()
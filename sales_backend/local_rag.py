@@ -0,0 +1,295 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Iterable, List, Tuple
+
+import numpy as np
+
+from shared_backend.tracing import set_attribute, traced
+
+# Matches the chunking used for the Vertex RAG corpus in rag.ipynb (512 tokens, 100 overlap), in words
+CHUNK_SIZE = 512
+CHUNK_OVERLAP = 100
+# Rows scored per matrix multiply; blocks are scored in parallel and keep the working set small
+SEARCH_BLOCK_ROWS = 32768
+DEFAULT_TOP_K = 5
+
+EMBEDDINGS_FILE = "embeddings.f32"
+CHUNKS_FILE = "chunks.jsonl"
+OFFSETS_FILE = "offsets.i64"
+META_FILE = "meta.json"
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+# Search is memory-bandwidth bound; numpy releases the GIL so blocks can be scored on every core
+_search_executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix="local-rag-search")
+
+
+def chunk_text(text: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> List[str]:
+    """Split text into overlapping chunks of roughly chunk_size words"""
+    words = text.split()
+    if not words:
+        return []
+    step = max(1, chunk_size - overlap)
+    chunks = []
+    for start in range(0, len(words), step):
+        chunks.append(" ".join(words[start:start + chunk_size]))
+        if start + chunk_size >= len(words):
+            break
+    return chunks
+
+
+class HashingEmbedder:
+    """
+    Deterministic local embedder using signed feature hashing of words and word bigrams.
+    Needs no network or model, so it stands in for a real embedder in tests and offline runs.
+    """
+
+    name = "hashing"
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+
+    def _embed(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        tokens = _TOKEN_PATTERN.findall(text.lower())
+        features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+        for feature in features:
+            digest = hashlib.blake2b(feature.encode(), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dim
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        return vector
+
+    def embed_documents(self, texts: List[str]) -> np.ndarray:
+        return normalize_rows(np.stack([self._embed(text) for text in texts]))
+
+    def embed_query(self, text: str) -> np.ndarray:
+        return normalize_rows(self._embed(text)[None, :])[0]
+
+
+class GeminiEmbedder:
+    """Embedder backed by the Gemini embedding API"""
+
+    name = "gemini"
+
+    def __init__(self, client, model: str = "gemini-embedding-001", dim: int = 768, batch_size: int = 100):
+        self.client = client
+        self.model = model
+        self.dim = dim
+        self.batch_size = batch_size
+
+    def _embed(self, texts: List[str], task_type: str) -> np.ndarray:
+        from google.genai import types
+
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            response = self.client.models.embed_content(
+                model=self.model,
+                contents=texts[start:start + self.batch_size],
+                config=types.EmbedContentConfig(task_type=task_type, output_dimensionality=self.dim),
+            )
+            vectors.extend(embedding.values for embedding in response.embeddings)
+        return normalize_rows(np.asarray(vectors, dtype=np.float32))
+
+    def embed_documents(self, texts: List[str]) -> np.ndarray:
+        return self._embed(texts, "RETRIEVAL_DOCUMENT")
+
+    def embed_query(self, text: str) -> np.ndarray:
+        return self._embed([text], "RETRIEVAL_QUERY")[0]
+
+
+def create_embedder(name: str, api_key: str = None, dim: int = None):
+    """Create an embedder by name: 'hashing' for the local stand-in or 'gemini'"""
+    if name == HashingEmbedder.name:
+        return HashingEmbedder(dim or 256)
+    if name == GeminiEmbedder.name:
+        from shared_backend.clients import get_genai_client
+
+        api_key = api_key or os.getenv("GEMINI_API_KEY")
+        if not api_key:
+            raise ValueError("No API key provided. Please provide a Gemini API key.")
+        return GeminiEmbedder(get_genai_client(api_key), dim=dim or 768)
+    raise ValueError(f"Unknown embedder: {name}")
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """L2-normalize each row so dot products are cosine similarities"""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32, copy=False)
+
+
+def build_index(documents: Iterable[Tuple[str, str]], index_dir: str, embedder, batch_size: int = 256) -> int:
+    """
+    Chunk and embed (source, text) documents into index_dir.
+    Embeddings are appended to a raw float32 file batch by batch, so the corpus never has to fit in RAM.
+    Returns the number of chunks indexed.
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    count = 0
+    pending = []
+
+    with open(os.path.join(index_dir, EMBEDDINGS_FILE), "wb") as embeddings_file, \
+            open(os.path.join(index_dir, CHUNKS_FILE), "wb") as chunks_file, \
+            open(os.path.join(index_dir, OFFSETS_FILE), "wb") as offsets_file:
+
+        def flush():
+            embeddings = embedder.embed_documents([text for _, text in pending])
+            embeddings_file.write(np.ascontiguousarray(embeddings, dtype=np.float32).tobytes())
+            for source, text in pending:
+                offsets_file.write(np.int64(chunks_file.tell()).tobytes())
+                chunks_file.write((json.dumps({"source": source, "text": text}) + "\n").encode("utf-8"))
+            pending.clear()
+
+        for source, text in documents:
+            for chunk in chunk_text(text):
+                pending.append((source, chunk))
+                count += 1
+                if len(pending) >= batch_size:
+                    flush()
+        if pending:
+            flush()
+
+    with open(os.path.join(index_dir, META_FILE), "w") as f:
+        json.dump({"count": count, "dim": embedder.dim, "embedder": embedder.name}, f)
+    return count
+
+
+def iter_text_files(source_dir: str):
+    """Yield (path, text) for every .txt file under source_dir"""
+    for root, _, files in os.walk(source_dir):
+        for filename in sorted(files):
+            if filename.endswith(".txt"):
+                path = os.path.join(root, filename)
+                with open(path, encoding="utf-8", errors="replace") as f:
+                    yield path, f.read()
+
+
+class LocalVectorIndex:
+    """
+    Memory-mapped embedding matrix with brute-force top-k cosine search.
+    The matrix is paged in by the OS instead of being loaded onto the heap,
+    and chunk texts are read from disk by offset only for the results.
+    """
+
+    def __init__(self, index_dir: str):
+        with open(os.path.join(index_dir, META_FILE)) as f:
+            self.meta = json.load(f)
+        self.index_dir = index_dir
+        self.count = self.meta["count"]
+        self.dim = self.meta["dim"]
+        self.embedder_name = self.meta["embedder"]
+        if self.count:
+            self.embeddings = np.memmap(os.path.join(index_dir, EMBEDDINGS_FILE), dtype=np.float32, mode="r", shape=(self.count, self.dim))
+            self.offsets = np.memmap(os.path.join(index_dir, OFFSETS_FILE), dtype=np.int64, mode="r", shape=(self.count,))
+        self._chunks_file = open(os.path.join(index_dir, CHUNKS_FILE), "rb")
+        self._chunks_lock = threading.Lock()
+
+    def _top_k_in_block(self, query: np.ndarray, start: int, k: int):
+        scores = self.embeddings[start:start + SEARCH_BLOCK_ROWS] @ query
+        top = min(k, len(scores))
+        block_ids = np.argpartition(-scores, top - 1)[:top]
+        return block_ids + start, scores[block_ids]
+
+    def search(self, query_embedding: np.ndarray, k: int = DEFAULT_TOP_K) -> List[Tuple[int, float]]:
+        """Return the k most similar (chunk id, score) pairs, best first"""
+        if not self.count:
+            return []
+        query = np.asarray(query_embedding, dtype=np.float32)
+        starts = range(0, self.count, SEARCH_BLOCK_ROWS)
+        if len(starts) == 1:
+            block_results = [self._top_k_in_block(query, 0, k)]
+        else:
+            block_results = list(_search_executor.map(lambda start: self._top_k_in_block(query, start, k), starts))
+        best_ids = np.concatenate([ids for ids, _ in block_results])
+        best_scores = np.concatenate([scores for _, scores in block_results])
+        order = np.argsort(-best_scores)[:k]
+        return [(int(best_ids[i]), float(best_scores[i])) for i in order]
+
+    def get_chunk(self, chunk_id: int) -> dict:
+        """Read a chunk's source and text from disk"""
+        with self._chunks_lock:
+            self._chunks_file.seek(int(self.offsets[chunk_id]))
+            return json.loads(self._chunks_file.readline())
+
+    def retrieve(self, query: str, embedder, k: int = DEFAULT_TOP_K) -> List[dict]:
+        """Embed the query and return the top-k chunks with their scores"""
+        if embedder.name != self.embedder_name or embedder.dim != self.dim:
+            raise ValueError(f"Index was built with {self.embedder_name}/{self.dim}, not {embedder.name}/{embedder.dim}")
+        results = []
+        for chunk_id, score in self.search(embedder.embed_query(query), k):
+            chunk = self.get_chunk(chunk_id)
+            chunk["score"] = score
+            results.append(chunk)
+        return results
+
+
+@lru_cache(maxsize=None)
+def open_index(index_dir: str) -> LocalVectorIndex:
+    """Open an index once per process so all sessions share the same memory map"""
+    return LocalVectorIndex(index_dir)
+
+
+def format_passages(passages: List[dict]) -> str:
+    """Format retrieved passages as a numbered context block for the prompt"""
+    return "\n\n".join(
+        f"[{i}] ({os.path.basename(passage['source'])})\n{passage['text']}"
+        for i, passage in enumerate(passages, start=1)
+    )
+
+
+class LocalRagChatSession:
+    """
+    Chat session wrapper that retrieves passages from a local index
+    and injects them into each message before it reaches the model.
+    The excerpts are sent with their turn only; the history keeps the customer's message as typed.
+    """
+
+    def __init__(self, chat_session, index: LocalVectorIndex, embedder, k: int = DEFAULT_TOP_K):
+        self.chat_session = chat_session
+        self.index = index
+        self.embedder = embedder
+        self.k = k
+
+    @traced("rag.retrieve")
+    def augment(self, message: str) -> str:
+        passages = self.index.retrieve(message, self.embedder, self.k)
+        set_attribute("passages", len(passages))
+        if not passages:
+            return message
+        return (
+            "Use these excerpts from Formlabs documents and sales calls if they help answer the customer. "
+            "Do not mention the excerpts to the customer.\n\n"
+            f"{format_passages(passages)}\n\n"
+            f"Customer message: {message}"
+        )
+
+    def send_message(self, message: str):
+        return self.chat_session.send_message(self.augment(message), slot_text=message)
+
+    def send_message_stream(self, message: str):
+        return self.chat_session.send_message_stream(self.augment(message), slot_text=message)
+
+    def __getattr__(self, name):
+        return getattr(self.chat_session, name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a local vector index for the sales agent")
+    parser.add_argument("source_dir", help="Directory of .txt documents, e.g. gong_transcripts/")
+    parser.add_argument("index_dir", help="Directory to write the index to")
+    parser.add_argument("--embedder", default=os.getenv("LOCAL_RAG_EMBEDDER", "gemini"), choices=["gemini", "hashing"])
+    parser.add_argument("--batch-size", type=int, default=256)
+    args = parser.parse_args()
+
+    embedder = create_embedder(args.embedder)
+    count = build_index(iter_text_files(args.source_dir), args.index_dir, embedder, args.batch_size)
+    print(f"Indexed {count} chunks into {args.index_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,333 @@
+import argparse
+import importlib
+import json
+import os
+import random
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+
+from dotenv import load_dotenv
+
+from sales_backend.chat import extract_json_from_response, build_system_instruction, extract_sales_slots
+from sales_backend.gong import OUTPUT_DIR as TRANSCRIPTS_DIR
+from shared_backend.prompt_cache import (
+    cached_config, invalidate_prompt_cache, is_prompt_cache_error, prompt_cache_handle, prompt_digest, record_prompt_cache_turn,
+)
+from shared_backend.scheduler import (
+    GEMINI_MAX_CONCURRENCY, PRIORITY_BACKGROUND, QuotaExceeded, get_scheduler, is_rate_limit_error, quota_owner,
+)
+
+load_dotenv()
+
+QUALIFY_MODEL = os.getenv("QUALIFY_MODEL", "gemini-2.5-flash")
+QUALIFY_OUTPUT = os.getenv("QUALIFY_OUTPUT", "qualified_leads.jsonl")
+# Defaults to the scheduler's concurrency so the per-model rate limit, not this, sets throughput
+QUALIFY_CONCURRENCY = int(os.getenv("QUALIFY_CONCURRENCY", str(GEMINI_MAX_CONCURRENCY)))
+# Batch requests wait behind live chats; give up on a wait only after this long, then retry
+QUALIFY_QUEUE_TIMEOUT_SECONDS = float(os.getenv("QUALIFY_QUEUE_TIMEOUT_SECONDS", "300"))
+QUALIFY_MAX_ATTEMPTS = int(os.getenv("QUALIFY_MAX_ATTEMPTS", "5"))
+# Parquet output is written as one part file per this many transcripts
+PARQUET_PART_SIZE = 500
+
+LEAD_FIELDS = (
+    "email",
+    "customer_initial_question",
+    "overview_of_customers_business_and_use_case_for_3d_printing",
+    "budget",
+    "estimated_purchase_date",
+    "is_qualified",
+)
+
+QUALIFY_INSTRUCTION = (
+    "You are reviewing the transcript of a recorded sales call instead of chatting with the customer. "
+    "Apply the qualification rules of the sales representative below to what the customer said on the call "
+    "and reply with only the JSON object they describe, using null for anything the call did not cover.\n"
+    + build_system_instruction()
+)
+
+_TRANSCRIPT_NAME = re.compile(r"gong_transcript_(.+)\.txt$")
+
+
+class GeminiQualifier:
+    """Qualifies transcripts with Gemini, admitted by the model's quota scheduler behind live chats"""
+
+    def __init__(self, api_key: str = None, model: str = QUALIFY_MODEL):
+        from shared_backend.clients import get_genai_client
+
+        api_key = api_key or os.getenv("GEMINI_API_KEY")
+        if not api_key:
+            raise ValueError("No API key provided. Please provide a Gemini API key.")
+        from google.genai import types
+
+        self.model = model
+        self.client = get_genai_client(api_key)
+        self.config = types.GenerateContentConfig(
+            system_instruction=QUALIFY_INSTRUCTION, response_mime_type="application/json", temperature=0,
+        )
+        # The instruction is the same for every transcript, so it is sent by reference to a prompt cache once one is ready
+        self.digest = prompt_digest(self.config)
+
+    def generate(self, transcript: str) -> str:
+        # Shares the API key's quota with the live chats on the same key
+        scheduler = get_scheduler(self.model, quota_owner(self.client))
+        with scheduler.acquire(PRIORITY_BACKGROUND, timeout=QUALIFY_QUEUE_TIMEOUT_SECONDS):
+            try:
+                response, cache = self._generate(transcript)
+            except Exception as e:
+                if not is_rate_limit_error(e):
+                    raise
+                scheduler.on_throttled()
+                raise QuotaExceeded(f"Gemini rate limit: {e}") from e
+        record_prompt_cache_turn(cache, response.usage_metadata)
+        return response.text
+
+    def _generate(self, transcript: str):
+        """Generate with the cached prompt when there is one, falling back inline if the cache is rejected"""
+        cache = prompt_cache_handle(self.client, self.model, self.config, self.digest)
+        try:
+            config = cached_config(self.config, cache)
+            return self.client.models.generate_content(model=self.model, contents=transcript, config=config), cache
+        except Exception as e:
+            if cache is None or not is_prompt_cache_error(e):
+                raise
+            invalidate_prompt_cache(self.client, cache)
+        return self.client.models.generate_content(model=self.model, contents=transcript, config=self.config), None
+
+
+class StubQualifier:
+    """Local stand-in that reads the lead fields with the chat's slot regexes; no model calls"""
+
+    model = "stub"
+
+    def generate(self, transcript: str) -> str:
+        slots = extract_sales_slots(transcript)
+        return json.dumps({
+            "email": slots.get("email"),
+            "budget": slots.get("budget"),
+            "estimated_purchase_date": slots.get("timeline"),
+            "is_qualified": "Yes" if slots.get("budget") and slots.get("timeline") else "No",
+        })
+
+
+def load_client(name: str):
+    """gemini, stub, or module:factory for any object with generate(transcript) -> str and a model attribute"""
+    if name == "gemini":
+        return GeminiQualifier()
+    if name == "stub":
+        return StubQualifier()
+    module_name, _, attribute = name.partition(":")
+    if not attribute:
+        raise ValueError(f"Unknown client {name!r}; use gemini, stub or module:factory")
+    return getattr(importlib.import_module(module_name), attribute)()
+
+
+def parse_lead(text: str):
+    """The lead JSON from a model reply, whether bare (JSON mode) or fenced like in chat"""
+    try:
+        data = json.loads((text or "").replace("```json", "").replace("```", "").strip())
+    except json.JSONDecodeError:
+        data = extract_json_from_response(text or "")
+    return data if isinstance(data, dict) else None
+
+
+def to_int(value):
+    """Budgets come back as 10000, "10000" or "$10,000"; anything else is dropped"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return int(value)
+    digits = re.sub(r"[^\d.]", "", str(value or ""))
+    try:
+        return int(float(digits)) if digits else None
+    except ValueError:
+        return None
+
+
+def qualify_transcript(client, path: str) -> dict:
+    """Run one transcript through the client, retrying when its request is shed or rate limited"""
+    with open(path, encoding="utf-8") as f:
+        transcript = f.read()
+    for attempt in range(QUALIFY_MAX_ATTEMPTS):
+        try:
+            text = client.generate(transcript)
+            break
+        except QuotaExceeded:
+            if attempt + 1 == QUALIFY_MAX_ATTEMPTS:
+                raise
+            time.sleep(random.uniform(0, min(60.0, 2.0 ** attempt)))
+
+    name = os.path.basename(path)
+    match = _TRANSCRIPT_NAME.match(name)
+    lead = parse_lead(text) or {}
+    record = {"file": name, "call_id": match.group(1) if match else None}
+    record.update((field, lead.get(field)) for field in LEAD_FIELDS)
+    record["budget"] = to_int(record["budget"])
+    for field in LEAD_FIELDS:
+        if record[field] is not None and not isinstance(record[field], (str, int)):
+            record[field] = str(record[field])
+    record["raw"] = None if lead else text
+    record["model"] = getattr(client, "model", None)
+    record["qualified_at"] = datetime.now(timezone.utc).isoformat()
+    return record
+
+
+class JsonlWriter:
+    """Appends one record per line, flushed as it is written, so an interrupted run loses nothing"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def finished(self) -> set:
+        if not os.path.exists(self.path):
+            return set()
+        done = set()
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    done.add(json.loads(line)["file"])
+                except (json.JSONDecodeError, KeyError):
+                    # A line cut short by a crash; that transcript is qualified again
+                    continue
+        return done
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._file = open(self.path, "a+", encoding="utf-8")
+        if self._file.tell():
+            self._file.seek(self._file.tell() - 1)
+            if self._file.read(1) != "\n":
+                # End the line a crash cut short so the next record starts on its own line
+                self._file.write("\n")
+        return self
+
+    def write(self, record: dict):
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+
+    def __exit__(self, *exc):
+        self._file.close()
+
+
+class ParquetWriter:
+    """Writes records to a directory of Parquet part files, a part per PARQUET_PART_SIZE records"""
+
+    def __init__(self, path: str, part_size: int = PARQUET_PART_SIZE):
+        import pyarrow as pa
+
+        self.path = path
+        self.part_size = part_size
+        self.schema = pa.schema(
+            [("file", pa.string()), ("call_id", pa.string())]
+            + [(field, pa.int64() if field == "budget" else pa.string()) for field in LEAD_FIELDS]
+            + [("raw", pa.string()), ("model", pa.string()), ("qualified_at", pa.string())]
+        )
+        self._rows = []
+
+    def _parts(self):
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(name for name in os.listdir(self.path) if name.startswith("part-") and name.endswith(".parquet"))
+
+    def finished(self) -> set:
+        import pyarrow.parquet as pq
+
+        done = set()
+        for name in self._parts():
+            done.update(pq.read_table(os.path.join(self.path, name), columns=["file"])["file"].to_pylist())
+        return done
+
+    def __enter__(self):
+        os.makedirs(self.path, exist_ok=True)
+        return self
+
+    def write(self, record: dict):
+        self._rows.append(record)
+        if len(self._rows) >= self.part_size:
+            self.flush()
+
+    def flush(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if not self._rows:
+            return
+        part = os.path.join(self.path, f"part-{time.time_ns()}.parquet")
+        pq.write_table(pa.Table.from_pylist(self._rows, schema=self.schema), f"{part}.tmp")
+        os.replace(f"{part}.tmp", part)
+        self._rows = []
+
+    def __exit__(self, *exc):
+        self.flush()
+
+
+def open_writer(output: str):
+    """Parquet for a .parquet path (written as a directory of parts), JSONL otherwise"""
+    return ParquetWriter(output) if output.endswith(".parquet") else JsonlWriter(output)
+
+
+def iter_transcripts(input_dir: str, done: set):
+    """Transcript paths in input_dir not yet in the output, listed lazily so huge archives start at once"""
+    with os.scandir(input_dir) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name.endswith(".txt") and entry.name not in done:
+                yield entry.path
+
+
+def qualify_all(client, input_dir: str = TRANSCRIPTS_DIR, output: str = QUALIFY_OUTPUT,
+                concurrency: int = QUALIFY_CONCURRENCY, limit: int = None) -> dict:
+    """Qualify every transcript in input_dir that the output does not have yet, concurrency at a time"""
+    writer = open_writer(output)
+    done = writer.finished()
+    counts = {"skipped": len(done), "qualified": 0, "is_qualified": 0, "failed": 0}
+    in_flight = {}
+    start = time.perf_counter()
+    print(f"Qualifying transcripts in {input_dir} with {getattr(client, 'model', client)}; {len(done)} already in {output}")
+
+    def collect(futures):
+        for future in futures:
+            path = in_flight.pop(future)
+            try:
+                record = future.result()
+            except Exception as e:
+                counts["failed"] += 1
+                print(f"  ✗ {os.path.basename(path)}: {e}")
+                continue
+            writer.write(record)
+            counts["qualified"] += 1
+            counts["is_qualified"] += record.get("is_qualified") == "Yes"
+            if counts["qualified"] % 100 == 0:
+                rate = counts["qualified"] / (time.perf_counter() - start)
+                print(f"  → {counts['qualified']} qualified ({rate:.1f}/s)")
+
+    with writer, ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="qualify") as executor:
+        for number, path in enumerate(iter_transcripts(input_dir, done)):
+            if limit is not None and number >= limit:
+                break
+            # Keep the pool fed without reading the whole archive into the queue
+            if len(in_flight) >= concurrency * 2:
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(finished)
+            in_flight[executor.submit(qualify_transcript, client, path)] = path
+        while in_flight:
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            collect(finished)
+
+    counts["seconds"] = round(time.perf_counter() - start, 1)
+    print(f"\nDone — qualified {counts['qualified']} transcripts ({counts['is_qualified']} qualified leads), "
+          f"{counts['failed']} failed, {counts['skipped']} skipped in {counts['seconds']}s.")
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Qualify downloaded Gong transcripts as leads in bulk")
+    parser.add_argument("--input-dir", default=TRANSCRIPTS_DIR)
+    parser.add_argument("--output", default=QUALIFY_OUTPUT, help="JSONL file, or a .parquet directory of part files")
+    parser.add_argument("--client", default="gemini", help="gemini, stub, or module:factory")
+    parser.add_argument("--concurrency", type=int, default=QUALIFY_CONCURRENCY)
+    parser.add_argument("--limit", type=int, help="Qualify at most this many new transcripts")
+    args = parser.parse_args()
+    qualify_all(load_client(args.client), args.input_dir, args.output, args.concurrency, args.limit)
+
+
+if __name__ == "__main__":
+    main()
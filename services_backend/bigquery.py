@@ -1,56 +1,364 @@
 import os
-from google.cloud import bigquery 
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from services_backend.serials import PRINTER_LINES, canonical_printer_serial
+from shared_backend.cache import TTLCache
+from shared_backend.startup import timed_init
+from shared_backend.tracing import current_context, percentile, set_attribute, traced
 
 if os.environ.get('HACKATHON_BIGQUERY_KEY') is not None:
    GOOGLE_APPLICATION_CREDENTIALS = os.getenv('HACKATHON_BIGQUERY_KEY')
 
-bigquery_client = bigquery.Client(project='formlabs-data-prod')
+BIGQUERY_PROJECT = os.getenv("BIGQUERY_PROJECT", "formlabs-data-prod")
 
+# Bulk reads stream results over the BigQuery Storage Read API when google-cloud-bigquery-storage is installed
+BIGQUERY_STORAGE_API = os.getenv("BIGQUERY_STORAGE_API", "1") == "1"
 
-def run_recent_jobs_query(printer_serial):
+# Every query's dry-run estimate is checked against this cap; it is also set as maximum_bytes_billed
+BIGQUERY_MAX_BYTES_SCANNED = int(float(os.getenv("BIGQUERY_MAX_BYTES_SCANNED", str(10 * 1024 ** 3))))
+BIGQUERY_DRY_RUN = os.getenv("BIGQUERY_DRY_RUN", "1") == "1"
+# Dry-run estimates per query shape and window are reused for this long
+DRY_RUN_CACHE_TTL_SECONDS = float(os.getenv("DRY_RUN_CACHE_TTL_SECONDS", "3600"))
+# Recent job lookups read the last 7 days of prints, widening to 30 and then 180 days while nothing is found
+RECENT_JOBS_LOOKBACK_DAYS = [int(days) for days in os.getenv("RECENT_JOBS_LOOKBACK_DAYS", "7,30,180").split(",")]
+
+_bigquery_client = None
+_bigquery_client_lock = threading.Lock()
+_bqstorage_client = None
+_dry_run_cache = TTLCache(maxsize=256, ttl=DRY_RUN_CACHE_TTL_SECONDS)
+
+# Recent job lookups are cached per canonical serial so repeat lookups skip BigQuery
+RECENT_JOBS_CACHE_TTL_SECONDS = float(os.getenv("RECENT_JOBS_CACHE_TTL_SECONDS", "300"))
+RECENT_JOBS_CACHE_SIZE = int(os.getenv("RECENT_JOBS_CACHE_SIZE", "1024"))
+# Concurrent lookups of the same serial share a single BigQuery job
+RECENT_JOBS_SINGLE_FLIGHT = os.getenv("RECENT_JOBS_SINGLE_FLIGHT", "1") == "1"
+
+recent_jobs_cache = TTLCache(maxsize=RECENT_JOBS_CACHE_SIZE, ttl=RECENT_JOBS_CACHE_TTL_SECONDS)
+_in_flight_lookups = {}
+_in_flight_lock = threading.Lock()
+_prefetch_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="recent-jobs-prefetch")
+
+RECENT_JOBS_COLUMNS = "pr.printer_serial, pr.print_guid, j.name, pr.print_started_at"
+
+
+class QueryTooExpensive(Exception):
+    """Raised when a query's dry run estimates more bytes than the cap allows"""
+
+
+class QueryStats:
+    """Process-wide bytes scanned and elapsed time per named query"""
+
+    def __init__(self, window: int = 1000):
+        self._lock = threading.Lock()
+        self._queries = {}
+        self.window = window
+
+    def _stats(self, name: str) -> dict:
+        return self._queries.setdefault(name, {
+            "calls": 0, "bytes_scanned": 0, "bytes_estimated": 0, "rejected": 0, "narrowed": 0, "widened": 0,
+            "elapsed": deque(maxlen=self.window),
+        })
+
+    def record(self, name: str, bytes_scanned: int, bytes_estimated: int, elapsed: float):
+        with self._lock:
+            stats = self._stats(name)
+            stats["calls"] += 1
+            stats["bytes_scanned"] += bytes_scanned or 0
+            stats["bytes_estimated"] += bytes_estimated or 0
+            stats["elapsed"].append(elapsed)
+
+    def count(self, name: str, counter: str):
+        with self._lock:
+            self._stats(name)[counter] += 1
+
+    def summary(self) -> dict:
+        """Calls, total bytes, rejections, window changes and latency percentiles per query"""
+        with self._lock:
+            return {
+                name: dict(
+                    {key: value for key, value in stats.items() if key != "elapsed"},
+                    elapsed_p50=percentile(stats["elapsed"], 50),
+                    elapsed_p95=percentile(stats["elapsed"], 95),
+                )
+                for name, stats in self._queries.items()
+            }
+
+
+query_stats = QueryStats()
+
+
+def build_print_query(select: str, join_job: bool = True, order_by: str = None, limit: int = None) -> str:
     """
-    Run a query to get recent jobs for a specific printer serial
-    Returns a tuple: (full_results, job_names_string)
+    SQL over form4_logs.print (aliased pr, with form4_logs.job as j when join_job) that is always bounded to
+    print_started_at >= @since, so only recent partitions are read, and to printer_serial IN @printer_serials,
+    the clustering column, on both tables. Pair it with print_query_parameters.
     """
-    recent_jobs_query = f"""
-    SELECT pr.printer_serial, pr.print_guid, j.name, pr.print_started_at
-    FROM form4_logs.print AS pr
-    INNER JOIN form4_logs.job AS j 
+    sql = f"""
+    SELECT {select}
+    FROM form4_logs.print AS pr"""
+    if join_job:
+        sql += """
+    INNER JOIN form4_logs.job AS j
     ON pr.printer_serial = j.printer_serial
-    AND pr.job_guid = j.job_guid
-    WHERE pr.printer_serial = '{printer_serial}'
-    ORDER BY print_started_at DESC
-    LIMIT 5
+    AND pr.job_guid = j.job_guid"""
+    sql += """
+    WHERE pr.print_started_at >= @since
+    AND pr.printer_serial IN UNNEST(@printer_serials)"""
+    if join_job:
+        sql += """
+    AND j.printer_serial IN UNNEST(@printer_serials)"""
+    if order_by:
+        sql += f"""
+    ORDER BY {order_by}"""
+    if limit:
+        sql += f"""
+    LIMIT {int(limit)}"""
+    return sql + "\n"
+
+
+def print_query_parameters(printer_serials: list, since: datetime) -> list:
+    from google.cloud import bigquery
+
+    return [
+        bigquery.ArrayQueryParameter("printer_serials", "STRING", list(printer_serials)),
+        bigquery.ScalarQueryParameter("since", "TIMESTAMP", since),
+    ]
+
+
+def serial_variants(printer_serial: str) -> list:
+    """Every spelling stored in the logs for a serial in any casing, e.g. CalmOtter, Form4-CalmOtter and Form4L-CalmOtter"""
+    serial_name = normalize_printer_serial(printer_serial)
+    return [serial_name] + [f"{line}-{serial_name}" for line in PRINTER_LINES]
+
+
+def estimate_bytes(query_string: str, query_parameters=(), cache_key=None) -> int:
+    """Bytes the query would scan, from a dry run; estimates are cached per cache_key"""
+    from google.cloud import bigquery
+
+    if cache_key is not None:
+        cached = _dry_run_cache.get(cache_key)
+        if cached is not None:
+            return cached
+    job_config = bigquery.QueryJobConfig(query_parameters=list(query_parameters), dry_run=True, use_query_cache=False)
+    estimated = get_bigquery_client().query(query_string, job_config=job_config).total_bytes_processed or 0
+    if cache_key is not None:
+        _dry_run_cache.set(cache_key, estimated)
+    return estimated
+
+
+def run_guarded_query(name: str, query_string: str, query_parameters=(), max_bytes: int = None, estimate_key=None):
     """
-    
+    Run a query after checking its dry-run estimate against max_bytes (BIGQUERY_MAX_BYTES_SCANNED by default),
+    with the cap also set as maximum_bytes_billed. Records bytes scanned and elapsed time; returns the row iterator.
+    """
+    from google.cloud import bigquery
+
+    max_bytes = BIGQUERY_MAX_BYTES_SCANNED if max_bytes is None else max_bytes
+    estimated = None
+    if BIGQUERY_DRY_RUN:
+        estimated = estimate_bytes(query_string, query_parameters, estimate_key)
+        set_attribute("bytes_estimated", estimated)
+        if estimated > max_bytes:
+            query_stats.count(name, "rejected")
+            raise QueryTooExpensive(f"{name} would scan {estimated / 1024 ** 2:,.0f} MiB, over the {max_bytes / 1024 ** 2:,.0f} MiB cap")
+
+    start = time.perf_counter()
+    job_config = bigquery.QueryJobConfig(query_parameters=list(query_parameters), maximum_bytes_billed=max_bytes)
+    query_job = get_bigquery_client().query(query_string, job_config=job_config)
+    rows = query_job.result()
+    elapsed = time.perf_counter() - start
+    bytes_scanned = getattr(query_job, "total_bytes_processed", None) or 0
+    query_stats.record(name, bytes_scanned, estimated, elapsed)
+    set_attribute("bytes_scanned", bytes_scanned)
+    set_attribute("query_ms", round(elapsed * 1000, 3))
+    return rows
+
+
+def run_print_query(name: str, select: str, printer_serials: list, lookback_days=RECENT_JOBS_LOOKBACK_DAYS, **options) -> list:
+    """
+    Run a build_print_query query over the first lookback window, widening through lookback_days while it
+    returns nothing. A first window over the bytes cap is halved until it fits; a wider one ends the search.
+    """
+    sql = build_print_query(select, **options)
+    rows = []
+    for attempt, days in enumerate(lookback_days):
+        while True:
+            since = (datetime.now(timezone.utc) - timedelta(days=days)).replace(hour=0, minute=0, second=0, microsecond=0)
+            try:
+                rows = [dict(row) for row in run_guarded_query(
+                    name, sql, print_query_parameters(printer_serials, since), estimate_key=(sql, days),
+                )]
+                break
+            except QueryTooExpensive:
+                if attempt > 0:
+                    set_attribute("lookback_days", lookback_days[attempt - 1])
+                    return rows
+                if days <= 1:
+                    raise
+                days = days // 2
+                query_stats.count(name, "narrowed")
+        set_attribute("lookback_days", days)
+        if rows:
+            break
+        if attempt + 1 < len(lookback_days):
+            query_stats.count(name, "widened")
+    return rows
+
+
+def get_bigquery_client():
+    """Return the shared BigQuery client, importing the SDK and creating the client on first use"""
+    global _bigquery_client
+    with _bigquery_client_lock:
+        if _bigquery_client is None:
+            with timed_init("bigquery.Client"):
+                from google.cloud import bigquery
+
+                _bigquery_client = bigquery.Client(project=BIGQUERY_PROJECT)
+        return _bigquery_client
+
+
+def get_bqstorage_client():
+    """Return the shared BigQuery Storage read client, or None to download results over REST"""
+    global _bqstorage_client
+    if not BIGQUERY_STORAGE_API:
+        return None
+    with _bigquery_client_lock:
+        if _bqstorage_client is None:
+            try:
+                from google.cloud import bigquery_storage
+            except ImportError:
+                print("google-cloud-bigquery-storage is not installed; reading query results over REST")
+                return None
+            with timed_init("bigquery_storage.BigQueryReadClient"):
+                _bqstorage_client = bigquery_storage.BigQueryReadClient()
+        return _bqstorage_client
+
+
+def strip_printer_line(printer_serial: str) -> str:
+    """Strip the printer line prefix, e.g. Form4-CalmOtter -> CalmOtter"""
+    return re.sub(r'^form\s*4[lb]?[\s_-]+', '', printer_serial.strip(), flags=re.IGNORECASE)
+
+
+def normalize_printer_serial(printer_serial: str) -> str:
+    """
+    The canonical serial the queries are built from (serial_variants), and so the cache key:
+    calmotter, CalmOtter and Form4-CalmOtter all look up the same rows and share an entry
+    """
+    return canonical_printer_serial(printer_serial)
+
+
+def _query_recent_jobs(printer_serial):
+    full_results = run_print_query(
+        "recent_jobs", RECENT_JOBS_COLUMNS, serial_variants(printer_serial), order_by="pr.print_started_at DESC", limit=5,
+    )
+
+    # Extract job names and concatenate them with newlines
+    job_names = [row['name'] for row in full_results if row.get('name')]
+    job_names_string = "\n".join(job_names) if job_names else "No jobs found"
+
+    return full_results, job_names_string
+
+
+def _lookup_and_cache(cache_key, printer_serial):
     try:
-        query_job = bigquery_client.query(recent_jobs_query)
-        results = query_job.result()
-        full_results = [dict(row) for row in results]
-        
-        # Extract job names and concatenate them with newlines
-        job_names = [row['name'] for row in full_results if row.get('name')]
-        job_names_string = "\n".join(job_names) if job_names else "No jobs found"
-        
-        return full_results, job_names_string
+        result = _query_recent_jobs(printer_serial)
     except Exception as e:
+        # Errors are not cached so the next lookup retries
         print(f"Error running query: {e}")
+        set_attribute("error", str(e))
         return [], "Error retrieving jobs"
+    recent_jobs_cache.set(cache_key, result)
+    return result
+
+
+@traced("bigquery.recent_jobs")
+def run_recent_jobs_query(printer_serial):
+    """
+    Run a query to get recent jobs for a specific printer serial
+    Returns a tuple: (full_results, job_names_string)
+    """
+    # The lookup runs on the key itself, so the cached rows are exactly what a query for the key returns
+    cache_key = printer_serial = normalize_printer_serial(printer_serial)
+    cached = recent_jobs_cache.get(cache_key)
+    if cached is not None:
+        set_attribute("cache", "hit")
+        return cached
+    if not RECENT_JOBS_SINGLE_FLIGHT:
+        set_attribute("cache", "miss")
+        return _lookup_and_cache(cache_key, printer_serial)
+
+    with _in_flight_lock:
+        future = _in_flight_lookups.get(cache_key)
+        is_leader = future is None
+        if is_leader:
+            future = Future()
+            _in_flight_lookups[cache_key] = future
+    set_attribute("cache", "miss" if is_leader else "shared")
+    if not is_leader:
+        return future.result()
+
+    try:
+        result = _lookup_and_cache(cache_key, printer_serial)
+        future.set_result(result)
+        return result
+    finally:
+        with _in_flight_lock:
+            _in_flight_lookups.pop(cache_key, None)
+
+
+def prefetch_recent_jobs(printer_serial) -> Future:
+    """
+    Start a recent jobs lookup in the background.
+    A later run_recent_jobs_query for the same serial picks up the cached or in-flight result.
+    """
+    # Run in a copy of the caller's context so the lookup's span is tagged with the turn it belongs to
+    return _prefetch_executor.submit(current_context().run, run_recent_jobs_query, printer_serial)
 
 
+def recent_jobs_cache_stats():
+    """Return hit/miss counters for the recent jobs cache"""
+    return recent_jobs_cache.stats()
+
+
+def query_stats_summary():
+    """Return bytes scanned and latency per named query for this process"""
+    return query_stats.summary()
+
+
+@traced("bigquery.custom_query")
 def run_custom_query(query_string):
     """
     Run a custom BigQuery query
+    Arbitrary SQL can't be given a time bound safely, so it is only checked against the bytes cap
     """
     try:
-        query_job = bigquery_client.query(query_string)
-        results = query_job.result()
+        results = run_guarded_query("custom", query_string)
         return [dict(row) for row in results]
     except Exception as e:
         print(f"Error running query: {e}")
         return []
 
 
+@traced("bigquery.arrow_query")
+def run_query_arrow(name: str, query_string: str, query_parameters=(), estimate_key=None):
+    """
+    Run a guarded query and return the results as a pyarrow Table, read as record batches
+    (over the Storage Read API when available) instead of one Python dict per row
+    """
+    import pyarrow as pa
+
+    rows = run_guarded_query(name, query_string, query_parameters, estimate_key=estimate_key)
+    batches = list(rows.to_arrow_iterable(bqstorage_client=get_bqstorage_client()))
+    set_attribute("rows", sum(batch.num_rows for batch in batches))
+    if not batches:
+        return rows.to_arrow()
+    return pa.Table.from_batches(batches)
+
+
 # Example usage:
 if __name__ == "__main__":
     # Example: Get recent jobs for a printer
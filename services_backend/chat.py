@@ -1,23 +1,49 @@
-from google import genai
-from google.genai import types
 import re
 import json
-import requests
 from typing import Dict, Any, Optional
 from datetime import date
 import os
 from dotenv import load_dotenv
+from shared_backend.idempotency import submit_once
+from shared_backend.clients import get_genai_client, track_session
+from shared_backend.history import CompactingChat, extract_email
+from shared_backend.router import RoutingChat
+from shared_backend.scheduler import BusyResponse, BUSY_MESSAGE, QuotaExceeded
+from shared_backend.tracing import set_attribute, traced
+from services_backend.bigquery import normalize_printer_serial, run_recent_jobs_query
+from services_backend.serials import detect_printer_serial
 
 load_dotenv()
 
-def create_gemini_chat(client, tools: list):
-    return client.chats.create(
+# Expose the printer job lookup to Pete as a function tool instead of the serial JSON round trip.
+# Gemini 2.5 rejects function declarations combined with Google Search grounding in one request,
+# so a chat with the lookup tool answers from the model's own knowledge.
+JOB_LOOKUP_TOOL = os.getenv("SERVICES_JOB_LOOKUP_TOOL", "1") == "1"
+
+def extract_services_slots(text: str) -> dict:
+    """Pull the email and printer serial out of a customer message"""
+    slots = extract_email(text)
+    printer_serial = detect_printer_serial(text)
+    if printer_serial:
+        slots["printer_serial"] = printer_serial
+    return slots
+
+def create_gemini_chat(client, tools: list, instruction: str = None, history: list = None):
+    from google.genai import types
+
+    # The router moves the conversation between flash and pro per turn; gemini-2.5-pro is the starting model
+    chat_session = RoutingChat(CompactingChat(
+        client,
         model="gemini-2.5-pro",
         config=types.GenerateContentConfig(
             tools=tools,
-            system_instruction=system_instruction,
-        )
-    )
+            system_instruction=instruction or build_system_instruction(),
+        ),
+        history=history,
+        slot_extractors=[extract_services_slots],
+    ))
+    track_session(client, chat_session)
+    return chat_session
 
 def init_genai_client(api_key: str = None):
     """Initialize the Gemini API client with the provided API key"""
@@ -27,16 +53,63 @@ def init_genai_client(api_key: str = None):
     if not api_key:
         raise ValueError("No API key provided. Please provide a Gemini API key.")
     
-    return genai.Client(api_key=api_key)
+    return get_genai_client(api_key)
 
-def create_chat_session(api_key: str = None):
-    """Create a new chat session with the provided API key"""
+def create_chat_session(api_key: str = None, job_lookup_tool: bool = None, history: list = None):
+    """Create a new chat session with the provided API key, optionally continuing a stored history"""
+    if job_lookup_tool is None:
+        job_lookup_tool = JOB_LOOKUP_TOOL
     client = init_genai_client(api_key)
-    return create_gemini_chat(client, [types.Tool(google_search=types.GoogleSearch())])
+    if job_lookup_tool:
+        # Python callables are declared to the model and their calls run locally by CompactingChat
+        return create_gemini_chat(client, [lookup_recent_printer_jobs, lookup_printer_history], build_system_instruction(job_lookup_tool=True), history)
+    from google.genai import types
 
-date = date.today()
+    return create_gemini_chat(client, [types.Tool(google_search=types.GoogleSearch())], history=history)
 
-system_instruction = f"""You are Pete, a friendly and knowledgeable Formlabs Support Agent.
+def lookup_recent_printer_jobs(printer_serial: str) -> dict:
+    """Look up the most recent print jobs for a Formlabs printer from its logs.
+
+    Args:
+        printer_serial: The printer serial name in AdjectiveAnimal format, optionally prefixed with the printer line, e.g. CalmOtter or Form4-CalmOtter.
+
+    Returns:
+        The printer serial and its most recent jobs, newest first, each with the job name and print start time.
+    """
+    full_results, job_names_string = run_recent_jobs_query(printer_serial)
+    if job_names_string == "Error retrieving jobs":
+        return {"printer_serial": printer_serial, "error": "The printer logs could not be retrieved right now."}
+    jobs = [
+        {
+            "job_name": row.get("name"),
+            "print_started_at": row["print_started_at"].isoformat() if row.get("print_started_at") else None,
+        }
+        for row in full_results
+    ]
+    return {"printer_serial": printer_serial, "jobs": jobs}
+
+def lookup_printer_history(printer_serial: str) -> dict:
+    """Summarize a Formlabs printer's print history over the last weeks from its logs.
+
+    Args:
+        printer_serial: The printer serial name in AdjectiveAnimal format, optionally prefixed with the printer line, e.g. CalmOtter or Form4-CalmOtter.
+
+    Returns:
+        Print count, failure rate, failures per week, resin used per material and the most common error codes.
+    """
+    try:
+        from services_backend.print_history import printer_history_summary
+
+        return printer_history_summary(printer_serial)
+    except Exception as e:
+        print(f"Error summarizing print history: {e}")
+        return {"printer_serial": printer_serial, "error": "The print history could not be retrieved right now."}
+
+serial_json_instruction = "As soon as you get the printer serial, return a 1 field json object with the printer serial. The field should be printer_serial STRING. When you print this JSON, only print this JSON and nothing else in the message."
+
+serial_tool_instruction = "As soon as you get the printer serial, call lookup_recent_printer_jobs with it. Show the user the job names it returns and ask which print had the problem; that is the job_name. If no jobs are found or the lookup fails, ask them to upload their printer logs. If the problem sounds recurring or intermittent, call lookup_printer_history to check failure trends, error codes and resin usage before suggesting fixes."
+
+system_instruction_template = """You are Pete, a friendly and knowledgeable Formlabs Support Agent.
 
 Your job is to:
 1. Listen to the user's problem with their Formlabs 3D printer.
@@ -79,7 +152,7 @@ STYLE:
 
 Today's date is: {date}
 
-As soon as you get the printer serial, return a 1 field json object with the printer serial. The field should be printer_serial STRING. When you print this JSON, only print this JSON and nothing else in the message.
+{serial_instruction}
 
 Once you have all the information below, you should summarize this information to a JSON String name data.json with the following columns
 The JSON formatted String should only have the JSON object, and no other characters:
@@ -91,11 +164,34 @@ job_name - STRING
 
 """
 
+def build_system_instruction(job_lookup_tool: bool = False, today: date = None) -> str:
+    """Pete's instructions with today's date; with the job lookup tool he looks up the printer's jobs himself instead of emitting the serial JSON"""
+    serial_instruction = serial_tool_instruction if job_lookup_tool else serial_json_instruction
+    return system_instruction_template.format(date=today or date.today(), serial_instruction=serial_instruction)
+
+@traced("query_llm")
 def query_llm(chat_session, question: str):
     """Send a message to the LLM and get the response"""
     try:
         response = chat_session.send_message(question)
         return response
+    except QuotaExceeded as e:
+        # Shed by the quota scheduler: tell the customer to retry instead of showing an error
+        set_attribute("shed", str(e))
+        return BusyResponse()
+    except Exception as e:
+        raise Exception(f"Error querying LLM: {str(e)}")
+
+@traced("query_llm")
+def query_llm_stream(chat_session, question: str):
+    """Send a message to the LLM and yield the response text as it is generated"""
+    try:
+        for chunk in chat_session.send_message_stream(question):
+            if chunk.text:
+                yield chunk.text
+    except QuotaExceeded as e:
+        set_attribute("shed", str(e))
+        yield BUSY_MESSAGE
     except Exception as e:
         raise Exception(f"Error querying LLM: {str(e)}")
 
@@ -118,9 +214,12 @@ def extract_json_from_response(response: str) -> Optional[Dict[str, Any]]:
     return None
 
 
+# Replace with your actual Zapier webhook URL
+ZAPIER_WEBHOOK_URL = os.getenv("SERVICES_WEBHOOK_URL", 'https://hooks.zapier.com/hooks/catch/18996039/u4rszm2/')
+
+@traced("webhook.enqueue")
 def create_case(data):
-    # Replace with your actual Zapier webhook URL
-    zapier_webhook_url = 'https://hooks.zapier.com/hooks/catch/18996039/u4rszm2/'
+    """Queue the case for delivery to Zapier, once per customer and printer; returns the outbox id without waiting on the webhook"""
 
     # Data you want to send
     # payload = {
@@ -132,20 +231,8 @@ def create_case(data):
     #     "is_qualified": "Yes"
     # }
 
-    # # Convert the dict to a JSON-formatted string
-    payload_json = json.dumps(data)
-
-    # Set headers to indicate you're sending JSON
-    headers = {'Content-Type': 'application/json'}
-
-    # Send POST request with JSON payload
-    response = requests.post(zapier_webhook_url, data=payload_json, headers=headers)
-
-    # Print the response
-    print(f"Status Code: {response.status_code}")
-    print(f"Response Text: {response.text}")
-
-
-
-# Create initial chat session
-chat = create_chat_session()
\ No newline at end of file
+    # The outbox persists the payload and posts it in the background with retries; re-emitted
+    # or corrected JSON for the same customer updates that submission instead of creating another
+    outbox_id = submit_once("case", ZAPIER_WEBHOOK_URL, data, normalize_printer_serial(data.get("printer_serial") or ""))
+    set_attribute("outbox_id", outbox_id)
+    return outbox_id
@@ -0,0 +1,212 @@
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from services_backend.bigquery import (
+    build_print_query, normalize_printer_serial, print_query_parameters, run_query_arrow, serial_variants,
+)
+from shared_backend.tracing import set_attribute, traced
+
+# Per-serial Parquet files holding the last PRINT_HISTORY_DAYS of prints
+PRINT_HISTORY_CACHE_DIR = os.getenv("PRINT_HISTORY_CACHE_DIR", "print_history_cache")
+PRINT_HISTORY_DAYS = int(os.getenv("PRINT_HISTORY_DAYS", "56"))
+# A cached serial is not refreshed again within this many seconds
+PRINT_HISTORY_REFRESH_SECONDS = float(os.getenv("PRINT_HISTORY_REFRESH_SECONDS", "300"))
+# Prints started this close to the newest cached one are re-read, since their status changes when they finish
+PRINT_HISTORY_REFRESH_OVERLAP_HOURS = float(os.getenv("PRINT_HISTORY_REFRESH_OVERLAP_HOURS", "24"))
+# Read from local Parquet files (e.g. fixtures from --write-fixture) instead of BigQuery
+PRINT_HISTORY_SOURCE_DIR = os.getenv("PRINT_HISTORY_SOURCE_DIR", "")
+
+FAILED_STATUSES = ("FAILED", "ABORTED", "ERROR")
+
+PRINT_HISTORY_SCHEMA = pa.schema([
+    ("printer_serial", pa.string()),
+    ("print_guid", pa.string()),
+    ("job_name", pa.string()),
+    ("print_started_at", pa.timestamp("us", tz="UTC")),
+    ("status", pa.string()),
+    ("error_code", pa.string()),
+    ("material", pa.string()),
+    ("volume_ml", pa.float64()),
+])
+
+PRINT_HISTORY_QUERY = build_print_query(
+    "pr.printer_serial, pr.print_guid, j.name AS job_name, pr.print_started_at, "
+    "pr.status, pr.error_code, pr.material, pr.volume_ml"
+)
+
+_serial_locks = {}
+_serial_locks_lock = threading.Lock()
+
+
+def _serial_lock(cache_key: str) -> threading.Lock:
+    with _serial_locks_lock:
+        return _serial_locks.setdefault(cache_key, threading.Lock())
+
+
+def _conform(table: pa.Table) -> pa.Table:
+    """Cast a fetched table to PRINT_HISTORY_SCHEMA so cached and fresh rows concatenate"""
+    return table.select(PRINT_HISTORY_SCHEMA.names).cast(PRINT_HISTORY_SCHEMA)
+
+
+def fetch_print_history(printer_serial: str, since: datetime) -> pa.Table:
+    """Read prints for a serial started at or after since, as Arrow, from BigQuery or PRINT_HISTORY_SOURCE_DIR"""
+    # Built from the canonical serial, like cache_path, so every spelling refreshes the same rows into the same file
+    serials = serial_variants(printer_serial)
+    if PRINT_HISTORY_SOURCE_DIR:
+        dataset = ds.dataset(PRINT_HISTORY_SOURCE_DIR, format="parquet", schema=PRINT_HISTORY_SCHEMA)
+        since = pa.scalar(since, PRINT_HISTORY_SCHEMA.field("print_started_at").type)
+        return dataset.to_table(filter=ds.field("printer_serial").isin(serials) & (ds.field("print_started_at") >= since))
+
+    table = run_query_arrow(
+        "print_history", PRINT_HISTORY_QUERY, print_query_parameters(serials, since),
+        estimate_key=(PRINT_HISTORY_QUERY, since.date()),
+    )
+    if table.num_rows == 0:
+        return PRINT_HISTORY_SCHEMA.empty_table()
+    return _conform(table)
+
+
+def cache_path(printer_serial: str) -> str:
+    """Parquet cache file for a serial, named after its canonical form"""
+    return os.path.join(PRINT_HISTORY_CACHE_DIR, f"{normalize_printer_serial(printer_serial)}.parquet")
+
+
+@traced("print_history.load")
+def load_print_history(printer_serial: str, days: int = PRINT_HISTORY_DAYS, refresh: bool = None) -> pa.Table:
+    """
+    Return the last days of prints for a serial from the Parquet cache, first reading
+    only prints newer than the cached ones (less the overlap) when the cache is stale.
+    """
+    path = cache_path(printer_serial)
+    now = datetime.now(timezone.utc)
+    window_start = now - timedelta(days=days)
+    with _serial_lock(path):
+        cached = pq.read_table(path, schema=PRINT_HISTORY_SCHEMA) if os.path.exists(path) else None
+        if refresh is None:
+            refresh = cached is None or time.time() - os.path.getmtime(path) >= PRINT_HISTORY_REFRESH_SECONDS
+        set_attribute("cache", "miss" if cached is None else ("stale" if refresh else "hit"))
+        if not refresh:
+            return cached.filter(pc.field("print_started_at") >= window_start)
+
+        since = window_start
+        if cached is not None and cached.num_rows:
+            newest = pc.max(cached["print_started_at"]).as_py()
+            since = max(window_start, newest - timedelta(hours=PRINT_HISTORY_REFRESH_OVERLAP_HOURS))
+        fresh = fetch_print_history(printer_serial, since)
+        set_attribute("rows_fetched", fresh.num_rows)
+
+        if cached is not None:
+            # Re-read rows replace their cached copies; anything outside the window is dropped
+            kept = cached.filter((pc.field("print_started_at") >= window_start) & (pc.field("print_started_at") < since))
+            table = pa.concat_tables([kept, fresh])
+        else:
+            table = fresh
+        table = table.sort_by("print_started_at")
+
+        os.makedirs(PRINT_HISTORY_CACHE_DIR, exist_ok=True)
+        temporary_path = f"{path}.{threading.get_ident()}.tmp"
+        pq.write_table(table, temporary_path)
+        os.replace(temporary_path, path)
+        return table
+
+
+def summarize_print_history(table: pa.Table, top_errors: int = 5) -> dict:
+    """Failure rate, weekly trend, resin usage per material and the most common error codes"""
+    total = table.num_rows
+    if total == 0:
+        return {"prints": 0}
+    failed = pc.is_in(pc.utf8_upper(table["status"]), value_set=pa.array(FAILED_STATUSES))
+    failed = pc.fill_null(failed, False)
+    failures = pc.sum(failed).as_py() or 0
+
+    weekly = (
+        pa.table({"week": pc.floor_temporal(table["print_started_at"], unit="week"), "failed": pc.cast(failed, pa.int64())})
+        .group_by("week")
+        .aggregate([("failed", "sum"), ("failed", "count")])
+        .sort_by("week")
+    )
+    materials = (
+        table.filter(pc.is_valid(table["material"]))
+        .group_by("material")
+        .aggregate([("volume_ml", "sum"), ("print_guid", "count")])
+        .sort_by([("volume_ml_sum", "descending")])
+    )
+    errors = (
+        table.filter(pc.is_valid(table["error_code"]))
+        .group_by("error_code")
+        .aggregate([("print_guid", "count")])
+        .sort_by([("print_guid_count", "descending")])
+        .slice(0, top_errors)
+    )
+    return {
+        "prints": total,
+        "failed": failures,
+        "failure_rate": round(failures / total, 3),
+        "first_print": pc.min(table["print_started_at"]).as_py().isoformat(),
+        "last_print": pc.max(table["print_started_at"]).as_py().isoformat(),
+        "weekly": [
+            {"week": week.date().isoformat(), "prints": count, "failed": failed_count}
+            for week, failed_count, count in zip(
+                weekly["week"].to_pylist(), weekly["failed_sum"].to_pylist(), weekly["failed_count"].to_pylist()
+            )
+        ],
+        "resin_ml_by_material": {
+            material: round(volume or 0.0, 1)
+            for material, volume in zip(materials["material"].to_pylist(), materials["volume_ml_sum"].to_pylist())
+        },
+        "top_error_codes": dict(zip(errors["error_code"].to_pylist(), errors["print_guid_count"].to_pylist())),
+    }
+
+
+def printer_history_summary(printer_serial: str, days: int = PRINT_HISTORY_DAYS) -> dict:
+    """Summary of a printer's recent print history, for Pete's diagnosis"""
+    summary = summarize_print_history(load_print_history(printer_serial, days))
+    return dict({"printer_serial": printer_serial, "days": days}, **summary)
+
+
+def write_fixture(path: str, printer_serials: list, days: int = PRINT_HISTORY_DAYS, prints_per_day: float = 3.0, seed: int = 0):
+    """Write synthetic print history for printer_serials to a Parquet file, for running without BigQuery"""
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    rows = {name: [] for name in PRINT_HISTORY_SCHEMA.names}
+    for serial in printer_serials:
+        for i in range(int(days * prints_per_day)):
+            failed = rng.random() < 0.12
+            rows["printer_serial"].append(f"Form4-{normalize_printer_serial(serial)}")
+            rows["print_guid"].append(f"{serial}-{i}")
+            rows["job_name"].append(f"part_{i % 17}.form")
+            rows["print_started_at"].append(now - timedelta(days=rng.uniform(0, days)))
+            rows["status"].append(rng.choice(FAILED_STATUSES) if failed else "FINISHED")
+            rows["error_code"].append(rng.choice(["E1101", "E2203", "E3021", "E4110"]) if failed else None)
+            rows["material"].append(rng.choice(["Grey V5", "Clear V5", "Tough 2000", "Rigid 10K"]))
+            rows["volume_ml"].append(round(rng.uniform(5, 250), 1))
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    pq.write_table(pa.table(rows, schema=PRINT_HISTORY_SCHEMA), path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize a printer's print history from form4_logs")
+    parser.add_argument("serials", nargs="+", help="Printer serials, e.g. CalmOtter or Form4-CalmOtter")
+    parser.add_argument("--days", type=int, default=PRINT_HISTORY_DAYS)
+    parser.add_argument("--write-fixture", metavar="PATH", help="Write synthetic history for the serials to PATH instead")
+    args = parser.parse_args()
+    if args.write_fixture:
+        write_fixture(args.write_fixture, args.serials, args.days)
+        print(f"Wrote fixture for {len(args.serials)} printers to {args.write_fixture}")
+        return
+    for serial in args.serials:
+        print(json.dumps(printer_history_summary(serial, args.days), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import re
+from typing import Optional
+
+# Printer serial names are AdjectiveAnimal, optionally prefixed with the printer line (Form4-CalmOtter).
+# The animal suffix is what separates a serial from other CamelCase words like PreForm or FormCure.
+ANIMALS = frozenset("""
+aardvark albatross alligator alpaca anaconda anchovy angelfish ant anteater antelope ape armadillo
+baboon badger barracuda bat bear beaver bee beetle bison boar bobcat buffalo bull bulldog butterfly buzzard
+camel canary capybara caribou carp cat caterpillar catfish chameleon cheetah chicken chimp chinchilla
+chipmunk clam cobra cockatoo cod condor coral cougar cow coyote crab crane crayfish cricket crocodile crow
+cuckoo deer dingo dog dolphin donkey dove dragon dragonfly duck eagle eel egret elephant elk emu falcon
+ferret finch firefly fish flamingo fox frog gazelle gecko gerbil gibbon giraffe gnat gnu goat goldfinch
+goldfish goose gopher gorilla grasshopper grouse gull hamster hare hawk hedgehog heron herring hippo hornet
+horse hound hummingbird husky hyena ibex ibis iguana impala jackal jaguar jay jellyfish kangaroo kingfisher
+kitten kiwi koala koi kudu ladybug lamb lark lemming lemur leopard lion lizard llama lobster locust loon
+lynx macaw magpie mallard mamba manatee mandrill marlin marmot marten meerkat mink minnow mole mongoose
+monkey moose mosquito moth mouse mule narwhal newt nightingale ocelot octopus okapi opossum orca oriole
+osprey ostrich otter owl ox oyster panda panther parrot partridge peacock pelican penguin pheasant pig
+pigeon pike piranha platypus pony poodle porcupine porpoise possum prawn puffin puma python quail rabbit
+raccoon ram rat raven reindeer rhino robin rooster salamander salmon sardine scorpion seahorse seal shark
+sheep shrew shrimp skunk sloth slug snail snake sparrow spider squid squirrel starfish stingray stork
+swallow swan swift tapir tarantula termite tern tiger toad tortoise toucan trout tuna turkey turtle
+viper vulture wallaby walrus warthog wasp weasel whale wildcat wolf wolverine wombat woodpecker worm wren
+yak zebra
+""".split())
+
+# Printer lines a serial may be prefixed with in the logs
+PRINTER_LINES = ("Form4", "Form4L", "Form4B")
+_PRINTER_LINE_PREFIX = re.compile(r'^form\s*4[lb]?[\s_-]+', re.IGNORECASE)
+
+_MAX_ANIMAL_LENGTH = max(len(animal) for animal in ANIMALS)
+_MIN_ADJECTIVE_LENGTH = 3
+
+# With the printer line prefix any casing is accepted; bare names must be CamelCase (CalmOtter)
+# so that ordinary words ending in an animal (important, program, pattern) are not matched
+_PREFIXED_SERIAL_PATTERN = re.compile(r'\bform\s?4[lb]?[\s_-]+([a-z]{4,40})\b', re.IGNORECASE)
+_CAMEL_CASE_PATTERN = re.compile(r'\b([A-Z][a-z]{2,}[A-Z][a-z]+)\b')
+
+
+def split_serial_name(word: str) -> Optional[tuple]:
+    """Split a serial name like CalmOtter or calmotter into (adjective, animal), or None if it is not one"""
+    lowered = word.lower()
+    for length in range(min(_MAX_ANIMAL_LENGTH, len(lowered) - _MIN_ADJECTIVE_LENGTH), 1, -1):
+        animal = lowered[-length:]
+        if animal in ANIMALS:
+            return lowered[:-length], animal
+    return None
+
+
+def canonical_printer_serial(printer_serial: str) -> str:
+    """
+    The serial name in AdjectiveAnimal casing without the printer line, e.g. CalmOtter for calmotter or
+    Form4L-CalmOtter. Names that don't split into adjective and animal are returned as given, minus the line.
+    """
+    name = _PRINTER_LINE_PREFIX.sub('', printer_serial.strip())
+    parts = split_serial_name(name)
+    if not parts:
+        return name
+    adjective, animal = parts
+    return adjective.capitalize() + animal.capitalize()
+
+
+def detect_printer_serial(text: str) -> Optional[str]:
+    """
+    Find a printer serial name in free text without calling the LLM.
+    Returns the serial in canonical AdjectiveAnimal casing (e.g. CalmOtter), or None.
+    """
+    for pattern, camel_case in ((_PREFIXED_SERIAL_PATTERN, False), (_CAMEL_CASE_PATTERN, True)):
+        for match in pattern.finditer(text):
+            word = match.group(1)
+            parts = split_serial_name(word)
+            if not parts:
+                continue
+            adjective, animal = parts
+            if camel_case and not word[len(adjective)].isupper():
+                continue
+            return adjective.capitalize() + animal.capitalize()
+    return None
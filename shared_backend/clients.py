@@ -0,0 +1,109 @@
+import atexit
+import hashlib
+import os
+import threading
+import time
+import weakref
+
+from shared_backend.startup import timed_init
+
+# Clients with no live chat sessions are closed after this many idle seconds
+CLIENT_IDLE_SECONDS = float(os.getenv("GENAI_CLIENT_IDLE_SECONDS", "900"))
+
+_lock = threading.Lock()
+_clients = {}
+
+
+class _PooledClient:
+    def __init__(self, client):
+        self.client = client
+        self.sessions = weakref.WeakSet()
+        self.last_used = time.monotonic()
+
+
+def _close_client(client):
+    close = getattr(client, "close", None)
+    if close is None:
+        return
+    try:
+        close()
+    except Exception as e:
+        print(f"Error closing client: {e}")
+
+
+def close_idle_clients(max_idle: float = None):
+    """Close pooled clients with no live sessions that have been idle for max_idle seconds"""
+    if max_idle is None:
+        max_idle = CLIENT_IDLE_SECONDS
+    now = time.monotonic()
+    with _lock:
+        idle_keys = [
+            key for key, pooled in _clients.items()
+            if len(pooled.sessions) == 0 and now - pooled.last_used >= max_idle
+        ]
+        idle_clients = [_clients.pop(key).client for key in idle_keys]
+    for client in idle_clients:
+        _close_client(client)
+    return len(idle_clients)
+
+
+def close_all_clients():
+    """Close every pooled client, e.g. on process shutdown"""
+    with _lock:
+        pooled_clients = list(_clients.values())
+        _clients.clear()
+    for pooled in pooled_clients:
+        _close_client(pooled.client)
+
+
+def _get_client(key: tuple, factory):
+    close_idle_clients()
+    with _lock:
+        pooled = _clients.get(key)
+        if pooled is None:
+            pooled = _PooledClient(factory())
+            _clients[key] = pooled
+        pooled.last_used = time.monotonic()
+        return pooled.client
+
+
+def _create_client(**kwargs):
+    # The SDK takes most of a second to import, so it is loaded with the first chat rather than at startup
+    with timed_init("genai.Client"):
+        from google import genai
+
+        return genai.Client(**kwargs)
+
+
+def get_genai_client(api_key: str):
+    """Return the shared Gemini API client for this API key, creating it on first use"""
+    key = ("genai", hashlib.sha256(api_key.encode()).hexdigest())
+    return _get_client(key, lambda: _create_client(api_key=api_key))
+
+
+def get_vertex_client(project_id: str, location: str):
+    """Return the shared Vertex AI client for this project and location, creating it on first use"""
+    key = ("vertex", project_id, location)
+    return _get_client(key, lambda: _create_client(project=project_id, location=location, vertexai=True))
+
+
+def track_session(client, session):
+    """Keep the pooled client open for as long as the chat session is alive"""
+    with _lock:
+        for pooled in _clients.values():
+            if pooled.client is client:
+                pooled.sessions.add(session)
+                pooled.last_used = time.monotonic()
+                return
+
+
+def pool_stats():
+    """Return the number of pooled clients and live sessions per client"""
+    with _lock:
+        return {
+            "clients": len(_clients),
+            "sessions": {key[0] + ":" + key[-1][:8]: len(pooled.sessions) for key, pooled in _clients.items()},
+        }
+
+
+atexit.register(close_all_clients)
@@ -0,0 +1,95 @@
+import time
+from dataclasses import dataclass, field
+
+from sales_backend.chat import query_llm_stream as query_sales_llm_stream, extract_json_from_response as sales_extract_json_from_response, create_opportunity
+from services_backend.chat import query_llm_stream as query_services_llm_stream, extract_json_from_response as services_extract_json_from_response, create_case
+from services_backend.bigquery import run_recent_jobs_query, prefetch_recent_jobs
+from services_backend.serials import detect_printer_serial
+from shared_backend.tracing import span
+
+QUALIFIED_NOTICE = "Ok we have everything we need. A sales rep will get back to you"
+NOT_QUALIFIED_NOTICE = "Thank you for your inquiry. Please visit our website for any future purchases"
+NO_LOGS_NOTICE = "It does not appear that we have logs for your printer. Can you please upload them?"
+
+
+@dataclass
+class TurnResult:
+    """Outcome of one chat turn: the agent's reply, any JSON it emitted and follow-up notices to show"""
+    text: str = ""
+    json: dict = None
+    notices: list = field(default_factory=list)
+    # Seconds spent in each stage of the turn: first_token, llm, render, extract_json, webhook, bigquery
+    timings: dict = field(default_factory=dict)
+
+
+def stream_reply(chunks, timings: dict, on_chunk=None) -> str:
+    """Collect streamed chunks, calling on_chunk with the text so far after each one"""
+    start = time.perf_counter()
+    render_seconds = 0.0
+    response_text = ""
+    for chunk in chunks:
+        if "first_token" not in timings:
+            timings["first_token"] = time.perf_counter() - start
+        response_text += chunk
+        if on_chunk:
+            render_start = time.perf_counter()
+            on_chunk(response_text)
+            render_seconds += time.perf_counter() - render_start
+    timings["llm"] = time.perf_counter() - start - render_seconds
+    timings["render"] = render_seconds
+    return response_text
+
+
+def extract_json(extract, text: str, timings: dict):
+    """Run a bot's JSON extractor on the finished reply inside its own span"""
+    start = time.perf_counter()
+    with span("extract_json") as extract_span:
+        data = extract(text)
+        extract_span.set("found", data is not None)
+    timings["extract_json"] = time.perf_counter() - start
+    return data
+
+
+def run_sales_turn(chat_session, prompt: str, on_chunk=None) -> TurnResult:
+    """Send one customer message to Rhys and create an opportunity if the lead JSON comes back"""
+    result = TurnResult()
+    result.text = stream_reply(query_sales_llm_stream(chat_session, prompt), result.timings, on_chunk)
+    result.json = extract_json(sales_extract_json_from_response, result.text, result.timings)
+
+    if result.json:
+        start = time.perf_counter()
+        create_opportunity(result.json)
+        result.timings["webhook"] = time.perf_counter() - start
+        if result.json.get('is_qualified') == 'Yes':
+            result.notices.append(QUALIFIED_NOTICE)
+        else:
+            result.notices.append(NOT_QUALIFIED_NOTICE)
+    return result
+
+
+def run_services_turn(chat_session, prompt: str, on_chunk=None) -> TurnResult:
+    """Send one customer message to Pete, then look up jobs or create a case from the JSON it emits"""
+    result = TurnResult()
+
+    # Start the log lookup while Pete is still replying if the message names a serial
+    detected_serial = detect_printer_serial(prompt)
+    if detected_serial:
+        prefetch_recent_jobs(detected_serial)
+
+    result.text = stream_reply(query_services_llm_stream(chat_session, prompt), result.timings, on_chunk)
+    result.json = extract_json(services_extract_json_from_response, result.text, result.timings)
+
+    if result.json:
+        if result.json.get('job_name'):
+            start = time.perf_counter()
+            create_case(result.json)
+            result.timings["webhook"] = time.perf_counter() - start
+        elif result.json.get('printer_serial'):
+            start = time.perf_counter()
+            full_jobs, jobs_to_display = run_recent_jobs_query(result.json.get('printer_serial'))
+            result.timings["bigquery"] = time.perf_counter() - start
+            if jobs_to_display == 'No jobs found':
+                result.notices.append(NO_LOGS_NOTICE)
+            else:
+                result.notices.append("Are these any of your prints?\n\n" + jobs_to_display)
+    return result
@@ -0,0 +1,341 @@
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+from shared_backend.scheduler import get_scheduler
+from shared_backend.tracing import current_context, percentile, set_attribute, span
+
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "true").lower() in ("1", "true", "yes")
+# The other backend is tried once the primary has gone this percentile of its recent first-token latencies without answering
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+HEDGE_MIN_DELAY_SECONDS = float(os.getenv("HEDGE_MIN_DELAY_SECONDS", "2"))
+HEDGE_MAX_DELAY_SECONDS = float(os.getenv("HEDGE_MAX_DELAY_SECONDS", "10"))
+# Used until a backend has HEDGE_MIN_SAMPLES latencies recorded
+HEDGE_DEFAULT_DELAY_SECONDS = float(os.getenv("HEDGE_DEFAULT_DELAY_SECONDS", "5"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+# A turn with no answer from any backend by then fails instead of hanging
+HEDGE_TURN_DEADLINE_SECONDS = float(os.getenv("HEDGE_TURN_DEADLINE_SECONDS", "60"))
+# A hedge due while the model's scheduler is full or queueing waits this long before checking again
+HEDGE_CAPACITY_RECHECK_SECONDS = 0.25
+
+# Circuit breaker: over the last BREAKER_WINDOW calls, too many errors or answers slower than
+# BREAKER_SLOW_SECONDS take the backend out of rotation for BREAKER_COOLDOWN_SECONDS
+BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", "50"))
+BREAKER_MIN_REQUESTS = int(os.getenv("BREAKER_MIN_REQUESTS", "10"))
+BREAKER_ERROR_RATE = float(os.getenv("BREAKER_ERROR_RATE", "0.5"))
+BREAKER_SLOW_SECONDS = float(os.getenv("BREAKER_SLOW_SECONDS", "15"))
+BREAKER_SLOW_RATE = float(os.getenv("BREAKER_SLOW_RATE", "0.5"))
+BREAKER_COOLDOWN_SECONDS = float(os.getenv("BREAKER_COOLDOWN_SECONDS", "60"))
+
+
+class BackendHealth:
+    """
+    Rolling first-token latency and error rate for one backend, with a circuit breaker.
+    Closed: in rotation. Open: skipped until the cooldown passes. Half-open: one trial call decides.
+    """
+
+    def __init__(self, name: str, window: int = BREAKER_WINDOW):
+        self.name = name
+        self.state = "closed"
+        self.opened_at = 0.0
+        self.calls = 0
+        self.errors = 0
+        self.hedged = 0
+        self.wins = 0
+        self._outcomes = deque(maxlen=window)  # (first-token seconds or None, ok)
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """True if the backend may take a call; an open breaker lets one trial through after the cooldown"""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= BREAKER_COOLDOWN_SECONDS:
+                self.state = "half_open"
+            if self.state == "half_open" and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record(self, latency: float = None, ok: bool = True):
+        """Record a call's first-token latency, or a failure"""
+        slow = latency is not None and latency >= BREAKER_SLOW_SECONDS
+        with self._lock:
+            self.calls += 1
+            self.errors += not ok
+            self._outcomes.append((latency, ok))
+            if self.state == "half_open":
+                self._trial_running = False
+                if ok and not slow:
+                    self.state = "closed"
+                    self._outcomes.clear()
+                else:
+                    self._open()
+            elif self.state == "closed" and len(self._outcomes) >= BREAKER_MIN_REQUESTS:
+                failed = sum(1 for _, outcome_ok in self._outcomes if not outcome_ok) / len(self._outcomes)
+                slowed = sum(1 for seconds, _ in self._outcomes if seconds is not None and seconds >= BREAKER_SLOW_SECONDS) / len(self._outcomes)
+                if failed >= BREAKER_ERROR_RATE or slowed >= BREAKER_SLOW_RATE:
+                    self._open()
+
+    def _open(self):
+        self.state = "open"
+        self.opened_at = time.monotonic()
+        print(f"Circuit breaker opened for {self.name} backend")
+
+    def count(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def hedge_delay(self) -> float:
+        """Seconds to wait on this backend before trying the other one"""
+        with self._lock:
+            latencies = [seconds for seconds, ok in self._outcomes if ok and seconds is not None]
+        if len(latencies) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY_SECONDS
+        return min(HEDGE_MAX_DELAY_SECONDS, max(HEDGE_MIN_DELAY_SECONDS, percentile(latencies, HEDGE_PERCENTILE)))
+
+    def stats(self) -> dict:
+        with self._lock:
+            latencies = [seconds for seconds, ok in self._outcomes if ok and seconds is not None]
+            state, calls, errors, hedged, wins = self.state, self.calls, self.errors, self.hedged, self.wins
+        return {
+            "state": state, "calls": calls, "errors": errors, "hedged": hedged, "wins": wins,
+            "first_token_p50": percentile(latencies, 50), "first_token_p95": percentile(latencies, 95),
+            "hedge_delay": self.hedge_delay(),
+        }
+
+
+_backend_health = {}
+_backend_health_lock = threading.Lock()
+
+
+def get_backend_health(name: str) -> BackendHealth:
+    """Return the process-wide health tracker for a backend"""
+    with _backend_health_lock:
+        health = _backend_health.get(name)
+        if health is None:
+            health = _backend_health[name] = BackendHealth(name)
+        return health
+
+
+def hedging_stats() -> dict:
+    """Return breaker state, hedges and latency percentiles for every backend"""
+    with _backend_health_lock:
+        backends = dict(_backend_health)
+    return {name: health.stats() for name, health in backends.items()}
+
+
+class HedgedResponse:
+    """Response for a non-streamed turn that was served by whichever backend answered first"""
+
+    def __init__(self, text: str, usage_metadata=None):
+        self.text = text
+        self.usage_metadata = usage_metadata
+
+
+class HedgedChat:
+    """
+    Runs each turn on a primary backend and, if it has not started answering within its hedge delay and
+    the quota scheduler has room, on the secondary too; the first backend to answer wins, and the other
+    gives its quota slot back right away and is abandoned.
+    Both are full chat sessions over the same conversation: before a backend is used again,
+    its history is replaced with the winner's, so it never sees an answer the customer did not.
+    """
+
+    def __init__(self, backends: dict, primary: str, deadline: float = HEDGE_TURN_DEADLINE_SECONDS):
+        self.backends = dict(backends)
+        self.primary = primary
+        self.deadline = deadline
+        self.active = primary
+        self.last_backend = None
+        self._stale = set()
+
+    def _sync(self):
+        """Bring backends that missed a turn up to date with the one that answered it"""
+        active = self.backends[self.active]
+        for name in self._stale:
+            backend = self.backends[name]
+            backend.set_history(active.get_history(curated=True))
+            backend.restore_state(active.summary, active.slots)
+        self._stale = set()
+
+    def _next_backend(self, candidates: list):
+        """Pop candidates until one whose breaker lets the call through"""
+        while candidates:
+            name = candidates.pop(0)
+            if get_backend_health(name).allow():
+                return name
+        return None
+
+    def _has_capacity(self, name: str) -> bool:
+        """A hedge takes a second quota slot for the turn, so only send one when the scheduler has a slot free"""
+        backend = self.backends[name]
+        model = getattr(backend, "model", None)
+        return model is None or get_scheduler(model, backend.quota_owner).has_capacity()
+
+    @staticmethod
+    def _lost(name: str, race: dict) -> bool:
+        return race["closed"] or race["winner"] not in (None, name)
+
+    @staticmethod
+    def _release_losers(race: dict):
+        """Give back the quota slots of backends that lost, without waiting for their requests to end"""
+        with race["lock"]:
+            for name, quota_slot in race["slots"].items():
+                if name != race["winner"]:
+                    quota_slot.release()
+
+    def _pump(self, name: str, role: str, message: str, kwargs: dict, events: queue.Queue, race: dict):
+        """Stream one backend's reply into events until it finishes or loses the race"""
+        health = get_backend_health(name)
+        start = time.perf_counter()
+        answered = False
+
+        def admitted(quota_slot) -> bool:
+            # Registered under the race lock, so a winner picked from here on releases this slot too
+            with race["lock"]:
+                if self._lost(name, race):
+                    return False
+                race["slots"][name] = quota_slot
+                return True
+
+        with span("grounding", backend=name, role=role) as backend_span:
+            try:
+                stream = self.backends[name].send_message_stream(message, on_admitted=admitted, **kwargs)
+                for chunk in stream:
+                    if not answered:
+                        answered = True
+                        health.record(time.perf_counter() - start)
+                    if self._lost(name, race):
+                        backend_span.set("abandoned", True)
+                        # Closing the stream before it finishes keeps the reply out of this backend's history
+                        stream.close()
+                        return
+                    events.put((name, "chunk", chunk))
+                if self._lost(name, race):
+                    # Lost while waiting for quota, so the turn was never sent
+                    backend_span.set("abandoned", True)
+                    return
+                if not answered:
+                    health.record(time.perf_counter() - start)
+                events.put((name, "done", None))
+            except Exception as e:
+                if not answered:
+                    health.record(ok=False)
+                backend_span.set("error", str(e))
+                events.put((name, "error", e))
+
+    def send_message_stream(self, message: str, **kwargs):
+        self._sync()
+        candidates = [self.primary] + [name for name in self.backends if name != self.primary]
+        events = queue.Queue()
+        race = {"winner": None, "closed": False, "slots": {}, "lock": threading.Lock()}
+        launched = []
+        errors = []
+
+        def launch(name: str, role: str):
+            launched.append(name)
+            if role == "hedge":
+                get_backend_health(name).count("hedged")
+            context = current_context()
+            threading.Thread(
+                target=context.run, args=(self._pump, name, role, message, kwargs, events, race),
+                name=f"hedge-{name}", daemon=True,
+            ).start()
+
+        start = time.monotonic()
+        # With every breaker open, still try the primary rather than fail outright
+        launch(self._next_backend(candidates) or self.primary, "primary")
+        hedge_at = start + get_backend_health(launched[0]).hedge_delay()
+        try:
+            while True:
+                now = time.monotonic()
+                if race["winner"] is None and candidates and now >= hedge_at:
+                    # After every launched backend failed this is a failover, not a second concurrent request
+                    if len(errors) < len(launched) and not self._has_capacity(candidates[0]):
+                        set_attribute("hedge_deferred", True)
+                        hedge_at = now + HEDGE_CAPACITY_RECHECK_SECONDS
+                    else:
+                        name = self._next_backend(candidates)
+                        if name is not None:
+                            launch(name, "hedge")
+                            hedge_at = now + get_backend_health(name).hedge_delay()
+                if now >= start + self.deadline:
+                    raise TimeoutError(f"No answer from {' or '.join(launched)} within {self.deadline:.0f}s")
+                timeout = start + self.deadline - now
+                if race["winner"] is None and candidates:
+                    timeout = min(timeout, hedge_at - now)
+                try:
+                    name, kind, payload = events.get(timeout=max(timeout, 0.001))
+                except queue.Empty:
+                    continue
+
+                if race["winner"] is None:
+                    if kind == "error":
+                        errors.append(payload)
+                        if len(errors) == len(launched) and not candidates:
+                            raise errors[0]
+                        # Don't wait out the hedge delay once the primary has failed
+                        hedge_at = now
+                        continue
+                    with race["lock"]:
+                        race["winner"] = name
+                    self._release_losers(race)
+                    get_backend_health(name).count("wins")
+                    set_attribute("backend", name)
+                    set_attribute("hedged", len(launched) > 1)
+                if name != race["winner"]:
+                    continue
+                if kind == "error":
+                    raise payload
+                if kind == "done":
+                    break
+                yield payload
+        finally:
+            with race["lock"]:
+                race["closed"] = True
+            self._release_losers(race)
+            winner = race["winner"]
+            if winner is not None:
+                self.active = winner
+                self.last_backend = winner
+                self._stale = set(self.backends) - {winner}
+
+    def send_message(self, message: str, **kwargs):
+        text = ""
+        usage = None
+        for chunk in self.send_message_stream(message, **kwargs):
+            text += chunk.text or ""
+            usage = getattr(chunk, "usage_metadata", None) or usage
+        return HedgedResponse(text, usage)
+
+    # The rest of the chat session interface applies to every backend or reads from the active one
+
+    def record_history(self, user_input, model_output, automatic_function_calling_history, is_valid):
+        self._sync()
+        for backend in self.backends.values():
+            backend.record_history(
+                user_input=user_input,
+                model_output=model_output,
+                automatic_function_calling_history=automatic_function_calling_history,
+                is_valid=is_valid,
+            )
+
+    def set_history(self, history):
+        for backend in self.backends.values():
+            backend.set_history(history)
+        self._stale = set()
+
+    def restore_state(self, summary: str, slots: dict):
+        for backend in self.backends.values():
+            backend.restore_state(summary, slots)
+
+    def set_override(self, route: str = None):
+        for backend in self.backends.values():
+            backend.set_override(route)
+
+    def __getattr__(self, name):
+        return getattr(self.backends[self.active], name)
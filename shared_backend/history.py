@@ -0,0 +1,382 @@
+import itertools
+import json
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from shared_backend.prompt_cache import (
+    cached_config, invalidate_prompt_cache, is_prompt_cache_error, prompt_cache_handle, prompt_digest, record_prompt_cache_turn,
+)
+from shared_backend.scheduler import (
+    PRIORITY_BACKGROUND, QuotaExceeded, get_scheduler, is_rate_limit_error, priority_for_slots, quota_owner,
+)
+
+# Turns kept verbatim after a compaction, and the turn count that triggers one
+HISTORY_KEEP_TURNS = int(os.getenv("HISTORY_KEEP_TURNS", "6"))
+HISTORY_COMPACT_AFTER_TURNS = int(os.getenv("HISTORY_COMPACT_AFTER_TURNS", "10"))
+HISTORY_SUMMARY_MODEL = os.getenv("HISTORY_SUMMARY_MODEL", "gemini-2.5-flash")
+
+SUMMARY_PROMPT = """Summarize the earlier part of this chat between a Formlabs customer and a Formlabs agent in at most 8 short sentences.
+Keep the customer's problem or use case, products and prices discussed, questions already asked and answers already given.
+Do not repeat log output or long quotes.
+
+Previous summary:
+{summary}
+
+Conversation:
+{transcript}
+"""
+
+_EMAIL_PATTERN = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+_JSON_BLOCK_PATTERN = re.compile(r"```json\s*(\{.*?\})\s*```", re.DOTALL)
+
+# Compactions are summarized in the background; turns keep using the full history until the
+# compacted one is ready and it is swapped in between turns, so they never add to a reply's latency
+_compaction_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="history-compaction")
+
+
+def extract_email(text: str) -> dict:
+    """Slot extractor for the customer's email address"""
+    match = _EMAIL_PATTERN.search(text)
+    return {"email": match.group(0)} if match else {}
+
+
+def extract_json_slots(text: str) -> dict:
+    """Collect every non-empty field from JSON blocks the model emitted"""
+    slots = {}
+    for block in _JSON_BLOCK_PATTERN.findall(text):
+        try:
+            data = json.loads(block)
+        except json.JSONDecodeError:
+            continue
+        slots.update({key: value for key, value in data.items() if value not in (None, "")})
+    return slots
+
+
+def estimate_tokens(contents) -> int:
+    """Rough token count (4 characters per token), computed locally without a count_tokens call"""
+    return sum(len(part.text or "") for content in contents for part in (content.parts or [])) // 4
+
+
+def content_text(content) -> str:
+    return "".join(part.text or "" for part in (content.parts or []))
+
+
+def turn_starts(history) -> list:
+    """Indexes of user messages that start a turn; function responses continue the current turn"""
+    return [
+        i for i, content in enumerate(history)
+        if content.role == "user" and any(part.text for part in (content.parts or []))
+    ]
+
+
+def declare_functions(client, config):
+    """
+    Split Python function tools out of a chat config: returns the config with them as function declarations,
+    which can be cached with the rest of the prompt, and the functions by name to run their calls.
+    """
+    tools = list(config.tools or []) if config is not None else []
+    functions = {tool.__name__: tool for tool in tools if callable(tool)}
+    if not functions:
+        return config, functions
+    from google.genai import types
+
+    api_option = "VERTEX_AI" if getattr(client, "vertexai", False) else "GEMINI_API"
+    declarations = types.Tool(function_declarations=[
+        types.FunctionDeclaration.from_callable_with_api_option(callable=function, api_option=api_option)
+        for function in functions.values()
+    ])
+    return config.model_copy(update={"tools": [tool for tool in tools if not callable(tool)] + [declarations]}), functions
+
+
+class CompactingChat:
+    """
+    Chat session that keeps the last keep_turns turns verbatim and folds older turns into a rolling summary.
+    Facts collected along the way (email, serial, budget, timeline) are held as structured slots and
+    restated with the summary, so the extraction rules in the system instruction still see them.
+    """
+
+    def __init__(self, client, model: str, config, history=None, slot_extractors=(),
+                 keep_turns: int = HISTORY_KEEP_TURNS, compact_after_turns: int = HISTORY_COMPACT_AFTER_TURNS,
+                 summary_model: str = HISTORY_SUMMARY_MODEL):
+        self.client = client
+        self.model = model
+        # Function calls are run here rather than by automatic function calling, which needs the
+        # callables on every request and so rules out referencing a cached prompt
+        self.config, self.functions = declare_functions(client, config)
+        self.slot_extractors = tuple(slot_extractors)
+        self.keep_turns = keep_turns
+        self.compact_after_turns = max(compact_after_turns, keep_turns + 1)
+        self.summary_model = summary_model
+        # Vertex and API-key clients have separate quotas, so each gets its own schedulers
+        self.quota_owner = quota_owner(client)
+        self.summary = ""
+        self.slots = {}
+        self.token_stats = {"compactions": 0, "tokens_before": 0, "tokens_after": 0, "tokens_saved": 0}
+        self._lock = threading.Lock()
+        self._pending_compaction = None
+        # The system instruction and tools are sent by reference to a Gemini cache when one is available
+        self._prompt_digest = prompt_digest(self.config)
+        self._cached_content = None
+        self._chat = self._create_chat(model, history or [])
+
+    # Chat session interface; slot_text is what the customer typed when message carries injected context
+    # (e.g. retrieved excerpts), which is sent for this turn only and not kept in the history
+
+    def send_message(self, message: str, slot_text: str = None):
+        self._before_turn(message if slot_text is None else slot_text)
+        with self._quota(self.model):
+            try:
+                response = self._chat.send_message(message)
+            except Exception as e:
+                if not self._drop_prompt_cache(e):
+                    raise
+                response = self._chat.send_message(message)
+            while response.function_calls and self.functions:
+                response = self._chat.send_message(self._call_functions(response.function_calls))
+        record_prompt_cache_turn(self._cached_content, getattr(response, "usage_metadata", None))
+        self._store_as_typed(message, slot_text)
+        self._after_turn(response.text or "")
+        return response
+
+    def send_message_stream(self, message: str, slot_text: str = None, on_admitted=None):
+        """on_admitted is called with the quota slot before the turn is sent; returning False abandons the turn"""
+        self._before_turn(message if slot_text is None else slot_text)
+        chunks = []
+        usage = None
+        with self._quota(self.model) as quota_slot:
+            if on_admitted is not None and not on_admitted(quota_slot):
+                return
+            try:
+                stream = iter(self._chat.send_message_stream(message))
+                first = next(stream, None)
+            except Exception as e:
+                if not self._drop_prompt_cache(e):
+                    raise
+                stream = iter(self._chat.send_message_stream(message))
+                first = next(stream, None)
+            stream = itertools.chain([] if first is None else [first], stream)
+            while stream is not None:
+                function_calls = []
+                for chunk in stream:
+                    if chunk.text:
+                        chunks.append(chunk.text)
+                    function_calls.extend(chunk.function_calls or [])
+                    usage = getattr(chunk, "usage_metadata", None) or usage
+                    yield chunk
+                # The model continues the same turn once it has the function results
+                stream = None
+                if function_calls and self.functions:
+                    stream = self._chat.send_message_stream(self._call_functions(function_calls))
+        record_prompt_cache_turn(self._cached_content, usage)
+        self._store_as_typed(message, slot_text)
+        self._after_turn("".join(chunks))
+
+    def _call_functions(self, function_calls) -> list:
+        """Run the model's function calls and return their results as parts for the next request"""
+        from google.genai import types
+
+        parts = []
+        for call in function_calls:
+            function = self.functions.get(call.name)
+            try:
+                if function is None:
+                    raise ValueError(f"Unknown function: {call.name}")
+                result = function(**(call.args or {}))
+            except Exception as e:
+                result = {"error": str(e)}
+            parts.append(types.Part.from_function_response(
+                name=call.name, response=result if isinstance(result, dict) else {"result": result},
+            ))
+        return parts
+
+    @contextmanager
+    def _quota(self, model: str, priority: int = None):
+        """Wait for the model's quota scheduler; conversations with hot slots go first"""
+        scheduler = get_scheduler(model, self.quota_owner)
+        with scheduler.acquire(priority_for_slots(self.slots) if priority is None else priority) as quota_slot:
+            try:
+                yield quota_slot
+            except Exception as e:
+                if not is_rate_limit_error(e):
+                    raise
+                # The quota is shared with other processes; back off everyone in this one too
+                scheduler.on_throttled()
+                raise QuotaExceeded(f"Gemini rate limit: {e}") from e
+
+    def get_history(self, curated: bool = False):
+        return self._chat.get_history(curated=curated)
+
+    def record_history(self, user_input, model_output, automatic_function_calling_history, is_valid):
+        self._chat.record_history(
+            user_input=user_input,
+            model_output=model_output,
+            automatic_function_calling_history=automatic_function_calling_history,
+            is_valid=is_valid,
+        )
+        self._update_slots(content_text(user_input))
+
+    def set_model(self, model: str):
+        """Continue the same conversation on a different model"""
+        with self._lock:
+            if model != self.model:
+                self.model = model
+                self._chat = self._create_chat(model, self._chat.get_history())
+
+    def set_history(self, history):
+        """Replace the conversation history, e.g. when rehydrating or syncing with another session"""
+        with self._lock:
+            # A compaction summarized from the old history no longer applies
+            self._pending_compaction = None
+            self._chat = self._create_chat(self.model, list(history))
+
+    def restore_state(self, summary: str, slots: dict):
+        """Restore the rolling summary and slots saved alongside a stored history"""
+        with self._lock:
+            self.summary = summary or ""
+            self.slots = dict(slots or {})
+
+    # Prompt caching
+
+    def _create_chat(self, model: str, history):
+        """Start the underlying chat on model, referencing the cached prompt prefix when there is one"""
+        self._cached_content = prompt_cache_handle(self.client, model, self.config, self._prompt_digest)
+        return self.client.chats.create(model=model, config=cached_config(self.config, self._cached_content), history=history)
+
+    def _refresh_prompt_cache(self):
+        """Switch to a cache that became ready, or to its replacement near expiry, before the turn is sent"""
+        if prompt_cache_handle(self.client, self.model, self.config, self._prompt_digest) != self._cached_content:
+            with self._lock:
+                self._chat = self._create_chat(self.model, self._chat.get_history())
+
+    def _drop_prompt_cache(self, error: Exception) -> bool:
+        """After a request failed on its cache reference, forget the cache and go inline; False for other errors"""
+        if self._cached_content is None or not is_prompt_cache_error(error):
+            return False
+        print(f"Prompt cache {self._cached_content} rejected, sending the prompt inline: {error}")
+        invalidate_prompt_cache(self.client, self._cached_content)
+        with self._lock:
+            self._chat = self._create_chat(self.model, self._chat.get_history())
+        return True
+
+    def _store_as_typed(self, message: str, slot_text: str):
+        """Replace the turn's sent message in the history with what the customer typed"""
+        if slot_text is None or slot_text == message:
+            return
+        from google.genai import types
+
+        with self._lock:
+            history = list(self._chat.get_history())
+            for i in range(len(history) - 1, -1, -1):
+                if history[i].role == "user" and content_text(history[i]) == message:
+                    history[i] = types.Content(role="user", parts=[types.Part.from_text(text=slot_text)])
+                    self._chat = self._create_chat(self.model, history)
+                    return
+
+    # Compaction
+
+    def _update_slots(self, text: str):
+        for extractor in self.slot_extractors:
+            self.slots.update(extractor(text))
+
+    def _before_turn(self, message: str):
+        self._apply_pending_compaction()
+        self._refresh_prompt_cache()
+        self._update_slots(message)
+
+    def _after_turn(self, response_text: str):
+        self.slots.update(extract_json_slots(response_text))
+        self._apply_pending_compaction()
+        if self._pending_compaction is None and len(turn_starts(self._chat.get_history(curated=True))) > self.compact_after_turns:
+            self._pending_compaction = _compaction_executor.submit(self._summarize_older_turns)
+
+    def _apply_pending_compaction(self, wait: bool = False):
+        """Swap in a finished background compaction; without wait, one still running is left for a later turn"""
+        pending = self._pending_compaction
+        if pending is None or not (wait or pending.done()):
+            return
+        self._pending_compaction = None
+        try:
+            result = pending.result()
+        except Exception as e:
+            print(f"Error compacting history: {e}")
+            return
+        if result is not None:
+            self._replace_older_turns(*result)
+
+    def wait_for_compaction(self):
+        """Block until a background compaction has finished and been applied"""
+        self._apply_pending_compaction(wait=True)
+
+    def count_tokens(self, contents) -> int:
+        """Count tokens for contents with the model's tokenizer, falling back to an estimate"""
+        if not contents:
+            return 0
+        try:
+            return self.client.models.count_tokens(model=self.model, contents=contents).total_tokens
+        except Exception:
+            return estimate_tokens(contents)
+
+    def token_counts(self) -> dict:
+        """Current history size in tokens plus totals from past compactions"""
+        return dict(self.token_stats, current=self.count_tokens(self._chat.get_history(curated=True)))
+
+    def _summarize(self, contents) -> str:
+        transcript = "\n".join(f"{content.role}: {content_text(content)}" for content in contents if content_text(content))
+        with self._quota(self.summary_model, PRIORITY_BACKGROUND):
+            response = self.client.models.generate_content(
+                model=self.summary_model,
+                contents=SUMMARY_PROMPT.format(summary=self.summary or "(none)", transcript=transcript),
+            )
+        return (response.text or "").strip()
+
+    def _summary_contents(self):
+        from google.genai import types
+
+        facts = json.dumps(self.slots, default=str) if self.slots else "{}"
+        return [
+            types.Content(role="user", parts=[types.Part.from_text(
+                text=f"Summary of our conversation so far: {self.summary}\nFacts already collected: {facts}"
+            )]),
+            types.Content(role="model", parts=[types.Part.from_text(
+                text="Thanks, I have the context and the details you've shared."
+            )]),
+        ]
+
+    def _summarize_older_turns(self):
+        """Summarize all but the last keep_turns turns; returns (older turns, summary), or None if too short"""
+        with self._lock:
+            history = self._chat.get_history(curated=True)
+        starts = turn_starts(history)
+        if len(starts) <= self.keep_turns:
+            return None
+        older = history[:starts[-self.keep_turns]]
+        # Summarized without holding the lock, so turns and other calls go on meanwhile
+        return older, self._summarize(older)
+
+    def _replace_older_turns(self, older: list, summary: str):
+        """Replace the summarized turns with the summary, keeping every turn added since"""
+        with self._lock:
+            history = self._chat.get_history(curated=True)
+            if history[:len(older)] != older:
+                # The history was replaced while the summary was written
+                return
+            self.summary = summary
+            compacted = self._summary_contents() + history[len(older):]
+            # Estimated locally; exact counts would cost two count_tokens round trips per compaction
+            tokens_before = estimate_tokens(history)
+            tokens_after = estimate_tokens(compacted)
+
+            self._chat = self._create_chat(self.model, compacted)
+            self.token_stats["compactions"] += 1
+            self.token_stats["tokens_before"] = tokens_before
+            self.token_stats["tokens_after"] = tokens_after
+            self.token_stats["tokens_saved"] += max(0, tokens_before - tokens_after)
+
+    def compact(self):
+        """Fold all but the last keep_turns turns into the rolling summary"""
+        result = self._summarize_older_turns()
+        if result is not None:
+            self._replace_older_turns(*result)
@@ -0,0 +1,168 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from shared_backend.outbox import get_outbox
+from shared_backend.tracing import set_attribute
+
+SUBMISSION_INDEX_PATH = os.getenv("SUBMISSION_INDEX_PATH", "submissions.sqlite3")
+# A customer's lead (sales) or case for the same printer (services) is updated, not repeated, within this window
+SUBMISSION_TTL_SECONDS = float(os.getenv("SUBMISSION_TTL_SECONDS", str(7 * 24 * 3600)))
+# New submissions wait this long in the outbox so corrections emitted on the next turns are merged into them
+SUBMISSION_HOLD_SECONDS = float(os.getenv("SUBMISSION_HOLD_SECONDS", "10"))
+SUBMISSION_PRUNE_INTERVAL_SECONDS = 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS submissions (
+    key TEXT PRIMARY KEY,
+    outbox_id INTEGER NOT NULL,
+    digest BLOB NOT NULL,
+    payload TEXT NOT NULL,
+    expires_at REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS submissions_expiry ON submissions (expires_at);
+"""
+
+OUTCOMES = ("new", "duplicate", "merged", "updated", "unkeyed")
+# Payload field telling the Zap whether to create the record or update the one with the same submission_key
+SUBMISSION_ACTION_FIELD = "submission_action"
+
+
+def normalize_email(email) -> str:
+    return str(email or "").strip().lower()
+
+
+def submission_key(kind: str, email: str, subject: str) -> str:
+    return hashlib.sha256(f"{kind}\x1f{email}\x1f{subject}".encode("utf-8")).hexdigest()[:32]
+
+
+def payload_digest(payload: dict) -> bytes:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).digest()[:16]
+
+
+def merge_submission(previous: dict, update: dict) -> dict:
+    """Fields in update replace those in previous; empty values in update don't erase earlier answers"""
+    merged = dict(previous)
+    merged.update((name, value) for name, value in update.items() if value not in (None, "", [], {}))
+    return merged
+
+
+class SubmissionIndex:
+    """
+    Persistent map from submission key to the outbox row that carries it, with expiry.
+    Shared by every session in the process and, through SQLite locking, by other processes.
+    """
+
+    def __init__(self, path: str = SUBMISSION_INDEX_PATH, ttl: float = SUBMISSION_TTL_SECONDS):
+        self.path = path
+        self.ttl = ttl
+        self.counts = dict.fromkeys(OUTCOMES, 0)
+        self.lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._pruned_at = 0.0
+
+    @contextmanager
+    def transaction(self):
+        """Serialize check-and-record across threads, and across processes through SQLite's write lock"""
+        with self.lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def lookup(self, key: str):
+        """Return (outbox_id, digest, payload) for an unexpired key, or None"""
+        row = self._conn.execute(
+            "SELECT outbox_id, digest, payload FROM submissions WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        return None if row is None else (row[0], row[1], json.loads(row[2]))
+
+    def record(self, key: str, outbox_id: int, payload: dict):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO submissions (key, outbox_id, digest, payload, expires_at) VALUES (?, ?, ?, ?, ?)",
+            (key, outbox_id, payload_digest(payload), json.dumps(payload), time.time() + self.ttl),
+        )
+
+    def prune(self):
+        now = time.time()
+        if now - self._pruned_at >= SUBMISSION_PRUNE_INTERVAL_SECONDS:
+            self._pruned_at = now
+            self._conn.execute("DELETE FROM submissions WHERE expires_at <= ?", (now,))
+
+    def count(self, outcome: str):
+        self.counts[outcome] += 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM submissions").fetchone()[0]
+            return dict(self.counts, indexed=size)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_submission_index() -> SubmissionIndex:
+    """Return the process-wide submission index, opening it on first use"""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = SubmissionIndex()
+        return _index
+
+
+def submit_once(kind: str, url: str, data: dict, subject: str = None) -> int:
+    """
+    Queue a lead or case for the webhook unless this customer already submitted it.
+    subject narrows the key within a customer's submissions (e.g. the printer serial); None keys on the email
+    alone, and an empty subject leaves the submission unkeyed. A repeat with nothing new returns the existing
+    outbox id; changed fields are merged into the queued payload if it has not been sent yet, and otherwise
+    sent as an update (submission_action "update", same submission_key) so the Zap doesn't create a second record.
+    """
+    index = get_submission_index()
+    email = normalize_email(data.get("email"))
+    if not email or subject == "":
+        with index.lock:
+            index.count("unkeyed")
+        set_attribute("submission", "unkeyed")
+        return get_outbox().enqueue(url, dict(data, **{SUBMISSION_ACTION_FIELD: "create"}))
+
+    key = submission_key(kind, email, subject or "")
+    outbox = get_outbox()
+    with index.transaction():
+        entry = index.lookup(key)
+        if entry is None:
+            outcome = "new"
+            payload = dict(data, submission_key=key, **{SUBMISSION_ACTION_FIELD: "create"})
+            outbox_id = outbox.enqueue(url, payload, delay=SUBMISSION_HOLD_SECONDS)
+        else:
+            outbox_id, digest, previous = entry
+            payload = merge_submission(previous, data)
+            if payload_digest(payload) == digest:
+                outcome = "duplicate"
+            elif outbox.update_pending(outbox_id, payload):
+                outcome = "merged"
+            else:
+                outcome = "updated"
+                payload[SUBMISSION_ACTION_FIELD] = "update"
+                outbox_id = outbox.enqueue(url, payload, delay=SUBMISSION_HOLD_SECONDS)
+        if outcome != "duplicate":
+            index.record(key, outbox_id, payload)
+        index.prune()
+        index.count(outcome)
+    set_attribute("submission", outcome)
+    return outbox_id
+
+
+def submission_stats() -> dict:
+    """Submissions by outcome since startup, plus the number of keys in the index"""
+    return get_submission_index().stats()
@@ -0,0 +1,292 @@
+import contextvars
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from shared_backend.tracing import current_context, span
+
+OUTBOX_PATH = os.getenv("OUTBOX_PATH", "outbox.sqlite3")
+MAX_CONCURRENCY = int(os.getenv("OUTBOX_MAX_CONCURRENCY", "4"))
+MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+REQUEST_TIMEOUT = (3.05, 15)  # (connect, read) seconds
+BACKOFF_BASE_SECONDS = 2.0
+BACKOFF_MAX_SECONDS = 300.0
+DELIVERED_RETENTION_SECONDS = 24 * 3600
+
+# 4xx responses that are worth retrying; any other 4xx goes straight to the dead-letter table
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    url TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    created_at REAL NOT NULL,
+    delivered_at REAL,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at);
+CREATE TABLE IF NOT EXISTS dead_letter (
+    id INTEGER PRIMARY KEY,
+    url TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    attempts INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    failed_at REAL NOT NULL,
+    last_error TEXT
+);
+"""
+
+
+def backoff_delay(attempts: int) -> float:
+    """Exponential backoff with full jitter for the given number of failed attempts"""
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** attempts)))
+
+
+class Outbox:
+    """
+    Durable webhook outbox backed by SQLite.
+    Payloads are persisted on enqueue and delivered by a background dispatcher
+    with bounded concurrency, timeouts, retries and a dead-letter table.
+    """
+
+    def __init__(self, path: str = OUTBOX_PATH, max_concurrency: int = MAX_CONCURRENCY, max_attempts: int = MAX_ATTEMPTS):
+        self.path = path
+        self.max_concurrency = max_concurrency
+        self.max_attempts = max_attempts
+        self._db_lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        # Rows left in flight by a previous process are retried
+        self._conn.execute("UPDATE outbox SET status = 'pending' WHERE status = 'sending'")
+
+        self._http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_concurrency, pool_maxsize=max_concurrency)
+        self._http.mount("https://", adapter)
+        self._http.mount("http://", adapter)
+
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._in_flight = 0
+        self._in_flight_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="outbox")
+        self._dispatcher = None
+        self._start_lock = threading.Lock()
+        # Tracing context of the turn that enqueued each row, so delivery spans join that turn's trace
+        self._trace_contexts = {}
+
+    def _execute(self, sql: str, params: tuple = ()):
+        with self._db_lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def enqueue(self, url: str, payload: dict, delay: float = 0.0) -> int:
+        """Persist a webhook payload for delivery, no sooner than delay seconds from now, and return its outbox id"""
+        now = time.time()
+        with self._db_lock:
+            cursor = self._conn.execute(
+                "INSERT INTO outbox (url, payload, next_attempt_at, created_at) VALUES (?, ?, ?, ?)",
+                (url, json.dumps(payload), now + delay, now),
+            )
+            outbox_id = cursor.lastrowid
+            self._trace_contexts[outbox_id] = current_context()
+        self.start()
+        self._wakeup.set()
+        return outbox_id
+
+    def update_pending(self, outbox_id: int, payload: dict) -> bool:
+        """Replace the payload of a row that has not been sent yet; False once it is in flight, delivered or dead-lettered"""
+        with self._db_lock:
+            updated = self._conn.execute(
+                "UPDATE outbox SET payload = ? WHERE id = ? AND status = 'pending'",
+                (json.dumps(payload), outbox_id),
+            ).rowcount
+        return bool(updated)
+
+    def start(self):
+        """Start the background dispatcher if it is not already running"""
+        with self._start_lock:
+            if self._dispatcher is None or not self._dispatcher.is_alive():
+                if self._executor is None:
+                    # stop() shut the previous pool down; it can't take new deliveries
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="outbox")
+                self._stopping.clear()
+                self._dispatcher = threading.Thread(target=self._run, name="outbox-dispatcher", daemon=True)
+                self._dispatcher.start()
+
+    def stop(self, timeout: float = 5.0):
+        """Stop the dispatcher and wait for in-flight deliveries"""
+        self._stopping.set()
+        self._wakeup.set()
+        if self._dispatcher is not None:
+            self._dispatcher.join(timeout)
+        with self._start_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+        self._http.close()
+
+    def _claim_due(self, limit: int):
+        now = time.time()
+        with self._db_lock:
+            rows = self._conn.execute(
+                "SELECT id, url, payload, attempts FROM outbox "
+                "WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY next_attempt_at LIMIT ?",
+                (now, limit),
+            ).fetchall()
+            for row in rows:
+                self._conn.execute("UPDATE outbox SET status = 'sending' WHERE id = ?", (row[0],))
+        return rows
+
+    def _seconds_until_next_due(self) -> float:
+        rows = self._execute("SELECT MIN(next_attempt_at) FROM outbox WHERE status = 'pending'")
+        next_due = rows[0][0]
+        if next_due is None:
+            return 60.0
+        return max(0.0, next_due - time.time())
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wakeup.clear()
+            with self._in_flight_lock:
+                free_slots = self.max_concurrency - self._in_flight
+            rows = self._claim_due(free_slots) if free_slots > 0 else []
+            for row in rows:
+                with self._in_flight_lock:
+                    self._in_flight += 1
+                context = self._trace_contexts.get(row[0]) or contextvars.Context()
+                self._executor.submit(context.copy().run, self._deliver, *row)
+            if not rows:
+                self._prune_delivered()
+                # Deliveries set the wakeup event when they finish and free a slot
+                self._wakeup.wait(self._seconds_until_next_due() if free_slots > 0 else 60.0)
+
+    def _deliver(self, outbox_id: int, url: str, payload: str, attempts: int):
+        try:
+            with span("webhook.post", outbox_id=outbox_id, attempt=attempts + 1) as post_span:
+                error = None
+                retryable = True
+                try:
+                    response = self._http.post(url, data=payload, headers={"Content-Type": "application/json"}, timeout=REQUEST_TIMEOUT)
+                    post_span.set("http_status", response.status_code)
+                    if response.ok:
+                        self._execute(
+                            "UPDATE outbox SET status = 'delivered', delivered_at = ?, attempts = ? WHERE id = ?",
+                            (time.time(), attempts + 1, outbox_id),
+                        )
+                        self._trace_contexts.pop(outbox_id, None)
+                        return
+                    error = f"HTTP {response.status_code}: {response.text[:200]}"
+                    retryable = response.status_code >= 500 or response.status_code in RETRYABLE_STATUS_CODES
+                except requests.RequestException as e:
+                    error = str(e)
+                post_span.set("error", error)
+
+                attempts += 1
+                if retryable and attempts < self.max_attempts:
+                    self._execute(
+                        "UPDATE outbox SET status = 'pending', attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                        (attempts, time.time() + backoff_delay(attempts), error, outbox_id),
+                    )
+                else:
+                    self._trace_contexts.pop(outbox_id, None)
+                    self._dead_letter(outbox_id, attempts, error)
+        finally:
+            with self._in_flight_lock:
+                self._in_flight -= 1
+            self._wakeup.set()
+
+    def _dead_letter(self, outbox_id: int, attempts: int, error: str):
+        print(f"Webhook delivery {outbox_id} failed after {attempts} attempts: {error}")
+        with self._db_lock:
+            self._conn.execute("BEGIN")
+            self._conn.execute(
+                "INSERT INTO dead_letter (id, url, payload, attempts, created_at, failed_at, last_error) "
+                "SELECT id, url, payload, ?, created_at, ?, ? FROM outbox WHERE id = ?",
+                (attempts, time.time(), error, outbox_id),
+            )
+            self._conn.execute("DELETE FROM outbox WHERE id = ?", (outbox_id,))
+            self._conn.execute("COMMIT")
+
+    def _prune_delivered(self):
+        self._execute(
+            "DELETE FROM outbox WHERE status = 'delivered' AND delivered_at < ?",
+            (time.time() - DELIVERED_RETENTION_SECONDS,),
+        )
+
+    def requeue_dead_letter(self, dead_letter_id: int) -> bool:
+        """Move a dead-lettered payload back into the outbox for another round of attempts"""
+        now = time.time()
+        with self._db_lock:
+            self._conn.execute("BEGIN")
+            moved = self._conn.execute(
+                "INSERT INTO outbox (id, url, payload, next_attempt_at, created_at) "
+                "SELECT id, url, payload, ?, created_at FROM dead_letter WHERE id = ?",
+                (now, dead_letter_id),
+            ).rowcount
+            self._conn.execute("DELETE FROM dead_letter WHERE id = ?", (dead_letter_id,))
+            self._conn.execute("COMMIT")
+        if moved:
+            self.start()
+            self._wakeup.set()
+        return bool(moved)
+
+    def dead_letters(self):
+        """Return dead-lettered payloads, most recent first"""
+        rows = self._execute("SELECT id, url, payload, attempts, failed_at, last_error FROM dead_letter ORDER BY failed_at DESC")
+        return [
+            {"id": row[0], "url": row[1], "payload": json.loads(row[2]), "attempts": row[3], "failed_at": row[4], "last_error": row[5]}
+            for row in rows
+        ]
+
+    def stats(self):
+        """Return row counts per outbox status plus the dead-letter count"""
+        counts = dict(self._execute("SELECT status, COUNT(*) FROM outbox GROUP BY status"))
+        counts["dead_letter"] = self._execute("SELECT COUNT(*) FROM dead_letter")[0][0]
+        return counts
+
+    def delivery_latencies(self, since: float = 0.0):
+        """Seconds from enqueue to successful delivery for payloads created after since (epoch seconds)"""
+        rows = self._execute(
+            "SELECT delivered_at - created_at FROM outbox WHERE status = 'delivered' AND created_at >= ?",
+            (since,),
+        )
+        return [row[0] for row in rows]
+
+    def wait_until_idle(self, timeout: float = 10.0) -> bool:
+        """Block until nothing is pending or in flight; returns False on timeout"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            rows = self._execute("SELECT COUNT(*) FROM outbox WHERE status IN ('pending', 'sending')")
+            if rows[0][0] == 0:
+                return True
+            time.sleep(0.05)
+        return False
+
+
+_outbox = None
+_outbox_lock = threading.Lock()
+
+
+def get_outbox() -> Outbox:
+    """Return the process-wide outbox, opening it on first use"""
+    global _outbox
+    with _outbox_lock:
+        if _outbox is None:
+            _outbox = Outbox()
+        return _outbox
+
+
+def enqueue_webhook(url: str, payload: dict) -> int:
+    """Queue a JSON payload for background delivery to a webhook"""
+    return get_outbox().enqueue(url, payload)
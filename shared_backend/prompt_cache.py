@@ -0,0 +1,170 @@
+import hashlib
+import os
+import threading
+import time
+import weakref
+
+PROMPT_CACHE_ENABLED = os.getenv("PROMPT_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+# Lifetime of each cached prefix on the Gemini side; a new one is created this close to expiry
+PROMPT_CACHE_TTL_SECONDS = float(os.getenv("PROMPT_CACHE_TTL_SECONDS", "3600"))
+PROMPT_CACHE_REFRESH_MARGIN_SECONDS = float(os.getenv("PROMPT_CACHE_REFRESH_MARGIN_SECONDS", "300"))
+# After a failed create (prompt under the model's minimum cacheable size, caching not offered for the
+# model or tool, quota) turns go without a cache for this long before another attempt
+PROMPT_CACHE_RETRY_SECONDS = float(os.getenv("PROMPT_CACHE_RETRY_SECONDS", "3600"))
+
+# Config fields a cached prefix replaces; requests that reference a cache must leave them unset
+CACHED_FIELDS = ("system_instruction", "tools", "tool_config")
+
+
+class _Entry:
+    def __init__(self):
+        self.name = None
+        self.expires_at = 0.0
+        self.tokens = 0
+        self.creating = False
+        self.retry_at = 0.0
+
+
+class PromptCache:
+    """
+    Cached system instruction and tool config per client, model and prompt digest, referenced by handle.
+    A new prompt text (e.g. a new date in the instruction) has a new digest and so gets its own cache.
+    Caches are created on a background thread; until one is ready, turns send the prefix inline.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.creates = 0
+        self.failures = 0
+        self.cached_tokens = 0
+        self._entries = weakref.WeakKeyDictionary()  # client -> {(model, digest): _Entry}
+        self._lock = threading.Lock()
+
+    def handle(self, client, model: str, config, digest: str):
+        """The cache name to reference for this prefix, or None to send it inline (starting a create if due)"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.setdefault(client, {}).setdefault((model, digest), _Entry())
+            if entry.name is not None and entry.expires_at - now > PROMPT_CACHE_REFRESH_MARGIN_SECONDS:
+                return entry.name
+            start = not entry.creating and now >= entry.retry_at
+            if start:
+                entry.creating = True
+            # An old cache is still good until it actually expires, while its replacement is created
+            name = entry.name if entry.expires_at > now else None
+        if start:
+            threading.Thread(
+                target=self._create, args=(client, model, config, digest, entry), name="prompt-cache", daemon=True,
+            ).start()
+        return name
+
+    def _create(self, client, model: str, config, digest: str, entry: _Entry):
+        from google.genai import types
+
+        try:
+            cached = client.caches.create(model=model, config=types.CreateCachedContentConfig(
+                display_name=f"prompt-{digest[:16]}",
+                ttl=f"{int(PROMPT_CACHE_TTL_SECONDS)}s",
+                **{field: getattr(config, field) for field in CACHED_FIELDS},
+            ))
+        except Exception as e:
+            print(f"Prompt caching unavailable for {model}, sending the prompt inline: {e}")
+            with self._lock:
+                self.failures += 1
+                entry.creating = False
+                entry.retry_at = time.time() + PROMPT_CACHE_RETRY_SECONDS
+            return
+        usage = getattr(cached, "usage_metadata", None)
+        with self._lock:
+            self.creates += 1
+            entry.name = cached.name
+            entry.expires_at = cached.expire_time.timestamp() if cached.expire_time else time.time() + PROMPT_CACHE_TTL_SECONDS
+            entry.tokens = getattr(usage, "total_token_count", None) or 0
+            entry.creating = False
+
+    def invalidate(self, client, name: str):
+        """Forget a cache the API no longer accepts (deleted or expired early); the next turn creates another"""
+        with self._lock:
+            for entry in self._entries.get(client, {}).values():
+                if entry.name == name:
+                    entry.name = None
+                    entry.expires_at = 0.0
+
+    def record_turn(self, name: str, usage_metadata):
+        """Count a turn as a hit if it referenced a cache, and the prompt tokens the cache served"""
+        cached_tokens = getattr(usage_metadata, "cached_content_token_count", None) or 0
+        with self._lock:
+            if name is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.cached_tokens += cached_tokens
+
+    def stats(self) -> dict:
+        """Hit/miss counts, prompt tokens served from caches, and the live caches per model"""
+        now = time.time()
+        with self._lock:
+            turns = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / turns, 3) if turns else 0.0,
+                "creates": self.creates,
+                "failures": self.failures,
+                "cached_tokens": self.cached_tokens,
+                "caches": [
+                    {"model": model, "digest": digest[:12], "tokens": entry.tokens, "expires_in": round(entry.expires_at - now)}
+                    for entries in self._entries.values()
+                    for (model, digest), entry in entries.items()
+                    if entry.name is not None and entry.expires_at > now
+                ],
+            }
+
+
+_prompt_cache = PromptCache()
+
+
+def prompt_digest(config):
+    """Digest of the cacheable part of a chat config, or None if it can't be cached"""
+    if not PROMPT_CACHE_ENABLED or config is None or not config.system_instruction:
+        return None
+    # Python functions run through automatic function calling, which needs them on every request;
+    # CompactingChat declares them up front and runs the calls itself, so its configs never hold any
+    if any(callable(tool) for tool in (config.tools or [])):
+        return None
+    prefix = config.model_dump_json(include=set(CACHED_FIELDS), exclude_none=True)
+    return hashlib.sha256(prefix.encode("utf-8")).hexdigest()
+
+
+def prompt_cache_handle(client, model: str, config, digest: str):
+    """The cache to reference for this chat's prefix on model, or None to send the prefix inline"""
+    if digest is None:
+        return None
+    return _prompt_cache.handle(client, model, config, digest)
+
+
+def cached_config(config, name: str):
+    """The chat config for a turn: the prefix fields swapped for the cache handle when there is one"""
+    if name is None:
+        return config
+    return config.model_copy(update=dict(dict.fromkeys(CACHED_FIELDS), cached_content=name))
+
+
+def is_prompt_cache_error(error: Exception) -> bool:
+    """True when a request failed because the cache it referenced is gone or not usable"""
+    message = str(error).lower()
+    return "cachedcontent" in message.replace(" ", "").replace("_", "") or "cached content" in message
+
+
+def invalidate_prompt_cache(client, name: str):
+    _prompt_cache.invalidate(client, name)
+
+
+def record_prompt_cache_turn(name: str, usage_metadata):
+    _prompt_cache.record_turn(name, usage_metadata)
+
+
+def prompt_cache_stats() -> dict:
+    """Return hit/miss counts, cached prompt tokens and live caches"""
+    return _prompt_cache.stats()
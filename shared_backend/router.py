@@ -0,0 +1,161 @@
+import os
+import re
+import threading
+import time
+from collections import deque
+
+from shared_backend.history import turn_starts
+from shared_backend.tracing import percentile, set_attribute
+
+FAST_MODEL = os.getenv("FAST_MODEL", "gemini-2.5-flash")
+PRO_MODEL = os.getenv("PRO_MODEL", "gemini-2.5-pro")
+# Force every turn onto one route ("fast" or "pro"); empty means classify each turn
+MODEL_ROUTE_OVERRIDE = os.getenv("MODEL_ROUTE_OVERRIDE", "")
+
+# USD per million tokens (input, output), used for the per-route cost estimate
+MODEL_PRICES = {
+    "gemini-2.5-pro": (1.25, 10.0),
+    "gemini-2.5-flash": (0.30, 2.50),
+    "gemini-2.5-flash-lite": (0.10, 0.40),
+}
+
+# Messages this short and free of a real question are slot-filling answers
+FAST_MAX_WORDS = 12
+FAST_MAX_CHARS = 120
+
+_SMALL_TALK_PATTERN = re.compile(
+    r"^(hi|hello|hey|thanks|thank you|thx|ok|okay|sure|yes|yeah|yep|no|nope|great|cool|perfect|sounds good|bye|goodbye)\b",
+    re.IGNORECASE,
+)
+_SLOT_PATTERN = re.compile(
+    r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+"
+    r"|[$€£]\s?\d"
+    r"|\b\d+\s*(?:k|usd|eur|gbp|dollars|weeks?|months?|years?)\b"
+    r"|\bnext\s+(?:week|month|quarter|year)\b",
+    re.IGNORECASE,
+)
+_QUESTION_PATTERN = re.compile(r"\?|^(what|which|how|why|can|could|does|do|is|are|should|will|would)\b", re.IGNORECASE)
+
+
+def classify_turn(message: str, turns_so_far: int) -> str:
+    """
+    Pick "fast" or "pro" for a turn with local heuristics.
+    The opening question and anything that reads like a real question go to pro;
+    greetings, thanks and short slot-filling answers (email, budget, timeline) go to fast.
+    """
+    text = message.strip()
+    if turns_so_far == 0 or not text:
+        return "pro"
+    words = len(text.split())
+    if words > FAST_MAX_WORDS or len(text) > FAST_MAX_CHARS:
+        return "pro"
+    if _SMALL_TALK_PATTERN.match(text) or _SLOT_PATTERN.search(text):
+        return "fast"
+    if _QUESTION_PATTERN.search(text):
+        return "pro"
+    return "fast"
+
+
+class RouteStats:
+    """Process-wide latency, token and cost counters per route"""
+
+    def __init__(self, window: int = 1000):
+        self._lock = threading.Lock()
+        self._routes = {}
+        self.window = window
+
+    def record(self, route: str, model: str, latency: float, first_token_latency: float = None, usage=None):
+        input_tokens = getattr(usage, "prompt_token_count", None) or 0
+        output_tokens = getattr(usage, "candidates_token_count", None) or 0
+        input_price, output_price = MODEL_PRICES.get(model, (0.0, 0.0))
+        cost = (input_tokens * input_price + output_tokens * output_price) / 1_000_000
+        with self._lock:
+            stats = self._routes.setdefault(route, {
+                "turns": 0, "input_tokens": 0, "output_tokens": 0, "cost_usd": 0.0,
+                "latencies": deque(maxlen=self.window), "first_token_latencies": deque(maxlen=self.window),
+            })
+            stats["turns"] += 1
+            stats["input_tokens"] += input_tokens
+            stats["output_tokens"] += output_tokens
+            stats["cost_usd"] += cost
+            stats["latencies"].append(latency)
+            if first_token_latency is not None:
+                stats["first_token_latencies"].append(first_token_latency)
+
+    def summary(self) -> dict:
+        """Turns, tokens, estimated cost and latency percentiles per route"""
+        with self._lock:
+            return {
+                route: {
+                    "turns": stats["turns"],
+                    "input_tokens": stats["input_tokens"],
+                    "output_tokens": stats["output_tokens"],
+                    "cost_usd": round(stats["cost_usd"], 6),
+                    "latency_p50": percentile(stats["latencies"], 50),
+                    "latency_p95": percentile(stats["latencies"], 95),
+                    "first_token_p50": percentile(stats["first_token_latencies"], 50),
+                }
+                for route, stats in self._routes.items()
+            }
+
+
+route_stats = RouteStats()
+
+
+class RoutingChat:
+    """
+    Sends each turn to the fast or pro model while keeping one shared conversation.
+    Wraps a chat that supports set_model (CompactingChat), which carries the history across models.
+    """
+
+    def __init__(self, chat_session, fast_model: str = FAST_MODEL, pro_model: str = PRO_MODEL,
+                 override: str = MODEL_ROUTE_OVERRIDE or None):
+        self.chat_session = chat_session
+        self.models = {"fast": fast_model, "pro": pro_model}
+        self.override = override
+        self.last_route = None
+
+    def set_override(self, route: str = None):
+        """Pin every turn to "fast" or "pro"; None goes back to classifying each turn"""
+        self.override = route
+
+    def choose_route(self, message: str) -> str:
+        if self.override:
+            return self.override
+        return classify_turn(message, len(turn_starts(self.chat_session.get_history(curated=True))))
+
+    def _route(self, message: str, slot_text: str = None):
+        route = self.choose_route(message if slot_text is None else slot_text)
+        self.last_route = route
+        set_attribute("route", route)
+        set_attribute("model", self.models[route])
+        self.chat_session.set_model(self.models[route])
+        return route
+
+    def send_message(self, message: str, **kwargs):
+        route = self._route(message, kwargs.get("slot_text"))
+        start = time.perf_counter()
+        response = self.chat_session.send_message(message, **kwargs)
+        route_stats.record(route, self.models[route], time.perf_counter() - start,
+                           usage=getattr(response, "usage_metadata", None))
+        return response
+
+    def send_message_stream(self, message: str, **kwargs):
+        route = self._route(message, kwargs.get("slot_text"))
+        start = time.perf_counter()
+        first_token_latency = None
+        usage = None
+        for chunk in self.chat_session.send_message_stream(message, **kwargs):
+            if first_token_latency is None:
+                first_token_latency = time.perf_counter() - start
+            usage = getattr(chunk, "usage_metadata", None) or usage
+            yield chunk
+        route_stats.record(route, self.models[route], time.perf_counter() - start, first_token_latency, usage)
+
+    def __getattr__(self, name):
+        return getattr(self.chat_session, name)
+
+
+def route_stats_summary() -> dict:
+    """Return per-route latency and cost stats for all sessions in this process"""
+    return route_stats.summary()
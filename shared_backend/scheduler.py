@@ -0,0 +1,281 @@
+import hashlib
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from shared_backend.tracing import percentile, set_attribute
+
+# Requests per minute allowed per model when nothing else is configured: the Gemini API paid tier 1 limits
+DEFAULT_MODEL_REQUESTS_PER_MINUTE = {
+    "gemini-2.5-pro": 150.0,
+    "gemini-2.5-flash": 1000.0,
+    "gemini-2.5-flash-lite": 4000.0,
+}
+# Per-model overrides like "gemini-2.5-pro=150,gemini-2.5-flash=1000"; GEMINI_REQUESTS_PER_MINUTE, if set, applies to
+# every model without an override. A model with no rate from any of these can't be scheduled
+GEMINI_MODEL_REQUESTS_PER_MINUTE = dict(
+    (model.strip(), float(rate))
+    for model, _, rate in (item.partition("=") for item in os.getenv("GEMINI_MODEL_REQUESTS_PER_MINUTE", "").split(","))
+    if rate
+)
+GEMINI_REQUESTS_PER_MINUTE = float(os.getenv("GEMINI_REQUESTS_PER_MINUTE")) if os.getenv("GEMINI_REQUESTS_PER_MINUTE") else None
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "16"))
+# Requests waiting beyond this many seconds, or arriving at a full queue, are shed with a busy message
+GEMINI_QUEUE_TIMEOUT_SECONDS = float(os.getenv("GEMINI_QUEUE_TIMEOUT_SECONDS", "20"))
+GEMINI_MAX_QUEUE = int(os.getenv("GEMINI_MAX_QUEUE", "200"))
+
+# Lower runs first
+PRIORITY_HOT = 0  # budget/timeline given, or a service case with a serial
+PRIORITY_WARM = 1  # contact details given
+PRIORITY_NORMAL = 2
+PRIORITY_BACKGROUND = 3  # history summaries and other work nobody is waiting on
+PRIORITY_NAMES = {PRIORITY_HOT: "hot", PRIORITY_WARM: "warm", PRIORITY_NORMAL: "normal", PRIORITY_BACKGROUND: "background"}
+
+HOT_SLOTS = ("budget", "timeline", "estimated_purchase_date", "printer_serial")
+WARM_SLOTS = ("email",)
+
+BUSY_MESSAGE = (
+    "We're helping a lot of customers right now and I couldn't get to your message in time. "
+    "Please send it again in a moment."
+)
+
+
+class QuotaExceeded(Exception):
+    """Raised when a request is shed instead of being sent to the model"""
+
+
+class BusyResponse:
+    """Stands in for a model response when the request was shed"""
+
+    def __init__(self, text: str = BUSY_MESSAGE):
+        self.text = text
+
+
+def priority_for_slots(slots: dict) -> int:
+    """Conversations closer to a sale or a service case are served first"""
+    if any(slots.get(name) for name in HOT_SLOTS):
+        return PRIORITY_HOT
+    if any(slots.get(name) for name in WARM_SLOTS):
+        return PRIORITY_WARM
+    return PRIORITY_NORMAL
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """True for a 429 / RESOURCE_EXHAUSTED error from the Gemini API"""
+    return getattr(error, "code", None) == 429 or "RESOURCE_EXHAUSTED" in str(error)
+
+
+class QuotaSlot:
+    """An admitted request's hold on a scheduler; released when the request ends, or earlier if it is abandoned"""
+
+    def __init__(self, scheduler):
+        self._scheduler = scheduler
+        self.released = False
+
+    def release(self):
+        self._scheduler._release(self)
+
+
+class _Waiter:
+    def __init__(self, priority: int, deadline: float):
+        self.priority = priority
+        self.deadline = deadline
+        self.shed = False
+
+
+class QuotaScheduler:
+    """
+    Admits requests to one model at most rate_per_minute (token bucket with burst) and
+    max_concurrency at a time. Waiting requests are served by priority, then arrival order.
+    A full queue sheds its lowest-priority waiter (or the newcomer), and so does a wait past queue_timeout.
+    """
+
+    def __init__(self, rate_per_minute: float, burst: float = None,
+                 max_concurrency: int = GEMINI_MAX_CONCURRENCY, max_queue: int = GEMINI_MAX_QUEUE,
+                 queue_timeout: float = GEMINI_QUEUE_TIMEOUT_SECONDS, window: int = 1000):
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst if burst is not None else max(1.0, rate_per_minute / 10)
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.tokens = self.burst
+        self.in_flight = 0
+        self.admitted = 0
+        self.shed = 0
+        self.throttled = 0
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._queue = []
+        self._sequence = itertools.count()
+        self._waits = {priority: deque(maxlen=window) for priority in PRIORITY_NAMES}
+        self._condition = threading.Condition()
+
+    def _refill(self, now: float):
+        if now > self._updated:
+            start = max(self._updated, self._paused_until)
+            if now > start:
+                self.tokens = min(self.burst, self.tokens + (now - start) * self.rate)
+            self._updated = now
+
+    def _seconds_until_token(self, now: float) -> float:
+        wait = max(0.0, self._paused_until - now)
+        if self.tokens < 1:
+            wait += (1 - self.tokens) / self.rate
+        return wait
+
+    def _enqueue(self, waiter: _Waiter):
+        if len(self._queue) >= self.max_queue:
+            worst = max(self._queue, key=lambda entry: (entry[0], entry[1]))
+            if worst[0] <= waiter.priority:
+                raise QuotaExceeded("Gemini request queue is full")
+            # Make room by shedding the least urgent waiter
+            self._queue.remove(worst)
+            heapq.heapify(self._queue)
+            worst[2].shed = True
+            self._condition.notify_all()
+        heapq.heappush(self._queue, (waiter.priority, next(self._sequence), waiter))
+
+    def _admit(self, waiter: _Waiter) -> float:
+        start = time.monotonic()
+        with self._condition:
+            try:
+                self._enqueue(waiter)
+            except QuotaExceeded:
+                self.shed += 1
+                raise
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if waiter.shed:
+                    self.shed += 1
+                    self._condition.notify_all()
+                    raise QuotaExceeded("Shed to make room for more urgent requests")
+                at_head = self._queue and self._queue[0][2] is waiter
+                if at_head and self.tokens >= 1 and now >= self._paused_until and self.in_flight < self.max_concurrency:
+                    heapq.heappop(self._queue)
+                    self.tokens -= 1
+                    self.in_flight += 1
+                    self.admitted += 1
+                    waited = now - start
+                    self._waits[waiter.priority].append(waited)
+                    self._condition.notify_all()
+                    return waited
+                if now >= waiter.deadline:
+                    self._queue = [item for item in self._queue if item[2] is not waiter]
+                    heapq.heapify(self._queue)
+                    self.shed += 1
+                    self._condition.notify_all()
+                    raise QuotaExceeded(f"Waited {now - start:.1f}s for Gemini quota")
+                timeout = waiter.deadline - now
+                if at_head and self.in_flight < self.max_concurrency:
+                    timeout = min(timeout, self._seconds_until_token(now))
+                self._condition.wait(max(timeout, 0.001))
+
+    def _release(self, slot: QuotaSlot):
+        with self._condition:
+            if slot.released:
+                return
+            slot.released = True
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    @contextmanager
+    def acquire(self, priority: int = PRIORITY_NORMAL, timeout: float = None):
+        """Hold a quota slot for the enclosed request; raises QuotaExceeded if the request is shed"""
+        waiter = _Waiter(priority, time.monotonic() + (self.queue_timeout if timeout is None else timeout))
+        waited = self._admit(waiter)
+        set_attribute("queue_wait_ms", round(waited * 1000, 3))
+        set_attribute("priority", PRIORITY_NAMES[priority])
+        slot = QuotaSlot(self)
+        try:
+            yield slot
+        finally:
+            slot.release()
+
+    def has_capacity(self) -> bool:
+        """True if a request arriving now would be admitted without waiting"""
+        with self._condition:
+            now = time.monotonic()
+            self._refill(now)
+            return not self._queue and self.in_flight < self.max_concurrency and self.tokens >= 1 and now >= self._paused_until
+
+    def on_throttled(self, retry_after: float = None):
+        """The API answered 429 anyway (e.g. quota shared with other processes): stop admitting for a while"""
+        with self._condition:
+            self.throttled += 1
+            self.tokens = 0.0
+            self._paused_until = max(self._paused_until, time.monotonic() + (retry_after or 1 / self.rate))
+
+    def stats(self) -> dict:
+        """Admission counters, queue depth and queue-wait percentiles per priority"""
+        with self._condition:
+            return {
+                "rate_per_minute": self.rate * 60,
+                "in_flight": self.in_flight,
+                "queued": len(self._queue),
+                "admitted": self.admitted,
+                "shed": self.shed,
+                "throttled": self.throttled,
+                "queue_wait": {
+                    PRIORITY_NAMES[priority]: {
+                        "count": len(waits),
+                        "p50": percentile(waits, 50),
+                        "p95": percentile(waits, 95),
+                        "p99": percentile(waits, 99),
+                    }
+                    for priority, waits in self._waits.items() if waits
+                },
+            }
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def requests_per_minute(model: str) -> float:
+    """The configured request rate for model; raises ValueError when none is configured"""
+    rate = GEMINI_MODEL_REQUESTS_PER_MINUTE.get(model, GEMINI_REQUESTS_PER_MINUTE)
+    if rate is None:
+        rate = DEFAULT_MODEL_REQUESTS_PER_MINUTE.get(model)
+    if rate is None:
+        raise ValueError(
+            f"No request rate configured for {model}. Set GEMINI_MODEL_REQUESTS_PER_MINUTE=\"{model}=<requests per minute>\" "
+            "to your project's quota"
+        )
+    return rate
+
+
+def quota_owner(client) -> str:
+    """The quota a client's requests count against: its Vertex project and region, or its API key"""
+    api_client = getattr(client, "_api_client", None)
+    if getattr(client, "vertexai", False):
+        return f"vertex:{api_client.project}/{api_client.location}"
+    api_key = getattr(api_client, "api_key", None)
+    if api_key:
+        # Named by a digest so the key never shows up in stats
+        return f"api-key:{hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:8]}"
+    return "default"
+
+
+def get_scheduler(model: str, owner: str = "default") -> QuotaScheduler:
+    """Return the process-wide scheduler for a model under one quota owner, creating it on first use"""
+    with _schedulers_lock:
+        scheduler = _schedulers.get((owner, model))
+        if scheduler is None:
+            scheduler = QuotaScheduler(requests_per_minute(model))
+            _schedulers[(owner, model)] = scheduler
+        return scheduler
+
+
+def scheduler_stats() -> dict:
+    """Return queue and admission stats for every scheduler, by quota owner and then model"""
+    with _schedulers_lock:
+        schedulers = dict(_schedulers)
+    stats = {}
+    for (owner, model), scheduler in schedulers.items():
+        stats.setdefault(owner, {})[model] = scheduler.stats()
+    return stats
@@ -0,0 +1,250 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+SESSION_STORE_PATH = os.getenv("SESSION_STORE_PATH", "sessions.sqlite3")
+# Live chat objects kept in memory; the least recently used beyond this are evicted and rehydrated on return
+SESSION_MAX_LIVE = int(os.getenv("SESSION_MAX_LIVE", "200"))
+SESSION_IDLE_SECONDS = float(os.getenv("SESSION_IDLE_SECONDS", "1800"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    bot TEXT NOT NULL,
+    settings TEXT NOT NULL DEFAULT '{}',
+    history TEXT NOT NULL DEFAULT '[]',
+    slots TEXT NOT NULL DEFAULT '{}',
+    summary TEXT NOT NULL DEFAULT '',
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    timestamp TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_by_session ON messages (session_id, id);
+"""
+
+
+def dump_history(history) -> str:
+    return json.dumps([content.model_dump(mode="json", exclude_none=True) for content in history])
+
+
+def load_history(data: str) -> list:
+    from google.genai import types
+
+    return [types.Content.model_validate(content) for content in json.loads(data)]
+
+
+class SessionStore:
+    """
+    SQLite store for conversations: the displayed message log, plus the model history,
+    slots and rolling summary needed to rebuild the chat after it was evicted or the process restarted.
+    Settings hold non-secret choices like the sales grounding mode; credentials are never stored.
+    """
+
+    def __init__(self, path: str = SESSION_STORE_PATH):
+        self.path = path
+        self._db_lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+
+    def _execute(self, sql: str, params: tuple = ()):
+        with self._db_lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def ensure(self, session_id: str, bot: str, settings: dict = None):
+        """Create the session row if it does not exist yet"""
+        now = time.time()
+        self._execute(
+            "INSERT OR IGNORE INTO sessions (session_id, bot, settings, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+            (session_id, bot, json.dumps(settings or {}), now, now),
+        )
+
+    def info(self, session_id: str):
+        """Return bot, settings, slots, summary and timestamps for a session, or None"""
+        rows = self._execute(
+            "SELECT bot, settings, slots, summary, created_at, updated_at FROM sessions WHERE session_id = ?",
+            (session_id,),
+        )
+        if not rows:
+            return None
+        bot, settings, slots, summary, created_at, updated_at = rows[0]
+        return {
+            "session_id": session_id, "bot": bot, "settings": json.loads(settings), "slots": json.loads(slots),
+            "summary": summary, "created_at": created_at, "updated_at": updated_at,
+        }
+
+    def history(self, session_id: str) -> list:
+        """Return the stored model history as genai Content objects"""
+        rows = self._execute("SELECT history FROM sessions WHERE session_id = ?", (session_id,))
+        return load_history(rows[0][0]) if rows else []
+
+    def save_state(self, session_id: str, history, slots: dict = None, summary: str = ""):
+        """Persist the chat's history, slots and summary after a turn"""
+        self._execute(
+            "UPDATE sessions SET history = ?, slots = ?, summary = ?, updated_at = ? WHERE session_id = ?",
+            (dump_history(history), json.dumps(slots or {}, default=str), summary or "", time.time(), session_id),
+        )
+
+    def append_message(self, session_id: str, role: str, content: str, timestamp: str = None) -> int:
+        """Add a message to the displayed log and return its id"""
+        now = time.time()
+        with self._db_lock:
+            cursor = self._conn.execute(
+                "INSERT INTO messages (session_id, role, content, timestamp, created_at) VALUES (?, ?, ?, ?, ?)",
+                (session_id, role, content, timestamp or datetime.now().strftime("%I:%M %p"), now),
+            )
+            self._conn.execute("UPDATE sessions SET updated_at = ? WHERE session_id = ?", (now, session_id))
+            return cursor.lastrowid
+
+    def messages(self, session_id: str, limit: int = None, before_id: int = None, after_id: int = None) -> list:
+        """Return the last limit messages (between after_id and before_id, if given) in chronological order"""
+        rows = self._execute(
+            "SELECT id, role, content, timestamp FROM messages WHERE session_id = ? AND id > ? AND id < ? ORDER BY id DESC LIMIT ?",
+            (
+                session_id, after_id if after_id is not None else 0,
+                before_id if before_id is not None else 2 ** 62, limit if limit is not None else -1,
+            ),
+        )
+        return [{"id": row[0], "role": row[1], "content": row[2], "timestamp": row[3]} for row in reversed(rows)]
+
+    def count_messages(self, session_id: str) -> int:
+        return self._execute("SELECT COUNT(*) FROM messages WHERE session_id = ?", (session_id,))[0][0]
+
+    def delete(self, session_id: str):
+        with self._db_lock:
+            self._conn.execute("BEGIN")
+            self._conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            self._conn.execute("COMMIT")
+
+    def prune(self, max_age_seconds: float) -> int:
+        """Delete sessions untouched for max_age_seconds; returns how many were removed"""
+        cutoff = time.time() - max_age_seconds
+        with self._db_lock:
+            self._conn.execute("BEGIN")
+            self._conn.execute(
+                "DELETE FROM messages WHERE session_id IN (SELECT session_id FROM sessions WHERE updated_at < ?)", (cutoff,)
+            )
+            removed = self._conn.execute("DELETE FROM sessions WHERE updated_at < ?", (cutoff,)).rowcount
+            self._conn.execute("COMMIT")
+        return removed
+
+
+class _LiveSession:
+    def __init__(self, chat_session):
+        self.chat_session = chat_session
+        self.last_used = time.monotonic()
+
+
+class SessionManager:
+    """
+    Bounded LRU of live chat objects in front of a SessionStore.
+    Sessions idle for idle_seconds or beyond max_live are dropped from memory and rebuilt from the
+    stored history the next time they are used, so memory stays flat however many sessions are open.
+    """
+
+    def __init__(self, store: SessionStore, max_live: int = SESSION_MAX_LIVE, idle_seconds: float = SESSION_IDLE_SECONDS):
+        self.store = store
+        self.max_live = max_live
+        self.idle_seconds = idle_seconds
+        self.rehydrations = 0
+        self.evictions = 0
+        self._live = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str, create_chat, bot: str, settings: dict = None):
+        """
+        Return the live chat for session_id, rebuilding it if needed.
+        create_chat(history) builds a chat session seeded with the stored history.
+        """
+        self.evict_idle()
+        with self._lock:
+            live = self._live.get(session_id)
+            if live is not None:
+                self._live.move_to_end(session_id)
+                live.last_used = time.monotonic()
+                return live.chat_session
+
+        self.store.ensure(session_id, bot, settings)
+        info = self.store.info(session_id)
+        history = self.store.history(session_id)
+        chat_session = create_chat(history or None)
+        restore_state = getattr(chat_session, "restore_state", None)
+        if history and restore_state is not None:
+            restore_state(info["summary"], info["slots"])
+
+        with self._lock:
+            if history:
+                self.rehydrations += 1
+            # Another request may have rebuilt the same session meanwhile; keep whichever got in first
+            live = self._live.setdefault(session_id, _LiveSession(chat_session))
+            self._live.move_to_end(session_id)
+            while len(self._live) > self.max_live:
+                self._live.popitem(last=False)
+                self.evictions += 1
+            return live.chat_session
+
+    def save(self, session_id: str, chat_session=None):
+        """
+        Persist a chat's state so it can be rehydrated later.
+        Pass the chat the turn ran on: under load it may already have been evicted from the live set.
+        """
+        if chat_session is None:
+            with self._lock:
+                live = self._live.get(session_id)
+            if live is None:
+                return
+            chat_session = live.chat_session
+        self.store.save_state(
+            session_id,
+            chat_session.get_history(curated=True),
+            getattr(chat_session, "slots", {}),
+            getattr(chat_session, "summary", ""),
+        )
+
+    def discard(self, session_id: str):
+        """Drop the live chat, e.g. after its settings changed; the stored history is kept"""
+        with self._lock:
+            self._live.pop(session_id, None)
+
+    def delete(self, session_id: str):
+        self.discard(session_id)
+        self.store.delete(session_id)
+
+    def evict_idle(self) -> int:
+        """Drop live chats unused for idle_seconds"""
+        cutoff = time.monotonic() - self.idle_seconds
+        with self._lock:
+            idle = [session_id for session_id, live in self._live.items() if live.last_used < cutoff]
+            for session_id in idle:
+                del self._live[session_id]
+            self.evictions += len(idle)
+        return len(idle)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"live": len(self._live), "max_live": self.max_live, "rehydrations": self.rehydrations, "evictions": self.evictions}
+
+
+_session_manager = None
+_session_manager_lock = threading.Lock()
+
+
+def get_session_manager() -> SessionManager:
+    """Return the process-wide session manager, opening the store on first use"""
+    global _session_manager
+    with _session_manager_lock:
+        if _session_manager is None:
+            _session_manager = SessionManager(SessionStore())
+        return _session_manager
@@ -0,0 +1,126 @@
+import argparse
+import importlib
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Set to 1 to print import and client init times per module at startup
+STARTUP_PROFILE = os.getenv("STARTUP_PROFILE", "0") == "1"
+STARTUP_PROFILE_TOP = int(os.getenv("STARTUP_PROFILE_TOP", "25"))
+
+_imports = {}  # module name -> [inclusive seconds, self seconds]
+_inits = []  # (name, seconds)
+_stack = []
+_lock = threading.Lock()
+_installed = False
+_reported = False
+
+
+class _TimedLoader:
+    """Wraps a module loader to time exec_module; time spent importing submodules is subtracted for self time"""
+
+    def __init__(self, loader):
+        self._loader = loader
+
+    def exec_module(self, module):
+        if threading.current_thread() is not threading.main_thread():
+            return self._loader.exec_module(module)
+        _stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            elapsed = time.perf_counter() - start
+            children = _stack.pop()
+            if _stack:
+                _stack[-1] += elapsed
+            _imports[module.__name__] = [elapsed, elapsed - children]
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+
+class _TimingFinder:
+    """Meta path finder that lets the other finders locate modules and wraps their loaders"""
+
+    def find_spec(self, name, path=None, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+                    spec.loader = _TimedLoader(spec.loader)
+                return spec
+        return None
+
+
+def start_profiling(force: bool = False):
+    """Start timing imports; call before the heavy imports. A no-op unless STARTUP_PROFILE=1 or force"""
+    global _installed
+    if not (STARTUP_PROFILE or force) or _installed:
+        return
+    sys.meta_path.insert(0, _TimingFinder())
+    _installed = True
+
+
+@contextmanager
+def timed_init(name: str):
+    """Time a one-off initialization such as creating an SDK client; printed as it happens when profiling"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if _installed:
+            elapsed = time.perf_counter() - start
+            with _lock:
+                _inits.append((name, elapsed))
+            print(f"[startup] init {name}: {elapsed * 1000:.1f} ms")
+
+
+def report(top: int = STARTUP_PROFILE_TOP) -> dict:
+    """Slowest imports by self time, plus the client inits seen so far"""
+    with _lock:
+        inits = list(_inits)
+    imports = sorted(_imports.items(), key=lambda item: item[1][1], reverse=True)
+    return {
+        "imports": [
+            {"module": name, "self_ms": round(self_seconds * 1000, 1), "total_ms": round(total * 1000, 1)}
+            for name, (total, self_seconds) in imports[:top]
+        ],
+        "import_total_ms": round(sum(self_seconds for _, self_seconds in _imports.values()) * 1000, 1),
+        "inits": [{"name": name, "ms": round(seconds * 1000, 1)} for name, seconds in inits],
+    }
+
+
+def print_report(top: int = STARTUP_PROFILE_TOP):
+    """Print the startup report once per process, if profiling is on"""
+    global _reported
+    if not _installed or _reported:
+        return
+    _reported = True
+    data = report(top)
+    print(f"[startup] imports took {data['import_total_ms']:.1f} ms; slowest by self time:")
+    for row in data["imports"]:
+        print(f"[startup]   {row['self_ms']:>8.1f} ms self {row['total_ms']:>8.1f} ms total  {row['module']}")
+    for row in data["inits"]:
+        print(f"[startup]   init {row['name']}: {row['ms']:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report import time per module for the app's entry points")
+    parser.add_argument("modules", nargs="*", default=["api"], help="Modules to import, e.g. api or app")
+    parser.add_argument("--top", type=int, default=STARTUP_PROFILE_TOP)
+    args = parser.parse_args()
+    start_profiling(force=True)
+    start = time.perf_counter()
+    for name in args.modules:
+        importlib.import_module(name)
+    print(f"[startup] imported {', '.join(args.modules)} in {(time.perf_counter() - start) * 1000:.1f} ms")
+    print_report(args.top)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+import contextvars
+import functools
+import importlib
+import inspect
+import json
+import math
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+# "jsonl" (default), "none", or "package.module:factory" for a custom exporter
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "jsonl")
+TRACE_PATH = os.getenv("TRACE_PATH", "traces.jsonl")
+# Spans kept in memory for the diagnostics panel
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "5000"))
+
+_session_id = contextvars.ContextVar("trace_session_id", default=None)
+_bot_type = contextvars.ContextVar("trace_bot_type", default=None)
+_current_span = contextvars.ContextVar("trace_current_span", default=None)
+
+
+def percentile(values, pct: float):
+    """Nearest-rank percentile of values, or None when empty"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+class Span:
+    """One timed operation; spans opened while another is current become its children"""
+
+    def __init__(self, name: str, parent=None, attributes: dict = None):
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.parent_id = parent.span_id if parent else None
+        self.session_id = _session_id.get()
+        self.bot_type = _bot_type.get()
+        self.attributes = dict(attributes or {})
+        self.status = "ok"
+        self.started_at = time.time()
+        self.duration_ms = None
+        self._start = time.perf_counter()
+
+    def set(self, key: str, value):
+        self.attributes[key] = value
+
+    def end(self, error: BaseException = None):
+        self.duration_ms = (time.perf_counter() - self._start) * 1000
+        if error is not None:
+            self.status = "error"
+            self.attributes["error"] = f"{type(error).__name__}: {error}"
+        _export(self.to_dict())
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "session_id": self.session_id,
+            "bot_type": self.bot_type,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration_ms, 3),
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Time the enclosed block as a span named name"""
+    current = Span(name, _current_span.get(), attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.end(e)
+        raise
+    else:
+        current.end()
+    finally:
+        _current_span.reset(token)
+
+
+@contextmanager
+def trace_turn(session_id: str, bot_type: str, **attributes):
+    """Root span for one chat turn; every span opened inside is tagged with the session id and bot type"""
+    session_token = _session_id.set(session_id)
+    bot_token = _bot_type.set(bot_type)
+    try:
+        with span("turn", **attributes) as turn:
+            yield turn
+    finally:
+        _bot_type.reset(bot_token)
+        _session_id.reset(session_token)
+
+
+def set_attribute(key: str, value):
+    """Attach an attribute to the current span, if there is one"""
+    current = _current_span.get()
+    if current is not None:
+        current.set(key, value)
+
+
+def traced(name: str = None):
+    """Decorator that runs a function inside a span; generators are timed until exhausted"""
+    def decorator(func):
+        span_name = name or func.__name__
+
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def generator_wrapper(*args, **kwargs):
+                current = Span(span_name, _current_span.get())
+                start = time.perf_counter()
+                chunks = 0
+                iterator = func(*args, **kwargs)
+                try:
+                    while True:
+                        # The span is only current while the generator body runs, never across a yield
+                        token = _current_span.set(current)
+                        try:
+                            item = next(iterator)
+                        except StopIteration:
+                            break
+                        finally:
+                            _current_span.reset(token)
+                        if chunks == 0:
+                            current.set("first_chunk_ms", round((time.perf_counter() - start) * 1000, 3))
+                        chunks += 1
+                        yield item
+                except BaseException as e:
+                    iterator.close()
+                    current.set("chunks", chunks)
+                    current.end(None if isinstance(e, GeneratorExit) else e)
+                    raise
+                current.set("chunks", chunks)
+                current.end()
+            return generator_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def current_context() -> contextvars.Context:
+    """Snapshot of the tracing context, for work handed to another thread"""
+    return contextvars.copy_context()
+
+
+# Exporters
+
+
+class JsonlExporter:
+    """Appends one JSON object per finished span to a file"""
+
+    def __init__(self, path: str = TRACE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+
+    def export(self, record: dict):
+        line = json.dumps(record, default=str)
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, "a", encoding="utf-8", buffering=1)
+            self._file.write(line + "\n")
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class RingBufferExporter:
+    """Keeps the most recent spans in memory for the diagnostics panel"""
+
+    def __init__(self, maxlen: int = TRACE_BUFFER_SIZE):
+        self._spans = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+
+    def export(self, record: dict):
+        with self._lock:
+            self._spans.append(record)
+
+    def spans(self) -> list:
+        with self._lock:
+            return list(self._spans)
+
+    def recent_turns(self, session_id: str = None, limit: int = 10) -> list:
+        """
+        Most recent turns first, each with its total and the longest span of each name inside it.
+        Longest rather than summed, since a prefetched lookup and the lookup that waits on it overlap.
+        """
+        spans = self.spans()
+        stages = {}
+        for record in spans:
+            if record["parent_id"] is not None:
+                trace_stages = stages.setdefault(record["trace_id"], {})
+                trace_stages[record["name"]] = max(trace_stages.get(record["name"], 0.0), record["duration_ms"])
+        turns = [
+            {
+                "started_at": record["started_at"],
+                "session_id": record["session_id"],
+                "bot_type": record["bot_type"],
+                "status": record["status"],
+                "total_ms": record["duration_ms"],
+                "stages": stages.get(record["trace_id"], {}),
+            }
+            for record in spans
+            if record["name"] == "turn" and (session_id is None or record["session_id"] == session_id)
+        ]
+        return turns[::-1][:limit]
+
+    def percentiles(self, bot_type: str = None) -> dict:
+        """Rolling p50/p95/p99 in ms per span name over the buffered spans"""
+        durations = {}
+        for record in self.spans():
+            if bot_type is None or record["bot_type"] == bot_type:
+                durations.setdefault(record["name"], []).append(record["duration_ms"])
+        return {
+            name: {
+                "count": len(values),
+                "p50": round(percentile(values, 50), 1),
+                "p95": round(percentile(values, 95), 1),
+                "p99": round(percentile(values, 99), 1),
+            }
+            for name, values in sorted(durations.items())
+        }
+
+
+def create_exporter(name: str = TRACE_EXPORTER):
+    """Build the configured exporter: "jsonl", "none", or a "package.module:factory" path"""
+    if name in ("", "none"):
+        return None
+    if name == "jsonl":
+        return JsonlExporter()
+    module_name, _, factory = name.partition(":")
+    return getattr(importlib.import_module(module_name), factory)()
+
+
+ring_buffer = RingBufferExporter()
+_exporters = [ring_buffer]
+_exporters_lock = threading.Lock()
+_configured = False
+
+
+def set_exporter(exporter):
+    """Replace the configured exporter; the in-memory ring buffer always stays on"""
+    global _configured
+    with _exporters_lock:
+        _exporters[:] = [ring_buffer] + ([exporter] if exporter is not None else [])
+        _configured = True
+
+
+def _export(record: dict):
+    global _configured
+    if not _configured:
+        with _exporters_lock:
+            if not _configured:
+                exporter = create_exporter()
+                if exporter is not None:
+                    _exporters.append(exporter)
+                _configured = True
+    for exporter in list(_exporters):
+        try:
+            exporter.export(record)
+        except Exception as e:
+            print(f"Error exporting span: {e}")
+
+
+def recent_turns(session_id: str = None, limit: int = 10) -> list:
+    """Return per-turn stage breakdowns from the in-memory buffer, newest first"""
+    return ring_buffer.recent_turns(session_id, limit)
+
+
+def span_percentiles(bot_type: str = None) -> dict:
+    """Return rolling latency percentiles per span name from the in-memory buffer"""
+    return ring_buffer.percentiles(bot_type)
@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+# The backends are namespace packages at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def schedulers(monkeypatch):
+    """Fresh process-wide quota schedulers for one test, admitting every model at a high rate"""
+    from shared_backend import scheduler
+
+    monkeypatch.setattr(scheduler, "_schedulers", {})
+    monkeypatch.setattr(scheduler, "GEMINI_REQUESTS_PER_MINUTE", 60000.0)
+    return scheduler.get_scheduler
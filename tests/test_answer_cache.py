@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from sales_backend import answer_cache
+from sales_backend.answer_cache import SemanticAnswerCache, key_terms
+from sales_backend.local_rag import HashingEmbedder
+
+NEAR_MISSES = [
+    ("What's the difference between SLS vs SLA printing?", "What's the difference between SLS vs FDM printing?"),
+    ("Is Tough 2000 resin good for snap fits?", "Is Tough 1500 resin good for snap fits?"),
+    ("How much does the Form 4 cost in the US?", "How much does the Form 4 cost in the UK?"),
+]
+
+
+class SameVectorEmbedder:
+    """Scores every pair of questions as identical, so only the key-term check can tell them apart"""
+
+    name = "same"
+
+    def embed_query(self, text):
+        return np.ones(4, dtype=np.float32) / 2
+
+
+def test_exact_hit_ignores_case_and_punctuation():
+    cache = SemanticAnswerCache()
+    entry_id = cache.store("How much is the Form 4?", "$4,499", namespace="search")
+    assert cache.lookup("how much is the form 4", namespace="search") == (entry_id, "$4,499")
+    assert cache.lookup("how much is the form 4", namespace="rag") is None
+    assert cache.stats()["exact_hits"] == 1
+
+
+@pytest.mark.parametrize("cached, asked", NEAR_MISSES)
+def test_near_misses_are_not_served(cached, asked):
+    for embedder in (None, SameVectorEmbedder()):
+        cache = SemanticAnswerCache(embedder)
+        cache.store(cached, "cached answer")
+        assert cache.lookup(asked) is None
+
+
+def test_semantic_hit_needs_the_same_key_terms():
+    cache = SemanticAnswerCache(SameVectorEmbedder())
+    entry_id = cache.store("Which printer should I buy for dental models?", "Form 4B")
+    assert cache.lookup("What printer do you recommend for dental models") == (entry_id, "Form 4B")
+    assert cache.stats()["semantic_hits"] == 1
+    assert key_terms("Price of the Form 4 in the UK?") == {"form", "4", "uk"}
+
+
+def test_hashing_embedder_is_not_used_for_matching(monkeypatch):
+    monkeypatch.setattr(answer_cache, "_answer_cache", None)
+    monkeypatch.setattr(answer_cache, "ANSWER_CACHE_EMBEDDER", HashingEmbedder.name)
+    assert answer_cache.get_answer_cache().embedder is None
+
+
+def test_entries_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(answer_cache.time, "monotonic", lambda: now[0])
+    cache = SemanticAnswerCache(ttl=60)
+    cache.store("Do you ship to Canada?", "Yes")
+    cache.store("Do you offer financing?", "Yes", ttl=600)
+    now[0] += 61
+    assert cache.lookup("Do you ship to Canada?") is None
+    assert cache.lookup("Do you offer financing?") is not None
+    assert cache.stats()["size"] == 1
+
+
+def test_invalidate_matching():
+    cache = SemanticAnswerCache()
+    cache.store("How much is the Form 4?", "The Form 4 price is $4,499")
+    cache.store("What is the Form 4 price in Europe?", "EUR 4,499")
+    cache.store("Do you offer training?", "Yes, online and on site")
+    assert cache.invalidate_matching("PRICE") == 2
+    assert [question for _, _, question in cache.entries()] == ["Do you offer training?"]
@@ -0,0 +1,55 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+import api
+from shared_backend.sessions import SessionManager, SessionStore
+
+
+@pytest.fixture
+def release(tmp_path, monkeypatch):
+    """Turns block until the returned event is set"""
+    release = threading.Event()
+
+    def run_turn(manager, info, message, on_chunk=None):
+        release.wait(10)
+        if on_chunk is not None:
+            on_chunk("hello")
+        return SimpleNamespace(text="hello", json=None, notices=[])
+
+    monkeypatch.setattr(api, "get_session_manager", lambda: SessionManager(SessionStore(str(tmp_path / "sessions.sqlite3"))))
+    monkeypatch.setattr(api, "create_chat", lambda bot, mode=None, history=None: SimpleNamespace())
+    monkeypatch.setattr(api, "run_turn", run_turn)
+    yield release
+    release.set()
+
+
+def test_turns_past_the_queue_get_503_with_retry_after(release):
+    async def scenario():
+        async with TestClient(TestServer(api.create_app(max_workers=1, max_queued_turns=1))) as client:
+            session_ids = []
+            for _ in range(3):
+                response = await client.post("/sessions", json={"bot": "services"})
+                session_ids.append((await response.json())["session_id"])
+
+            running = asyncio.ensure_future(client.post(f"/sessions/{session_ids[0]}/messages", json={"message": "hi"}))
+            queued = asyncio.ensure_future(client.post(f"/sessions/{session_ids[1]}/messages/stream", json={"message": "hi"}))
+            await asyncio.sleep(0.2)
+
+            rejected = await client.post(f"/sessions/{session_ids[2]}/messages/stream", json={"message": "hi"})
+            assert rejected.status == 503
+            assert rejected.headers["Retry-After"] == str(api.API_RETRY_AFTER_SECONDS)
+            assert (await client.post("/sessions", json={"bot": "services"})).status == 503
+
+            health = await (await client.get("/healthz")).json()
+            assert health["turns"] == {"running": 1, "queued": 1, "limit": 2, "rejected": 2}
+
+            release.set()
+            assert (await (await running).json())["reply"] == "hello"
+            assert "event: done" in await (await queued).text()
+            assert (await client.post(f"/sessions/{session_ids[2]}/messages", json={"message": "hi"})).status == 200
+
+    asyncio.run(scenario())
@@ -0,0 +1,138 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from services_backend import bigquery
+from services_backend.bigquery import (
+    QueryStats, build_print_query, normalize_printer_serial, run_custom_query, run_print_query, run_recent_jobs_query,
+    serial_variants,
+)
+
+MIB = 1024 ** 2
+
+
+class CaseSensitiveClient:
+    """Answers print queries like BigQuery's IN UNNEST: only exact, case-sensitive serial matches have rows"""
+
+    stored_serials = {"Form4L-CalmOtter"}
+
+    def __init__(self):
+        self.queried = []
+
+    def query(self, query, job_config=None, **kwargs):
+        serials = next(parameter.values for parameter in job_config.query_parameters if parameter.name == "printer_serials")
+        if job_config.dry_run:
+            return Job([])
+        self.queried.append(list(serials))
+        matches = self.stored_serials & set(serials)
+        return Job([{"printer_serial": serial, "name": "part.form"} for serial in matches])
+
+
+class WindowClient:
+    """Estimates bytes_per_day for each day the since parameter reaches back; prints exist only from rows_after_days back"""
+
+    def __init__(self, bytes_per_day=MIB, rows_after_days=0):
+        self.bytes_per_day = bytes_per_day
+        self.rows_after_days = rows_after_days
+        self.windows = []
+
+    def query(self, query, job_config=None, **kwargs):
+        since = next((parameter.value for parameter in job_config.query_parameters if parameter.name == "since"), None)
+        days = 365 if since is None else int((datetime.now(timezone.utc) - since) / timedelta(days=1))
+        estimated = days * self.bytes_per_day
+        if job_config.dry_run:
+            return Job([], estimated)
+        assert estimated <= job_config.maximum_bytes_billed
+        self.windows.append(days)
+        rows = [{"printer_serial": "CalmOtter", "name": "part.form"}] if days >= self.rows_after_days else []
+        return Job(rows, estimated)
+
+
+class Job:
+    def __init__(self, rows, total_bytes_processed=1024):
+        self.rows = rows
+        self.total_bytes_processed = total_bytes_processed
+
+    def result(self):
+        return self.rows
+
+
+def test_serial_variants_use_canonical_casing_and_every_printer_line():
+    for spelling in ("calmotter", "CALMOTTER", "CalmOtter", "form4-calmotter", "Form4L-CalmOtter", "FORM 4B calmotter"):
+        assert normalize_printer_serial(spelling) == "CalmOtter"
+        assert serial_variants(spelling) == ["CalmOtter", "Form4-CalmOtter", "Form4L-CalmOtter", "Form4B-CalmOtter"]
+
+
+def test_names_that_do_not_split_keep_their_spelling():
+    assert normalize_printer_serial("Form4-XJ9000") == "XJ9000"
+
+
+def test_lookups_in_any_casing_find_the_rows_and_share_one_cache_entry(monkeypatch):
+    client = CaseSensitiveClient()
+    monkeypatch.setattr(bigquery, "get_bigquery_client", lambda: client)
+    bigquery.recent_jobs_cache.clear()
+
+    full_results, job_names = run_recent_jobs_query("calmotter")
+    assert job_names == "part.form"
+    assert run_recent_jobs_query("Form4L-CalmOtter") == (full_results, job_names)
+    assert run_recent_jobs_query("CalmOtter") == (full_results, job_names)
+    assert len(client.queried) == 1
+
+
+@pytest.fixture
+def window_client(monkeypatch):
+    """A WindowClient behind a 10 MiB cap, with fresh dry-run estimates and query stats"""
+
+    def install(**options):
+        client = WindowClient(**options)
+        monkeypatch.setattr(bigquery, "get_bigquery_client", lambda: client)
+        monkeypatch.setattr(bigquery, "_dry_run_cache", bigquery.TTLCache(maxsize=256, ttl=3600))
+        monkeypatch.setattr(bigquery, "query_stats", QueryStats())
+        monkeypatch.setattr(bigquery, "BIGQUERY_MAX_BYTES_SCANNED", 10 * MIB)
+        monkeypatch.setattr(bigquery, "BIGQUERY_DRY_RUN", True)
+        return client
+
+    return install
+
+
+def stats(name):
+    counters = bigquery.query_stats.summary()[name]
+    return {counter: counters[counter] for counter in ("calls", "rejected", "narrowed", "widened")}
+
+
+def test_print_query_is_bounded_in_time_and_serial():
+    sql = build_print_query("pr.print_guid", order_by="pr.print_started_at DESC", limit=5)
+    assert "pr.print_started_at >= @since" in sql
+    assert "pr.printer_serial IN UNNEST(@printer_serials)" in sql
+    assert "j.printer_serial IN UNNEST(@printer_serials)" in sql
+    assert sql.rstrip().endswith("LIMIT 5")
+
+
+def test_empty_windows_widen_from_7_to_30_to_180_days(window_client):
+    client = window_client(bytes_per_day=1024, rows_after_days=180)
+    rows = run_print_query("recent_jobs", "pr.print_guid", ["CalmOtter"])
+    assert rows and client.windows == [7, 30, 180]
+    assert stats("recent_jobs") == {"calls": 3, "rejected": 0, "narrowed": 0, "widened": 2}
+
+
+def test_over_budget_first_window_is_halved(window_client):
+    client = window_client(bytes_per_day=3 * MIB)
+    assert run_print_query("recent_jobs", "pr.print_guid", ["CalmOtter"])
+    # 7 days would scan 21 MiB; 3 days (9 MiB) fits under the 10 MiB cap
+    assert client.windows == [3]
+    assert stats("recent_jobs") == {"calls": 1, "rejected": 1, "narrowed": 1, "widened": 0}
+
+
+def test_widening_stops_at_a_window_over_the_cap(window_client):
+    client = window_client(bytes_per_day=MIB, rows_after_days=180)
+    assert run_print_query("recent_jobs", "pr.print_guid", ["CalmOtter"]) == []
+    # 30 days would scan 30 MiB, so the 7-day answer stands
+    assert client.windows == [7]
+    assert stats("recent_jobs") == {"calls": 1, "rejected": 1, "narrowed": 0, "widened": 1}
+
+
+def test_over_cap_custom_query_is_rejected_without_running(window_client):
+    client = window_client(bytes_per_day=MIB)
+    assert run_custom_query("SELECT * FROM form4_logs.print") == []
+    assert client.windows == []
+    assert bigquery.query_stats.summary()["custom"]["rejected"] == 1
@@ -0,0 +1,132 @@
+import asyncio
+import json
+from datetime import datetime, timedelta, timezone
+
+import aiohttp
+import pytest
+
+from sales_backend import gong
+
+
+class Response:
+    def __init__(self, body, status=200):
+        self.status = status
+        self.headers = {}
+        self.body = body
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    async def json(self):
+        return self.body
+
+
+class FakeGong:
+    """
+    Every window has two pages of one transcript each. failures is a list of exceptions raised by the
+    next requests in turn; None lets a request through
+    """
+
+    def __init__(self, failures=()):
+        self.failures = list(failures)
+        self.requests = []
+
+    def session(self, *args, **kwargs):
+        return FakeSession(self)
+
+    def post(self, url, json):
+        window = (json["filter"]["fromDateTime"], json["filter"]["toDateTime"])
+        cursor = json.get("cursor")
+        failure = self.failures.pop(0) if self.failures else None
+        if failure is not None:
+            raise failure
+        self.requests.append((window, cursor))
+        page = 2 if cursor else 1
+        call_id = f"{window[0][:10]}-{page}"
+        records = {"cursor": "page-2"} if page == 1 else {}
+        return Response({"records": records, "callTranscripts": [{"callId": call_id, "transcript": [{"speakerId": "1", "text": "hi"}]}]})
+
+
+class FakeSession:
+    def __init__(self, gong_api):
+        self.gong_api = gong_api
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def post(self, url, json):
+        return self.gong_api.post(url, json)
+
+
+@pytest.fixture
+def fake_gong(monkeypatch):
+    def install(failures=()):
+        api = FakeGong(failures)
+        monkeypatch.setattr(gong.aiohttp, "ClientSession", api.session)
+        return api
+
+    monkeypatch.setattr(gong, "ACCESS_KEY", "key")
+    monkeypatch.setattr(gong, "SECRET_KEY", "secret")
+    monkeypatch.setattr(gong, "BASE_URL", "https://gong.example")
+    return install
+
+
+@pytest.fixture(autouse=True)
+def fast_limiter(monkeypatch):
+    original = gong.AdaptiveRateLimiter
+    monkeypatch.setattr(gong, "AdaptiveRateLimiter", lambda: original(min_interval=0.0, max_interval=0.0))
+
+
+def run(**kwargs):
+    return asyncio.run(gong.fetch_all(**kwargs))
+
+
+def test_resume_reuses_the_saved_range_and_cursors(fake_gong, tmp_path):
+    checkpoint = str(tmp_path / "checkpoint.json")
+    output = str(tmp_path / "transcripts")
+    from_dt = datetime.now(timezone.utc) - timedelta(days=10)
+    # Window one finishes, window two dies for good after its first page
+    api = fake_gong([None, None, None] + [ValueError("crash")])
+    with pytest.raises(ValueError):
+        run(from_dt=from_dt, output_dir=output, checkpoint_path=checkpoint, max_concurrent_windows=1)
+    with open(checkpoint) as f:
+        saved = json.load(f)
+    second_window = api.requests[-1][0]
+    assert saved["run"]["to"] == second_window[1]
+
+    api = fake_gong()
+    assert run(output_dir=output, checkpoint_path=checkpoint, max_concurrent_windows=1, resume=True) == 4
+    # Only the page after the saved cursor is fetched again, for the same window key
+    assert api.requests == [(second_window, "page-2")]
+    with open(checkpoint) as f:
+        saved = json.load(f)
+    assert saved == {"run": None, "windows": {}, "last_to": second_window[1]}
+    assert len(list((tmp_path / "transcripts").iterdir())) == 4
+
+
+def test_a_new_range_drops_stale_windows(fake_gong, tmp_path):
+    checkpoint = str(tmp_path / "checkpoint.json")
+    from_dt = datetime.now(timezone.utc) - timedelta(days=3)
+    fake_gong([None, ValueError("crash")])
+    with pytest.raises(ValueError):
+        run(from_dt=from_dt, output_dir=str(tmp_path), checkpoint_path=checkpoint)
+
+    api = fake_gong()
+    run(from_dt=from_dt, output_dir=str(tmp_path), checkpoint_path=checkpoint)
+    assert [cursor for _, cursor in api.requests] == [None, "page-2"]
+
+
+def test_transport_errors_are_retried(fake_gong, tmp_path):
+    from_dt = datetime.now(timezone.utc) - timedelta(days=3)
+    api = fake_gong([aiohttp.ServerDisconnectedError(), asyncio.TimeoutError()])
+    assert run(from_dt=from_dt, output_dir=str(tmp_path), checkpoint_path=str(tmp_path / "checkpoint.json")) == 2
+    assert [cursor for _, cursor in api.requests] == [None, "page-2"]
@@ -0,0 +1,117 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from google.genai import types
+
+from shared_backend import hedging
+from shared_backend.hedging import HedgedChat
+from shared_backend.history import CompactingChat
+
+
+def chunk(text):
+    return types.GenerateContentResponse(candidates=[types.Candidate(content=types.Content(role="model", parts=[types.Part.from_text(text=text)]))])
+
+
+class FakeChat:
+    def __init__(self, backend, history):
+        self.backend = backend
+        self.history = list(history)
+
+    def send_message_stream(self, message):
+        self.backend.requests += 1
+        self.backend.release.wait(self.backend.first_token_seconds)
+        yield chunk(self.backend.reply[0])
+        self.backend.rest.wait(10)
+        for text in self.backend.reply[1:]:
+            yield chunk(text)
+        self.history += [types.Content(role="user", parts=[types.Part.from_text(text=message)]), chunk("".join(self.backend.reply)).candidates[0].content]
+
+    def get_history(self, curated=False):
+        return self.history
+
+
+class FakeBackend:
+    """Client whose chats stall first_token_seconds (or until release is set) before replying, then until rest is set"""
+
+    def __init__(self, first_token_seconds, reply, project="formlabs"):
+        # Looks like a Vertex client to quota_owner, so each project gets its own schedulers
+        self.vertexai = True
+        self._api_client = SimpleNamespace(project=project, location="us-central1")
+        self.first_token_seconds = first_token_seconds
+        self.reply = reply
+        self.requests = 0
+        self.release = threading.Event()
+        self.rest = threading.Event()
+        self.rest.set()
+        self.chats = self
+
+    def create(self, model, config, history):
+        return FakeChat(self, history)
+
+
+@pytest.fixture(autouse=True)
+def short_hedge_delay(monkeypatch):
+    monkeypatch.setattr(hedging, "HEDGE_DEFAULT_DELAY_SECONDS", 0.05)
+
+
+def scheduler_for(schedulers, model, max_concurrency, project="formlabs"):
+    scheduler = schedulers(model, f"vertex:{project}/us-central1")
+    scheduler.max_concurrency = max_concurrency
+    return scheduler
+
+
+def test_losing_backend_gives_its_slot_back_when_the_winner_answers(schedulers):
+    scheduler = scheduler_for(schedulers, "hedge-test-release", 4)
+    slow, fast = FakeBackend(10, ["slow"]), FakeBackend(0, ["fast ", "answer"])
+    fast.rest.clear()
+    chat = HedgedChat({
+        "rag": CompactingChat(slow, "hedge-test-release", None),
+        "search": CompactingChat(fast, "hedge-test-release", None),
+    }, "rag")
+
+    stream = chat.send_message_stream("which printer?")
+    assert next(stream).text == "fast "
+    # The primary is still stalled on its request, but no longer holds a slot
+    assert scheduler.in_flight == 1
+    fast.rest.set()
+    assert "".join(c.text for c in stream) == "answer"
+    assert chat.last_backend == "search"
+    assert scheduler.in_flight == 0
+
+    slow.release.set()
+    time.sleep(0.1)
+    assert scheduler.in_flight == 0
+    assert slow.chats.requests == 1
+
+
+def test_no_hedge_without_spare_capacity(schedulers):
+    scheduler = scheduler_for(schedulers, "hedge-test-full", 1)
+    primary, secondary = FakeBackend(0.3, ["primary"]), FakeBackend(0, ["secondary"])
+    chat = HedgedChat({
+        "rag": CompactingChat(primary, "hedge-test-full", None),
+        "search": CompactingChat(secondary, "hedge-test-full", None),
+    }, "rag")
+
+    assert chat.send_message("which printer?").text == "primary"
+    assert secondary.requests == 0
+    assert scheduler.in_flight == 0
+
+
+def test_capacity_is_checked_on_the_hedge_backends_own_quota(schedulers):
+    busy = scheduler_for(schedulers, "hedge-test-owners", 1, project="vertex-project")
+    free = scheduler_for(schedulers, "hedge-test-owners", 1, project="api-project")
+    primary = FakeBackend(10, ["primary"], project="vertex-project")
+    secondary = FakeBackend(0, ["secondary"], project="api-project")
+    chat = HedgedChat({
+        "rag": CompactingChat(primary, "hedge-test-owners", None),
+        "search": CompactingChat(secondary, "hedge-test-owners", None),
+    }, "rag")
+
+    # The primary fills its own project's only slot; the other project's quota is untouched
+    assert chat.send_message("which printer?").text == "secondary"
+    assert secondary.requests == 1
+    assert (busy.admitted, free.admitted) == (1, 1)
+    primary.release.set()
@@ -0,0 +1,138 @@
+import threading
+import time
+from types import SimpleNamespace
+
+from google.genai import types
+
+from shared_backend.history import CompactingChat, content_text
+
+
+def text_content(role, text):
+    return types.Content(role=role, parts=[types.Part.from_text(text=text)])
+
+
+class FakeChat:
+    def __init__(self, history):
+        self.history = list(history)
+
+    def send_message(self, message):
+        self.history += [text_content("user", message), text_content("model", f"reply to {message}")]
+        return types.GenerateContentResponse(candidates=[types.Candidate(content=self.history[-1])])
+
+    def get_history(self, curated=False):
+        return self.history
+
+
+class FakeModels:
+    """Summaries block until release is set; counting tokens over the network is not expected"""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.summaries = 0
+
+    def generate_content(self, model, contents):
+        self.release.wait(10)
+        self.summaries += 1
+        return SimpleNamespace(text=f"summary {self.summaries}")
+
+    def count_tokens(self, model, contents):
+        raise AssertionError("compaction should not call count_tokens")
+
+
+class FakeClient:
+    def __init__(self):
+        self.models = FakeModels()
+        self.chats = SimpleNamespace(create=lambda model, config, history: FakeChat(history))
+
+
+def user_turns(chat):
+    return [content_text(content) for content in chat.get_history() if content.role == "user"]
+
+
+def test_turns_do_not_wait_for_a_pending_compaction(schedulers):
+    client = FakeClient()
+    chat = CompactingChat(client, "history-test", None, keep_turns=2, compact_after_turns=3)
+    for i in range(4):
+        chat.send_message(f"turn {i}")
+
+    # The summary call is still running; the next turns go out on the full history without waiting for it
+    start = time.perf_counter()
+    chat.send_message("turn 4")
+    chat.send_message("turn 5")
+    assert time.perf_counter() - start < 1
+    assert user_turns(chat) == [f"turn {i}" for i in range(6)]
+
+    client.models.release.set()
+    chat.wait_for_compaction()
+    assert chat.summary == "summary 1"
+    # Turns 0 and 1 were summarized; turns sent while the summary was written are all kept
+    assert user_turns(chat)[0].startswith("Summary of our conversation so far: summary 1")
+    assert user_turns(chat)[1:] == [f"turn {i}" for i in range(2, 6)]
+    assert chat.token_stats["compactions"] == 1
+    assert chat.token_stats["tokens_before"] > 0
+
+
+def test_compaction_is_dropped_when_the_history_is_replaced(schedulers):
+    client = FakeClient()
+    chat = CompactingChat(client, "history-test", None, keep_turns=2, compact_after_turns=3)
+    for i in range(4):
+        chat.send_message(f"turn {i}")
+    chat.set_history([text_content("user", "synced"), text_content("model", "ok")])
+
+    client.models.release.set()
+    chat.wait_for_compaction()
+    chat.send_message("next")
+    assert chat.summary == ""
+    assert user_turns(chat) == ["synced", "next"]
+
+
+def lookup_jobs(printer_serial: str) -> dict:
+    """Look up a printer's recent jobs"""
+    return {"jobs": [f"{printer_serial}-job"]}
+
+
+class FunctionCallingChat(FakeChat):
+    """Answers a message with a lookup_jobs call, then the function result with text, as the model would"""
+
+    def __init__(self, history):
+        super().__init__(history)
+        self.sent = []
+
+    def _reply(self, message):
+        self.sent.append(message)
+        if isinstance(message, str):
+            part = types.Part.from_function_call(name="lookup_jobs", args={"printer_serial": "Form4-1"})
+        else:
+            part = types.Part.from_text(text=f"jobs: {message[0].function_response.response['jobs']}")
+        self.history.append(types.Content(role="model", parts=[part]))
+        return types.GenerateContentResponse(candidates=[types.Candidate(content=self.history[-1])])
+
+    def send_message(self, message):
+        return self._reply(message)
+
+    def send_message_stream(self, message):
+        yield self._reply(message)
+
+
+def function_tool_chat():
+    client = FakeClient()
+    client.chats = SimpleNamespace(create=lambda model, config, history: FunctionCallingChat(history))
+    config = types.GenerateContentConfig(tools=[lookup_jobs], system_instruction="You are Pete")
+    return CompactingChat(client, "history-test", config)
+
+
+def test_function_tools_are_declared_so_the_prompt_can_be_cached(schedulers):
+    chat = function_tool_chat()
+
+    declaration, = chat.config.tools[0].function_declarations
+    assert declaration.name == "lookup_jobs"
+    assert chat._prompt_digest is not None
+
+
+def test_function_calls_are_run_by_the_chat(schedulers):
+    chat = function_tool_chat()
+
+    assert chat.send_message("my serial is Form4-1").text == "jobs: ['Form4-1-job']"
+    assert "".join(chunk.text or "" for chunk in chat.send_message_stream("again")) == "jobs: ['Form4-1-job']"
+    assert chat._chat.sent[1][0].function_response.name == "lookup_jobs"
+    assert len(chat._chat.sent) == 4
@@ -0,0 +1,54 @@
+import json
+
+import pytest
+
+from shared_backend import idempotency, outbox as outbox_module
+from shared_backend.idempotency import SubmissionIndex, submit_once
+from shared_backend.outbox import Outbox
+
+URL = "http://127.0.0.1:9/hook"
+
+
+@pytest.fixture
+def box(tmp_path, monkeypatch):
+    box = Outbox(str(tmp_path / "outbox.sqlite3"))
+    monkeypatch.setattr(outbox_module, "_outbox", box)
+    monkeypatch.setattr(idempotency, "_index", SubmissionIndex(str(tmp_path / "submissions.sqlite3")))
+    monkeypatch.setattr(idempotency, "SUBMISSION_HOLD_SECONDS", 3600)
+    yield box
+    box.stop()
+
+
+def payloads(box):
+    return [json.loads(payload) for (payload,) in box._execute("SELECT payload FROM outbox ORDER BY id")]
+
+
+def test_sales_leads_are_keyed_on_email_alone(box):
+    first = submit_once("opportunity", URL, {"email": "A@example.com", "customer_initial_question": "Which printer for dental?"})
+    again = submit_once("opportunity", URL, {"email": "a@example.com ", "customer_initial_question": "Looking at dental printers"})
+    assert again == first
+    assert idempotency.submission_stats()["merged"] == 1
+    (payload,) = payloads(box)
+    assert payload["submission_action"] == "create"
+
+
+def test_changes_after_delivery_are_sent_as_an_update(box):
+    first = submit_once("case", URL, {"email": "a@example.com", "issue": "layer shift"}, "BrightOtter")
+    box._execute("DELETE FROM outbox WHERE id = ?", (first,))  # delivered
+
+    assert submit_once("case", URL, {"email": "a@example.com", "issue": "layer shift"}, "BrightOtter") == first
+    update = submit_once("case", URL, {"email": "a@example.com", "issue": "layer shift on every print"}, "BrightOtter")
+    assert update != first
+
+    stats = idempotency.submission_stats()
+    assert (stats["new"], stats["duplicate"], stats["updated"]) == (1, 1, 1)
+    (payload,) = payloads(box)
+    assert payload["submission_action"] == "update" and payload["issue"] == "layer shift on every print"
+    assert payload["submission_key"] == idempotency.submission_key("case", "a@example.com", "BrightOtter")
+
+
+def test_cases_without_a_serial_are_not_keyed(box):
+    first = submit_once("case", URL, {"email": "a@example.com"}, "")
+    second = submit_once("case", URL, {"email": "a@example.com"}, "")
+    assert first != second
+    assert idempotency.submission_stats()["unkeyed"] == 2
@@ -0,0 +1,124 @@
+import pytest
+
+from sales_backend.ingest import Manifest, ingest
+
+CORPUS = "projects/p/locations/l/ragCorpora/1"
+
+
+class FakeCorpus:
+    """In-memory RAG corpus behind the import, list and delete functions ingest() calls"""
+
+    def __init__(self):
+        self.rag_files = {}
+        self.created = 0
+        self.deleted = []
+        self.fail_imports = set()
+
+    def import_batch(self, corpus_name, batch, embedding_requests_per_min, import_limiter):
+        if self.fail_imports & {file_id for file_id, _ in batch}:
+            raise RuntimeError("import failed")
+        for file_id, content_key in batch:
+            self.created += 1
+            self.rag_files[f"{corpus_name}/ragFiles/{self.created}"] = (file_id, content_key)
+        return len(batch)
+
+    def list_files(self, corpus_name):
+        return {file_id: name for name, (file_id, _) in self.rag_files.items()}
+
+    def delete_file(self, rag_file_name):
+        del self.rag_files[rag_file_name]
+        self.deleted.append(rag_file_name)
+
+    def versions(self):
+        return sorted(self.rag_files.values())
+
+    def ingest(self, manifest, drive_files=None, **kwargs):
+        return ingest(CORPUS, manifest, drive_files, import_batch_fn=self.import_batch,
+                      list_rag_files_fn=self.list_files, delete_file_fn=self.delete_file, **kwargs)
+
+
+def drive_file(file_id, md5):
+    return {"id": file_id, "name": f"{file_id}.pdf", "createdTime": f"2024-01-0{file_id[-1]}T00:00:00Z", "md5Checksum": md5}
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    return Manifest(str(tmp_path / "manifest.sqlite3"))
+
+
+@pytest.fixture
+def corpus():
+    return FakeCorpus()
+
+
+def test_failed_batches_stay_pending_and_resume_imports_only_them(manifest, corpus):
+    files = [drive_file(f"f{i}", "a") for i in range(1, 5)]
+    corpus.fail_imports = {"f1"}
+
+    assert corpus.ingest(manifest, files, batch_size=2) == 2
+    assert manifest.stats() == {"imported": 2, "pending": 2}
+
+    corpus.fail_imports = set()
+    assert corpus.ingest(manifest, batch_size=2) == 2
+    assert manifest.stats() == {"imported": 4}
+    assert corpus.versions() == [(f"f{i}", "a") for i in range(1, 5)]
+    assert corpus.ingest(manifest, files) == 0
+
+
+def test_changed_file_replaces_its_old_rag_file(manifest, corpus):
+    corpus.ingest(manifest, [drive_file("f1", "a"), drive_file("f2", "a")])
+    old_name = corpus.list_files(CORPUS)["f1"]
+
+    assert corpus.ingest(manifest, [drive_file("f1", "b"), drive_file("f2", "a")]) == 1
+
+    assert corpus.deleted == [old_name]
+    assert corpus.versions() == [("f1", "b"), ("f2", "a")]
+    rag_file_name, = manifest._conn.execute("SELECT rag_file_name FROM files WHERE file_id = 'f1'").fetchone()
+    assert rag_file_name == corpus.list_files(CORPUS)["f1"] != old_name
+
+
+def test_changed_file_whose_import_fails_is_not_deleted_twice(manifest, corpus):
+    corpus.ingest(manifest, [drive_file("f1", "a")])
+    corpus.fail_imports = {"f1"}
+
+    corpus.ingest(manifest, [drive_file("f1", "b")])
+    assert corpus.versions() == []
+    corpus.fail_imports = set()
+    corpus.ingest(manifest)
+
+    assert len(corpus.deleted) == 1
+    assert corpus.versions() == [("f1", "b")]
+
+
+def test_file_deleted_from_drive_is_removed_from_the_corpus_and_manifest(manifest, corpus):
+    corpus.ingest(manifest, [drive_file("f1", "a"), drive_file("f2", "a")])
+
+    assert corpus.ingest(manifest, [drive_file("f2", "a")]) == 0
+
+    assert corpus.versions() == [("f2", "a")]
+    assert manifest.stats() == {"imported": 1}
+
+
+def test_failed_delete_keeps_the_old_version_out_of_the_import(manifest, corpus):
+    corpus.ingest(manifest, [drive_file("f1", "a")])
+
+    def failing_delete(rag_file_name):
+        raise RuntimeError("delete failed")
+
+    imported = ingest(CORPUS, manifest, [drive_file("f1", "b")], import_batch_fn=corpus.import_batch,
+                      list_rag_files_fn=corpus.list_files, delete_file_fn=failing_delete)
+
+    assert imported == 0
+    assert corpus.versions() == [("f1", "a")]
+    assert corpus.ingest(manifest) == 1
+    assert corpus.versions() == [("f1", "b")]
+
+
+def test_rag_file_names_are_backfilled_for_manifests_without_them(manifest, corpus):
+    corpus.ingest(manifest, [drive_file("f1", "a")])
+    manifest._conn.execute("UPDATE files SET rag_file_name = NULL")
+
+    corpus.ingest(manifest, [drive_file("f1", "b")])
+
+    assert len(corpus.deleted) == 1
+    assert corpus.versions() == [("f1", "b")]
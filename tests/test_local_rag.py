@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+from google.genai import types
+
+from sales_backend.local_rag import HashingEmbedder, LocalRagChatSession, build_index, open_index
+from shared_backend.history import CompactingChat
+
+DOCUMENTS = [
+    ("docs/resin.txt", "Tough 2000 resin is a rigid engineering material for functional prototypes and jigs."),
+    ("docs/wash.txt", "Form Wash cleans parts in isopropyl alcohol after printing before they are cured."),
+    ("docs/cure.txt", "Form Cure post-cures printed parts with heat and 405 nm light for full material properties."),
+    ("docs/dental.txt", "Dental resins print surgical guides, models and splints for labs and clinics."),
+]
+
+
+@pytest.fixture
+def index_dir(tmp_path):
+    directory = str(tmp_path / "index")
+    assert build_index(DOCUMENTS, directory, HashingEmbedder(), batch_size=3) == len(DOCUMENTS)
+    return directory
+
+
+def test_top_k_retrieval(index_dir):
+    index = open_index(index_dir)
+    results = index.retrieve("which resin for rigid engineering prototypes", HashingEmbedder(), k=2)
+    assert len(results) == 2
+    assert results[0]["source"] == "docs/resin.txt"
+    assert results[0]["score"] >= results[1]["score"]
+    assert len(index.retrieve("resin", HashingEmbedder(), k=10)) == len(DOCUMENTS)
+
+
+def test_open_index_reads_from_memory_map(index_dir):
+    index = open_index(index_dir)
+    assert open_index(index_dir) is index
+    assert isinstance(index.embeddings, np.memmap) and isinstance(index.offsets, np.memmap)
+    assert index.embeddings.shape == (len(DOCUMENTS), 256)
+    expected = HashingEmbedder().embed_documents([text for _, text in DOCUMENTS])
+    assert np.allclose(index.embeddings, expected)
+    assert [index.get_chunk(i)["source"] for i in range(len(DOCUMENTS))] == [source for source, _ in DOCUMENTS]
+
+    with pytest.raises(ValueError):
+        index.retrieve("resin", HashingEmbedder(dim=64))
+
+
+class FakeChat:
+    def __init__(self, history):
+        self.history = list(history)
+        self.sent = []
+
+    def send_message(self, message):
+        self.sent.append(message)
+        self.history.append(types.Content(role="user", parts=[types.Part.from_text(text=message)]))
+        self.history.append(types.Content(role="model", parts=[types.Part.from_text(text="Tough 2000 fits.")]))
+        return types.GenerateContentResponse(candidates=[types.Candidate(content=self.history[-1])])
+
+    def get_history(self, curated=False):
+        return self.history
+
+
+class FakeChats:
+    def __init__(self):
+        self.sent = []
+
+    def create(self, model, config, history):
+        chat = FakeChat(history)
+        chat.sent = self.sent
+        return chat
+
+
+class FakeClient:
+    def __init__(self):
+        self.chats = FakeChats()
+
+
+def test_excerpts_are_sent_but_not_kept_in_history(index_dir):
+    client = FakeClient()
+    session = LocalRagChatSession(CompactingChat(client, "gemini-2.5-flash", None), open_index(index_dir), HashingEmbedder(), k=2)
+
+    for message in ("which resin for rigid prototypes?", "and how do I clean the parts?"):
+        session.send_message(message)
+
+    assert all("Customer message:" in sent and "[1]" in sent for sent in client.chats.sent)
+    assert "Customer message: and how do I clean the parts?" in client.chats.sent[1]
+    user_turns = [content.parts[0].text for content in session.get_history() if content.role == "user"]
+    assert user_turns == ["which resin for rigid prototypes?", "and how do I clean the parts?"]
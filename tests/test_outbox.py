@@ -0,0 +1,134 @@
+import json
+import sqlite3
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from shared_backend import outbox as outbox_module
+from shared_backend.outbox import Outbox
+
+
+class Webhook:
+    """Local webhook that answers with the scripted statuses in turn, then 200, and records every payload"""
+
+    def __init__(self, statuses=()):
+        self.statuses = list(statuses)
+        self.received = []
+        self._lock = threading.Lock()
+        webhook = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                with webhook._lock:
+                    webhook.received.append(body)
+                    status = webhook.statuses.pop(0) if webhook.statuses else 200
+                self.send_response(status)
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/hook"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(outbox_module, "BACKOFF_BASE_SECONDS", 0.05)
+    monkeypatch.setattr(outbox_module, "BACKOFF_MAX_SECONDS", 0.2)
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "outbox.sqlite3")
+
+
+def test_retries_with_backoff_until_delivered(db_path):
+    webhook = Webhook([503, 429, 200])
+    box = Outbox(db_path, max_attempts=5)
+    try:
+        outbox_id = box.enqueue(webhook.url, {"email": "a@example.com"})
+        assert box.wait_until_idle(timeout=10)
+        assert webhook.received == [{"email": "a@example.com"}] * 3
+        assert box.stats() == {"delivered": 1, "dead_letter": 0}
+        attempts, last_error = box._execute("SELECT attempts, last_error FROM outbox WHERE id = ?", (outbox_id,))[0]
+        assert attempts == 3
+        assert last_error.startswith("HTTP 429")
+    finally:
+        box.stop()
+        webhook.close()
+
+
+def test_dead_letters_after_max_attempts_and_requeues(db_path):
+    webhook = Webhook([500, 500, 500])
+    box = Outbox(db_path, max_attempts=3)
+    try:
+        outbox_id = box.enqueue(webhook.url, {"n": 1})
+        assert box.wait_until_idle(timeout=10)
+        dead = box.dead_letters()
+        assert [(row["id"], row["attempts"], row["payload"]) for row in dead] == [(outbox_id, 3, {"n": 1})]
+        assert dead[0]["last_error"].startswith("HTTP 500")
+        assert box.stats() == {"dead_letter": 1}
+
+        assert box.requeue_dead_letter(outbox_id)
+        assert box.wait_until_idle(timeout=10)
+        assert box.stats() == {"delivered": 1, "dead_letter": 0}
+        assert len(webhook.received) == 4
+    finally:
+        box.stop()
+        webhook.close()
+
+
+def test_client_errors_are_not_retried(db_path):
+    webhook = Webhook([400])
+    box = Outbox(db_path)
+    try:
+        box.enqueue(webhook.url, {"n": 1})
+        assert box.wait_until_idle(timeout=10)
+        assert len(webhook.received) == 1
+        assert box.dead_letters()[0]["attempts"] == 1
+    finally:
+        box.stop()
+        webhook.close()
+
+
+def test_rows_in_flight_at_a_crash_are_delivered_after_restart(db_path):
+    webhook = Webhook()
+    first = Outbox(db_path)
+    first.enqueue(webhook.url, {"n": 1}, delay=3600)
+    first.stop()
+    # The process died while posting the row
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("UPDATE outbox SET status = 'sending', next_attempt_at = 0")
+
+    second = Outbox(db_path)
+    try:
+        second.start()
+        assert second.wait_until_idle(timeout=10)
+        assert webhook.received == [{"n": 1}]
+        assert second.stats() == {"delivered": 1, "dead_letter": 0}
+    finally:
+        second.stop()
+        webhook.close()
+
+
+def test_start_after_stop_delivers_again(db_path):
+    webhook = Webhook()
+    box = Outbox(db_path)
+    try:
+        box.enqueue(webhook.url, {"n": 1})
+        assert box.wait_until_idle(timeout=10)
+        box.stop()
+        box.enqueue(webhook.url, {"n": 2})
+        assert box.wait_until_idle(timeout=10)
+        assert webhook.received == [{"n": 1}, {"n": 2}]
+    finally:
+        box.stop()
+        webhook.close()
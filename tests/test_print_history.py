@@ -0,0 +1,61 @@
+import os
+from datetime import datetime, timedelta, timezone
+
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import pytest
+
+from services_backend import print_history
+from services_backend.print_history import load_print_history, printer_history_summary, write_fixture
+
+
+@pytest.fixture
+def source(tmp_path, monkeypatch):
+    """Prints are read from Parquet fixtures in a source dir and cached in a separate dir"""
+    source_dir = tmp_path / "source"
+    monkeypatch.setattr(print_history, "PRINT_HISTORY_SOURCE_DIR", str(source_dir))
+    monkeypatch.setattr(print_history, "PRINT_HISTORY_CACHE_DIR", str(tmp_path / "cache"))
+    write_fixture(str(source_dir / "prints.parquet"), ["CalmOtter", "BaroqueTurtle"], days=28, seed=1)
+    return source_dir
+
+
+def test_summary_from_fixture(source):
+    table = pq.read_table(source / "prints.parquet")
+    expected = pc.sum(pc.equal(table["printer_serial"], "Form4-CalmOtter")).as_py()
+
+    summary = printer_history_summary("CalmOtter", days=28)
+    assert summary["prints"] == expected
+    assert 0 < summary["failed"] < expected
+    assert summary["failure_rate"] == round(summary["failed"] / expected, 3)
+    assert sum(week["prints"] for week in summary["weekly"]) == expected
+    assert sum(summary["top_error_codes"].values()) <= summary["failed"]
+
+
+def test_refresh_in_other_casing_keeps_the_cached_prints(source):
+    cached = load_print_history("Form4-CalmOtter", days=28)
+    assert load_print_history("calmotter", days=28, refresh=True).num_rows == cached.num_rows
+    assert load_print_history("FORM4-CALMOTTER", days=28, refresh=False).num_rows == cached.num_rows
+    assert os.listdir(print_history.PRINT_HISTORY_CACHE_DIR) == ["CalmOtter.parquet"]
+
+
+def test_incremental_refresh_reads_only_the_overlap(source):
+    cached = load_print_history("CalmOtter", days=28)
+    newest = pc.max(cached["print_started_at"]).as_py()
+
+    # The source now only has the last day of prints plus two new ones; older prints must come from the cache
+    table = pq.read_table(source / "prints.parquet")
+    recent = table.filter(pc.field("print_started_at") >= newest - timedelta(hours=print_history.PRINT_HISTORY_REFRESH_OVERLAP_HOURS))
+    pq.write_table(recent, source / "prints.parquet")
+    write_fixture(str(source / "new.parquet"), ["CalmOtter"], days=1, prints_per_day=2, seed=2)
+
+    refreshed = load_print_history("calmotter", days=28, refresh=True)
+    assert refreshed.num_rows == cached.num_rows + 2
+    assert refreshed["print_started_at"].to_pylist() == sorted(refreshed["print_started_at"].to_pylist())
+
+
+def test_prints_outside_the_window_are_dropped(source):
+    load_print_history("CalmOtter", days=28)
+    recent = load_print_history("CalmOtter", days=7, refresh=False)
+    since = datetime.now(timezone.utc) - timedelta(days=7, minutes=1)
+    assert recent.num_rows > 0
+    assert pc.min(recent["print_started_at"]).as_py() >= since
@@ -0,0 +1,108 @@
+import json
+
+import pyarrow.dataset as ds
+import pytest
+
+from sales_backend import qualify
+from sales_backend.qualify import (
+    JsonlWriter, ParquetWriter, StubQualifier, qualify_all, qualify_transcript, to_int,
+)
+from shared_backend.scheduler import QuotaExceeded
+
+
+@pytest.fixture
+def transcripts(tmp_path):
+    directory = tmp_path / "gong_transcripts"
+    directory.mkdir()
+    for i in range(12):
+        budget = f"our budget is ${i + 1},000 and we want to buy in 3 months" if i % 3 else "just browsing"
+        (directory / f"gong_transcript_{i}.txt").write_text(f"Customer: hi, I'm buyer{i}@example.com, {budget}\nRep: great\n")
+    (directory / "notes.md").write_text("not a transcript")
+    return directory
+
+
+def test_to_int():
+    assert to_int("$10,000") == 10000
+    assert to_int(10000) == 10000
+    assert to_int(2500.0) == 2500
+    assert to_int("about ten grand") is None
+    assert to_int(None) is None
+    assert to_int(True) is None
+
+
+def test_jsonl_output_and_resume(transcripts, tmp_path):
+    output = str(tmp_path / "leads.jsonl")
+    counts = qualify_all(StubQualifier(), str(transcripts), output, concurrency=4, limit=5)
+    assert (counts["qualified"], counts["skipped"]) == (5, 0)
+
+    counts = qualify_all(StubQualifier(), str(transcripts), output, concurrency=4)
+    assert (counts["qualified"], counts["skipped"], counts["failed"]) == (7, 5, 0)
+
+    records = [json.loads(line) for line in open(output)]
+    assert sorted(record["call_id"] for record in records) == sorted(str(i) for i in range(12))
+    by_call = {record["call_id"]: record for record in records}
+    assert by_call["1"]["email"] == "buyer1@example.com"
+    assert by_call["1"]["budget"] == 2000
+    assert by_call["1"]["is_qualified"] == "Yes"
+    assert by_call["0"]["is_qualified"] == "No"
+    assert by_call["0"]["model"] == "stub"
+
+
+def test_jsonl_line_cut_short_by_a_crash_is_qualified_again(transcripts, tmp_path):
+    output = tmp_path / "leads.jsonl"
+    qualify_all(StubQualifier(), str(transcripts), str(output), limit=3)
+    lines = output.read_text().splitlines()
+    cut_file = json.loads(lines[-1])["file"]
+    output.write_text("\n".join(lines[:-1]) + "\n" + lines[-1][:25])
+
+    assert cut_file not in JsonlWriter(str(output)).finished()
+    counts = qualify_all(StubQualifier(), str(transcripts), str(output))
+    assert (counts["qualified"], counts["skipped"]) == (10, 2)
+
+    records = [json.loads(line) for line in output.read_text().splitlines()[3:]]
+    assert len(records) == 10
+    assert cut_file in {record["file"] for record in records}
+
+
+def test_parquet_parts_and_resume(transcripts, tmp_path, monkeypatch):
+    output = str(tmp_path / "leads.parquet")
+    monkeypatch.setattr(qualify, "open_writer", lambda path: ParquetWriter(path, part_size=4))
+    qualify_all(StubQualifier(), str(transcripts), output, concurrency=3, limit=6)
+    assert len(ParquetWriter(output)._parts()) == 2
+
+    counts = qualify_all(StubQualifier(), str(transcripts), output, concurrency=3)
+    assert (counts["qualified"], counts["skipped"]) == (6, 6)
+    table = ds.dataset(output, format="parquet").to_table()
+    assert table.num_rows == 12
+    assert len(set(table["file"].to_pylist())) == 12
+    assert ParquetWriter(output).finished() == set(table["file"].to_pylist())
+
+
+class ShedTwice(StubQualifier):
+    """Shed by the quota scheduler on the first two attempts"""
+
+    def __init__(self):
+        self.attempts = 0
+
+    def generate(self, transcript):
+        self.attempts += 1
+        if self.attempts <= 2:
+            raise QuotaExceeded("shed")
+        return super().generate(transcript)
+
+
+def test_shed_requests_are_retried(transcripts, monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(qualify.time, "sleep", sleeps.append)
+    client = ShedTwice()
+    record = qualify_transcript(client, str(transcripts / "gong_transcript_1.txt"))
+    assert client.attempts == 3
+    assert len(sleeps) == 2
+    assert record["email"] == "buyer1@example.com"
+
+
+def test_gives_up_after_max_attempts(transcripts, monkeypatch):
+    monkeypatch.setattr(qualify.time, "sleep", lambda seconds: None)
+    monkeypatch.setattr(qualify, "QUALIFY_MAX_ATTEMPTS", 2)
+    with pytest.raises(QuotaExceeded):
+        qualify_transcript(ShedTwice(), str(transcripts / "gong_transcript_1.txt"))
@@ -0,0 +1,21 @@
+import pytest
+
+from shared_backend import scheduler
+from shared_backend.scheduler import requests_per_minute
+
+
+def test_default_rates_per_model(monkeypatch):
+    monkeypatch.setattr(scheduler, "GEMINI_REQUESTS_PER_MINUTE", None)
+    monkeypatch.setattr(scheduler, "GEMINI_MODEL_REQUESTS_PER_MINUTE", {})
+    assert requests_per_minute("gemini-2.5-pro") == 150
+    assert requests_per_minute("gemini-2.5-flash") == 1000
+    with pytest.raises(ValueError, match="GEMINI_MODEL_REQUESTS_PER_MINUTE"):
+        requests_per_minute("gemini-experimental")
+
+
+def test_configured_rates_take_precedence(monkeypatch):
+    monkeypatch.setattr(scheduler, "GEMINI_REQUESTS_PER_MINUTE", 300.0)
+    monkeypatch.setattr(scheduler, "GEMINI_MODEL_REQUESTS_PER_MINUTE", {"gemini-2.5-flash": 2000.0})
+    assert requests_per_minute("gemini-2.5-flash") == 2000
+    assert requests_per_minute("gemini-2.5-pro") == 300
+    assert requests_per_minute("gemini-experimental") == 300